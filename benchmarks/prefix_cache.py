@@ -0,0 +1,55 @@
+"""比较两种prompt布局下，带前缀缓存的模型服务能复用多少prompt token
+
+    python -m benchmarks.prefix_cache --requests 50
+"""
+import argparse
+
+from pydantic import BaseModel, Field
+
+from tudi import Agent
+from tudi.testing import PrefixCachingChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str = Field(description="Name of the city")
+    degree: int = Field(description="Temperature in degrees Celsius")
+    humidity: int = Field(description="Relative humidity in percent")
+    wind: str = Field(description="Wind direction and strength, e.g. 'north 3 m/s'")
+    summary: str = Field(description="One sentence describing the weather for a traveller")
+
+
+RESPONSE = '{"city": "somewhere", "degree": 20, "humidity": 40, "wind": "north 3 m/s", "summary": "fine"}'
+
+
+def run(requests: int, layout: str) -> PrefixCachingChatModel:
+    model = PrefixCachingChatModel(responses=[RESPONSE])
+    agent = Agent(
+        name="weather_agent",
+        model=model,
+        prompt_template="Report today's weather of {arg.city}.",
+        input_type=WeatherQuery,
+        output_type=WeatherReport,
+        prompt_layout=layout
+    )
+    for i in range(requests):
+        agent.run(WeatherQuery(city=f"city-{i}"))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'layout':>14} {'prompt':>8} {'reused':>8} {'rate':>7}")
+    for layout in ("inline", "prefix_stable"):
+        model = run(args.requests, layout)
+        print(f"{layout:>14} {model.prompt_tokens:>8} {model.reused_tokens:>8} {model.reuse_rate:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
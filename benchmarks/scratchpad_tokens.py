@@ -0,0 +1,55 @@
+"""比较ReAct循环中每轮prompt的token数：默认scratchpad vs 有界scratchpad
+
+    python -m benchmarks.scratchpad_tokens --iterations 8 --observation-words 400
+"""
+import argparse
+
+from langchain_core.tools import tool
+
+from tudi import Agent
+from tudi.scratchpad import Scratchpad
+from tudi.testing import FakeChatModel, count_tokens
+
+ACTION = '''Thought: I need to search again
+Action:
+```
+{{"action": "search", "action_input": "query {index}"}}
+```'''
+
+FINAL = "Thought: I now know the final answer\nFinal Answer: done"
+
+
+def run(iterations: int, observation_words: int, scratchpad) -> list[int]:
+    @tool
+    def search(query: str) -> str:
+        """Searches the knowledge base"""
+        return " ".join(f"{query}-result-{i}" for i in range(observation_words))
+
+    responses = [ACTION.format(index=i) for i in range(iterations)] + [FINAL]
+    model = FakeChatModel(responses=responses)
+    agent = Agent(name="bench", model=model, tools=[search], scratchpad=scratchpad)
+    agent._runnable.verbose = False
+    agent.run("Find everything about tudi")
+    return [count_tokens(prompt) for prompt in model.prompts]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=8)
+    parser.add_argument("--observation-words", type=int, default=400)
+    parser.add_argument("--max-observation-chars", type=int, default=500)
+    parser.add_argument("--window", type=int, default=2)
+    args = parser.parse_args()
+
+    before = run(args.iterations, args.observation_words, None)
+    after = run(args.iterations, args.observation_words,
+                Scratchpad(max_observation_chars=args.max_observation_chars, window=args.window))
+
+    print(f"{'iteration':>9} {'default':>10} {'bounded':>10}")
+    for i, (default_tokens, bounded_tokens) in enumerate(zip(before, after, strict=True)):
+        print(f"{i:>9} {default_tokens:>10} {bounded_tokens:>10}")
+    print(f"{'total':>9} {sum(before):>10} {sum(after):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.batching import MicroBatching
+from tudi.testing import FakeChatModel
+
+
+class Question(BaseModel):
+    number: int
+
+
+class Answer(BaseModel):
+    value: int
+
+
+class BatchRecordingModel(FakeChatModel):
+    batch_sizes: list = []
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        self.batch_sizes.append(len(inputs))
+        return super().batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+
+def double(prompt: str) -> str:
+    number = int(prompt.split("Double ")[1].split()[0])
+    return f'{{"value": {number * 2}}}'
+
+
+def create_agent(model, max_batch_size=8, max_wait=0.2) -> Agent:
+    return Agent(
+        name="double agent",
+        model=model,
+        prompt_template="Double {arg.number}",
+        input_type=Question,
+        output_type=Answer,
+        micro_batching=MicroBatching(max_batch_size=max_batch_size, max_wait=max_wait)
+    )
+
+
+class TestAgentBatching:
+    def test_coalesce_concurrent_runs(self):
+        model = BatchRecordingModel(respond=double, batch_sizes=[])
+        agent = create_agent(model, max_batch_size=4, max_wait=1)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(agent.run, [Question(number=i) for i in range(4)]))
+
+        assert [result.value for result in results] == [0, 2, 4, 6]
+        assert model.batch_sizes == [4]
+
+    def test_flush_after_max_wait(self):
+        model = BatchRecordingModel(respond=double, batch_sizes=[])
+        agent = create_agent(model, max_batch_size=8, max_wait=0.05)
+
+        result = agent.run(Question(number=21))
+
+        assert result.value == 42
+        assert model.batch_sizes == [1]
+
+    def test_coalesce_concurrent_aruns(self):
+        model = BatchRecordingModel(respond=double, batch_sizes=[])
+        agent = create_agent(model, max_batch_size=3, max_wait=1)
+
+        async def main():
+            return await asyncio.gather(*[agent.arun(Question(number=i)) for i in range(3)])
+
+        results = asyncio.run(main())
+
+        assert [result.value for result in results] == [0, 2, 4]
+        assert model.batch_sizes == [3]
+
+    def test_parse_failure_only_affects_its_caller(self):
+        model = BatchRecordingModel(respond=lambda prompt: "oops" if "Double 1" in prompt else double(prompt),
+                                    batch_sizes=[])
+        agent = create_agent(model, max_batch_size=2, max_wait=1)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ok = executor.submit(agent.run, Question(number=2))
+            failed = executor.submit(agent.run, Question(number=1))
+
+            assert ok.result().value == 4
+            with pytest.raises(Exception, match="oops"):
+                failed.result()
+
+    def test_reject_micro_batching_with_tools(self):
+        from langchain_core.tools import tool
+
+        @tool
+        def noop(text: str) -> str:
+            """Does nothing"""
+            return text
+
+        with pytest.raises(ValueError, match="micro_batching"):
+            Agent(name="agent", model=FakeChatModel(), tools=[noop], micro_batching=MicroBatching())
+
+    def test_full_batch_does_not_block_event_loop(self):
+        model = BatchRecordingModel(respond=double, batch_sizes=[], latency=0.5)
+        agent = create_agent(model, max_batch_size=2, max_wait=1)
+
+        async def main():
+            stalls = []
+
+            async def ticker():
+                for _ in range(10):
+                    started = asyncio.get_running_loop().time()
+                    await asyncio.sleep(0.02)
+                    stalls.append(asyncio.get_running_loop().time() - started)
+
+            results = await asyncio.gather(ticker(), agent.arun(Question(number=1)), agent.arun(Question(number=2)))
+            return results[1:], max(stalls)
+
+        results, stall = asyncio.run(main())
+
+        assert [result.value for result in results] == [2, 4]
+        assert stall < 0.2
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+import pytest
+from langchain_core.tools import tool
+
+from tudi import Agent
+from tudi.budget import AgentBudget
+from tudi.testing import FakeChatModel
+
+
+def action(city: str) -> str:
+    return f'''Thought: I need the weather
+Action:
+```
+{{"action": "get_weather", "action_input": "{city}"}}
+```'''
+
+
+FINAL = "Thought: I now know the final answer\nFinal Answer: 24°C"
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Gets the weather for a given city"""
+    return f"the weather of {city} is 24°C"
+
+
+def create_agent(responses: list[str], budget: AgentBudget) -> tuple[Agent, FakeChatModel]:
+    model = FakeChatModel(responses=responses)
+    return Agent(name="weather agent", model=model, tools=[get_weather], budget=budget), model
+
+
+class TestAgentBudget:
+    def test_report_finished_run(self):
+        agent, _ = create_agent([action("beijing"), FINAL], AgentBudget())
+
+        result = agent.run("What is the weather in Beijing?")
+
+        assert result == "24°C"
+        metadata = agent.last_run_metadata
+        assert metadata["stop_reason"] == "finished"
+        assert metadata["iterations"] == 1
+        assert metadata["model_calls"] == 2
+        assert metadata["total_tokens"] > 0
+
+    def test_stop_at_max_iterations(self):
+        agent, model = create_agent([action(f"city{i}") for i in range(10)], AgentBudget(max_iterations=3))
+
+        agent.run("What is the weather?")
+
+        assert model.calls == 3
+        assert agent.last_run_metadata["stop_reason"] == "max_iterations"
+
+    def test_break_repeated_actions(self):
+        agent, model = create_agent([action("beijing")], AgentBudget(max_repeated_actions=2))
+
+        agent.run("What is the weather in Beijing?")
+
+        assert model.calls == 2
+        assert agent.last_run_metadata["stop_reason"] == "repeated_action"
+
+    def test_stop_at_token_budget(self):
+        agent, model = create_agent([action(f"city{i}") for i in range(10)], AgentBudget(max_total_tokens=1))
+
+        agent.run("What is the weather?")
+
+        assert model.calls == 1
+        assert agent.last_run_metadata["stop_reason"] == "max_total_tokens"
+
+    def test_generate_final_answer_when_stopped(self):
+        agent, model = create_agent([action("beijing"), action("beijing"), "Final Answer: 24°C in Beijing"],
+                                    AgentBudget(max_repeated_actions=2, early_stopping_method="generate"))
+
+        result = agent.run("What is the weather in Beijing?")
+
+        assert result == "24°C in Beijing"
+        assert model.calls == 3
+        assert "I must stop using tools now" in model.prompts[-1]
+        assert agent.last_run_metadata["stop_reason"] == "repeated_action"
+
+    def test_generate_final_answer_async(self):
+        responses = iter([action("beijing"), action("beijing"), "Final Answer: 24°C in Beijing"])
+        threads = []
+
+        def respond(prompt: str) -> str:
+            threads.append(threading.current_thread())
+            return next(responses)
+
+        model = FakeChatModel(respond=respond)
+        agent = Agent(name="weather agent", model=model, tools=[get_weather],
+                      budget=AgentBudget(max_repeated_actions=2, early_stopping_method="generate"))
+
+        async def main():
+            return await agent.arun("What is the weather in Beijing?"), agent.last_run_metadata
+
+        result, metadata = asyncio.run(main())
+
+        assert result == "24°C in Beijing"
+        assert metadata["stop_reason"] == "repeated_action"
+        # 包括生成最终答案在内，模型调用都不在事件循环的线程中执行
+        assert len(threads) == 3
+        assert threading.main_thread() not in threads
+
+    def test_force_stop_message_when_stopped(self):
+        agent, _ = create_agent([action("beijing")], AgentBudget(max_iterations=1))
+
+        result = agent.run("What is the weather in Beijing?")
+
+        assert "stopped" in result
+
+    def test_reject_invalid_early_stopping_method(self):
+        with pytest.raises(ValueError, match="early_stopping_method"):
+            AgentBudget(early_stopping_method="guess")
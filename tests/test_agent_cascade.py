@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+from tudi import Agent, metrics
+from tudi.cascade import ModelCascade
+from tudi.testing import FakeChatModel
+
+
+class Question(BaseModel):
+    text: str
+
+
+class Answer(BaseModel):
+    answer: str
+    confidence: float = 1.0
+
+
+def create_agent(model: FakeChatModel, cascade: ModelCascade) -> Agent:
+    return Agent(
+        name="answerer",
+        model=model,
+        prompt_template="Answer the question: {arg.text}",
+        input_type=Question,
+        output_type=Answer,
+        cascade=cascade
+    )
+
+
+class TestModelCascade:
+    def test_accept_cheap_tier(self):
+        small = FakeChatModel(responses=['{"answer": "4"}'])
+        large = FakeChatModel(responses=['{"answer": "four"}'])
+        agent = create_agent(large, ModelCascade([small]))
+
+        assert agent.run(Question(text="2+2")).answer == "4"
+        assert agent.last_run_metadata == {"cascade_tier": 0}
+        assert large.calls == 0
+
+    def test_escalate_on_parse_failure(self):
+        small = FakeChatModel(responses=["I don't know"])
+        medium = FakeChatModel(responses=["still no json"])
+        large = FakeChatModel(responses=['{"answer": "4"}'])
+        cascade = ModelCascade([small, medium])
+
+        assert create_agent(large, cascade).run(Question(text="2+2")).answer == "4"
+        stats = [(s.attempts, s.parse_failures, s.accepted) for s in cascade.stats()]
+        assert stats == [(1, 1, 0), (1, 1, 0), (1, 0, 1)]
+
+    def test_escalate_on_failed_validation(self):
+        small = FakeChatModel(responses=['{"answer": "5", "confidence": 0.3}'])
+        large = FakeChatModel(responses=['{"answer": "4", "confidence": 0.9}'])
+        cascade = ModelCascade([small], validator=lambda answer: answer.confidence >= 0.8)
+        agent = create_agent(large, cascade)
+
+        assert agent.run(Question(text="2+2")).answer == "4"
+        assert agent.last_run_metadata == {"cascade_tier": 1}
+        assert cascade.stats()[0].rejected == 1
+        assert cascade.stats()[1].acceptance_rate == 1.0
+
+    def test_escalate_on_low_confidence(self):
+        small = FakeChatModel(responses=['{"answer": "5"}'])
+        large = FakeChatModel(responses=['{"answer": "4"}'])
+        cascade = ModelCascade([small], confidence=lambda message: 0.2, min_confidence=0.5)
+
+        assert create_agent(large, cascade).run(Question(text="2+2")).answer == "4"
+
+    def test_raise_when_last_tier_fails(self):
+        cascade = ModelCascade([FakeChatModel(responses=["no"])])
+
+        with pytest.raises(OutputParserException):
+            create_agent(FakeChatModel(responses=["no"]), cascade).run(Question(text="2+2"))
+
+    def test_async_and_metrics(self):
+        metrics.registry.reset()
+        metrics.registry.enable()
+        try:
+            small = FakeChatModel(responses=['{"answer": "4"}', "oops"])
+            large = FakeChatModel(responses=['{"answer": "4"}'])
+            agent = create_agent(large, ModelCascade([small]))
+
+            asyncio.run(agent.arun(Question(text="2+2")))
+            asyncio.run(agent.arun(Question(text="3+1")))
+            text = metrics.registry.render_prometheus()
+        finally:
+            metrics.registry.disable()
+
+        assert 'tudi_cascade_attempts_total{agent="answerer",outcome="accepted",tier="0:FakeChatModel"} 1' in text
+        assert 'tudi_cascade_attempts_total{agent="answerer",outcome="parse_failure",tier="0:FakeChatModel"} 1' in text
+        assert 'tudi_cascade_attempts_total{agent="answerer",outcome="accepted",tier="1:FakeChatModel"} 1' in text
+
+    def test_reject_with_tools(self):
+        with pytest.raises(ValueError, match="cascade"):
+            Agent(name="a", model=FakeChatModel(), tools=[lambda: None],
+                  cascade=ModelCascade([FakeChatModel()]))
@@ -0,0 +1,89 @@
+import pytest
+from langchain_core.tools import tool
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.testing import FakeChatModel, PrefixCachingChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class RecordingModel(FakeChatModel):
+    def _as_prompt(self, messages):
+        self.__dict__.setdefault("messages", []).append([(m.type, m.content) for m in messages])
+        return super()._as_prompt(messages)
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Get the weather of a city"""
+    return "24"
+
+
+def weather_agent(model: FakeChatModel, layout: str, **kwargs) -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=model,
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport,
+        prompt_layout=layout,
+        **kwargs
+    )
+
+
+class TestPromptLayout:
+    def test_put_format_instructions_in_system_message(self):
+        model = RecordingModel(responses=['{"city": "beijing", "degree": 24}'])
+        agent = weather_agent(model, "prefix_stable")
+
+        assert agent.run(WeatherQuery(city="beijing")).degree == 24
+        agent.run(WeatherQuery(city="harbin"))
+
+        first, second = model.messages
+        assert [role for role, _ in first] == ["system", "human"]
+        assert "JSON schema" in first[0][1]
+        assert first[0] == second[0]
+        assert second[1] == ("human", "Report the weather of harbin")
+
+    def test_inline_layout_is_unchanged(self):
+        model = RecordingModel(responses=['{"city": "beijing", "degree": 24}'])
+
+        weather_agent(model, "inline").run(WeatherQuery(city="beijing"))
+
+        [(role, content)] = model.messages[0]
+        assert role == "human"
+        assert content.startswith("Report the weather of beijing\n")
+
+    def test_result_template_of_tool_agent(self):
+        model = RecordingModel(responses=[
+            "Thought: I now know the final answer\nFinal Answer: 24 degrees in beijing",
+            '{"city": "beijing", "degree": 24}',
+        ])
+
+        weather_agent(model, "prefix_stable", tools=[get_weather]).run(WeatherQuery(city="beijing"))
+
+        result_messages = model.messages[1]
+        assert [role for role, _ in result_messages] == ["system", "human"]
+        assert result_messages[1][1] == "The Final Answer: ```24 degrees in beijing```"
+
+    def test_reuse_prefix_cache(self):
+        inline = PrefixCachingChatModel(responses=['{"city": "x", "degree": 1}'])
+        stable = PrefixCachingChatModel(responses=['{"city": "x", "degree": 1}'])
+        for city in ["beijing", "harbin", "xian"]:
+            weather_agent(inline, "inline").run(WeatherQuery(city=city))
+            weather_agent(stable, "prefix_stable").run(WeatherQuery(city=city))
+
+        assert stable.reuse_rate > 0.6
+        assert inline.reuse_rate < 0.1
+
+    def test_reject_unknown_layout(self):
+        with pytest.raises(ValueError, match="prompt_layout"):
+            weather_agent(FakeChatModel(), "suffix")
@@ -0,0 +1,69 @@
+import pytest
+from langchain_core.agents import AgentAction
+from langchain_core.tools import tool
+
+from tudi import Agent
+from tudi.scratchpad import Scratchpad
+from tudi.testing import FakeChatModel
+
+ACTION = '''Thought: I need to look up the weather
+Action:
+```
+{"action": "get_weather", "action_input": "beijing"}
+```'''
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Gets the weather for a given city"""
+    return "sunny " * 500
+
+
+def step(index: int, observation: str) -> tuple[AgentAction, str]:
+    return AgentAction(tool="get_weather", tool_input=f"city{index}", log=f"Action {index}"), observation
+
+
+class TestScratchpad:
+    def test_truncate_long_observation(self):
+        scratchpad = Scratchpad(max_observation_chars=10)
+
+        text = scratchpad.format([step(0, "x" * 25)])
+
+        assert "x" * 10 + "... [truncated 15 chars]" in text
+        assert "x" * 11 not in text
+
+    def test_summarize_steps_outside_window(self):
+        scratchpad = Scratchpad(window=1)
+
+        text = scratchpad.format([step(0, "cloudy"), step(1, "rainy"), step(2, "sunny")])
+
+        assert "Earlier steps (2, summarized):" in text
+        assert "- get_weather(city0) -> cloudy" in text
+        assert "Action 0" not in text
+        assert text.endswith("Action 2\nObservation: sunny\nThought: ")
+
+    def test_custom_summarizer(self):
+        scratchpad = Scratchpad(window=1, summarizer=lambda steps: f"{len(steps)} steps done")
+
+        text = scratchpad.format([step(0, "cloudy"), step(1, "sunny")])
+
+        assert text.startswith("1 steps done\n")
+
+    def test_agent_prompt_uses_bounded_scratchpad(self):
+        model = FakeChatModel(responses=[ACTION, "Thought: I now know the final answer\nFinal Answer: sunny"])
+        agent = Agent(
+            name="weather agent",
+            model=model,
+            tools=[get_weather],
+            scratchpad=Scratchpad(max_observation_chars=50)
+        )
+
+        result = agent.run("What is the weather in Beijing?")
+
+        assert result == "sunny"
+        assert "[truncated" in model.prompts[1]
+        assert len(model.prompts[1]) < len(model.prompts[0]) + 400
+
+    def test_reject_scratchpad_without_tools(self):
+        with pytest.raises(ValueError, match="scratchpad"):
+            Agent(name="agent", model=FakeChatModel(), scratchpad=Scratchpad())
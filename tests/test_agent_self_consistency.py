@@ -0,0 +1,125 @@
+import asyncio
+import itertools
+import json
+import time
+from typing import List
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.tools import tool
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.consistency import SelfConsistency
+from tudi.testing import FakeChatModel
+
+
+class Ticket(BaseModel):
+    text: str
+
+
+class Label(BaseModel):
+    label: str
+    confidence: float = 1.0
+
+
+def voting_model(answers: List[str], delays: List[float]) -> FakeChatModel:
+    """第i次调用等待delays[i]秒后返回answers[i]"""
+    counter = itertools.count()
+
+    def respond(prompt: str) -> str:
+        index = next(counter)
+        time.sleep(delays[index])
+        return answers[index]
+
+    return FakeChatModel(respond=respond)
+
+
+def label(name: str, confidence: float = 1.0) -> str:
+    return json.dumps({"label": name, "confidence": confidence})
+
+
+def classifier(model: FakeChatModel, config: SelfConsistency) -> Agent:
+    return Agent(
+        name="classifier",
+        model=model,
+        prompt_template="Classify the ticket: {arg.text}",
+        input_type=Ticket,
+        output_type=Label,
+        self_consistency=config
+    )
+
+
+class TestSelfConsistency:
+    def test_returns_when_enough_samples_agree(self):
+        model = voting_model([label("spam"), label("ham"), label("spam"), label("spam"), label("ham")],
+                             [0.05, 0.1, 0.15, 0.2, 2.0])
+        agent = classifier(model, SelfConsistency(samples=5, agree=3))
+
+        started = time.monotonic()
+        assert agent.run(Ticket(text="WIN A PRIZE")) == Label(label="spam")
+        # 并发采样，不等待最慢的一个
+        assert time.monotonic() - started < 1
+        assert model.calls == 5
+        assert agent.last_run_metadata == {"samples_completed": 4, "votes": 3, "agreement": 0.75, "agreed": True}
+
+    def test_plurality_without_agreement(self):
+        model = voting_model([label("spam"), label("ham"), label("spam")], [0, 0.05, 0.1])
+        agent = classifier(model, SelfConsistency(samples=3, agree=3))
+
+        assert agent.run(Ticket(text="hello")).label == "spam"
+        metadata = agent.last_run_metadata
+        assert (metadata["agreed"], metadata["votes"], metadata["samples_completed"]) == (False, 2, 3)
+        assert metadata["agreement"] == pytest.approx(2 / 3)
+
+    def test_custom_key(self):
+        answers = [label("spam", 0.9), label("spam", 0.8), label("ham", 0.7)]
+        model = voting_model(answers, [0, 0.05, 0.1])
+
+        field_wise = classifier(model, SelfConsistency(samples=3, agree=2))
+        assert field_wise.run(Ticket(text="hi")).label == "spam"
+        assert field_wise.last_run_metadata["agreed"] is False
+
+        model = voting_model(answers, [0, 0.05, 0.1])
+        by_label = classifier(model, SelfConsistency(samples=3, agree=2, key=lambda result: result.label))
+        assert by_label.run(Ticket(text="hi")) == Label(label="spam", confidence=0.9)
+        assert by_label.last_run_metadata["agreed"] is True
+
+    def test_parse_failures_do_not_vote(self):
+        model = voting_model(["not json", label("ham"), label("ham")], [0, 0.05, 0.1])
+        agent = classifier(model, SelfConsistency(samples=3, agree=2))
+
+        assert agent.run(Ticket(text="hi")).label == "ham"
+        assert agent.last_run_metadata == {"samples_completed": 3, "votes": 2, "agreement": 1.0, "agreed": True}
+
+        agent = classifier(FakeChatModel(responses=["not json"]), SelfConsistency(samples=3, agree=2))
+        with pytest.raises(OutputParserException):
+            agent.run(Ticket(text="hi"))
+
+    def test_async_cancels_remaining_samples(self):
+        model = voting_model([label("spam"), label("spam"), label("ham")], [0.05, 0.05, 2.0])
+        agent = classifier(model, SelfConsistency(samples=3, agree=2))
+
+        async def main():
+            started = time.monotonic()
+            result = await agent.arun(Ticket(text="WIN A PRIZE"))
+            return result, time.monotonic() - started, agent.last_run_metadata
+
+        result, elapsed, metadata = asyncio.run(main())
+        assert result.label == "spam"
+        assert elapsed < 1
+        assert metadata["agreed"] is True
+
+    def test_validation(self):
+        with pytest.raises(ValueError):
+            SelfConsistency(samples=3, agree=4)
+        with pytest.raises(ValueError):
+            SelfConsistency(samples=0)
+
+        @tool
+        def lookup(text: str) -> str:
+            """Looks up a ticket"""
+            return text
+
+        with pytest.raises(ValueError):
+            Agent(name="agent", model=FakeChatModel(), tools=[lookup], self_consistency=SelfConsistency())
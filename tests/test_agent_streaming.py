@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from langchain_core.tools import tool
+from langchain_core.utils.json import parse_partial_json
+from pydantic import BaseModel
+
+from tudi import Agent, Flow
+from tudi.runlog import RunLog
+from tudi.step_cache import StepCache
+from tudi.streaming import IncrementalJsonParser
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+    summary: str
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Get the weather of a city"""
+    return "sunny"
+
+
+REPORT = '<think>{"city": "guess"}</think>{"city": "beijing", "degree": 24, "summary": "sunny and warm"}'
+
+
+def weather_agent() -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=FakeChatModel(responses=[REPORT]),
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+
+
+class TestStreaming:
+    def test_incremental_json_parser(self):
+        parser = IncrementalJsonParser(WeatherReport)
+
+        assert parser.feed('<think>{"city": "x"') is None
+        assert parser.feed('</think>{"city": "bei').completed == ()
+        partial = parser.feed('jing", "degree": 2')
+        assert partial.value.city == "beijing"
+        assert partial.completed == ("city",)
+        partial = parser.feed('4, "summary": "a, b"}')
+        assert partial.completed == ("city", "degree", "summary")
+        assert partial.data == {"city": "beijing", "degree": 24, "summary": "a, b"}
+
+    def test_stream_partial_models(self):
+        outputs = list(weather_agent().stream(WeatherQuery(city="beijing")))
+
+        assert all(not output.final for output in outputs[:-1])
+        assert outputs[0].data == {}
+        assert any(output.completed == ("city",) for output in outputs)
+        assert outputs[-1].final
+        assert outputs[-1].value == WeatherReport(city="beijing", degree=24, summary="sunny and warm")
+
+    def test_astream(self):
+        async def collect():
+            return [output async for output in weather_agent().astream(WeatherQuery(city="beijing"))]
+
+        outputs = asyncio.run(collect())
+
+        assert outputs[-1].value.degree == 24
+        assert len(outputs) > 2
+
+    def test_stream_text(self):
+        agent = Agent(name="echo", model=FakeChatModel(responses=["<think>hmm</think> hello world"]))
+
+        outputs = list(agent.stream("hi"))
+
+        assert [output.value for output in outputs] == ["hello ", "hello world", "hello world"]
+        assert outputs[-1].final
+
+    def test_stream_last_step_of_flow(self):
+        echo = Agent(name="echo", model=FakeChatModel(responses=['{"city": "beijing"}']), output_type=WeatherQuery)
+        flow = Flow.start(echo).next(weather_agent())
+
+        outputs = list(flow.stream("where"))
+
+        assert outputs[-1].value.summary == "sunny and warm"
+        assert len(outputs) > 2
+
+    def test_flow_falls_back_for_unstreamable_last_step(self, tmp_path):
+        echo = Agent(name="echo", model=FakeChatModel(responses=['{"city": "beijing"}']), output_type=WeatherQuery)
+        tools = Agent(name="tools", model=FakeChatModel(responses=["Final Answer: sunny"]), tools=[get_weather],
+                      prompt_template="What is the weather of {arg.city}?", input_type=WeatherQuery)
+
+        with RunLog(str(tmp_path / "runs.log")) as run_log:
+            flow = Flow.start(echo, name="weather", run_log=run_log).next(tools)
+            outputs = list(flow.stream("where"))
+            assert run_log.flush(timeout=5)
+            kinds = [event["kind"] for event in run_log.query(flow="weather")]
+
+        assert [(output.value, output.final) for output in outputs] == [("sunny", True)]
+        assert kinds == ["run_start", "step", "step", "run_end"]
+
+    def test_flow_stream_uses_step_cache(self):
+        echo = Agent(name="echo", model=FakeChatModel(responses=['{"city": "beijing"}']), output_type=WeatherQuery)
+        weather = weather_agent()
+        flow = Flow.start(echo, step_cache=StepCache()).next(weather)
+
+        list(flow.stream("where"))
+        outputs = list(flow.stream("where"))
+
+        assert [output.final for output in outputs] == [True]
+        assert outputs[0].value.degree == 24
+        assert (echo.model.calls, weather.model.calls) == (1, 1)
+
+    def test_parser_work_is_linear(self, monkeypatch):
+        import tudi.streaming
+        parsed = []
+        monkeypatch.setattr(tudi.streaming, "parse_partial_json",
+                            lambda text: parsed.append(text) or parse_partial_json(text))
+        parser = IncrementalJsonParser(WeatherReport)
+
+        parser.feed('{"city": "beijing", "degree": 24, "summary": "')
+        for _ in range(1000):
+            parser.feed("sunny ")
+        partial = parser.feed('"}')
+
+        # 字符串还在生成时不重新解析
+        assert len(parsed) == 2
+        assert partial.completed == ("city", "degree", "summary")
+
+    def test_thinking_tag_split_across_chunks(self):
+        parser = IncrementalJsonParser(WeatherReport)
+
+        chunks = ["<thi", 'nk>{"city": "x"}</th', 'ink>{"city": "beijing", ', '"degree": 24}']
+        partials = [partial for partial in map(parser.feed, chunks) if partial is not None]
+
+        assert partials[0].data == {"city": "beijing"}
+        assert partials[-1].data == {"city": "beijing", "degree": 24}
+
+    def test_reject_tool_agents(self):
+        agent = Agent(name="tools", model=FakeChatModel(), tools=[get_weather])
+
+        with pytest.raises(ValueError, match="stream"):
+            list(agent.stream("hi"))
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.templates import TemplateInputs, analyze
+from tudi.testing import FakeChatModel
+
+
+class Document(BaseModel):
+    title: str
+    body: str
+
+
+class Request(BaseModel):
+    city: str
+    document: Document
+    history: list[str]
+
+
+def create_request() -> Request:
+    return Request(city="beijing", document=Document(title="Weather", body="x" * 10_000),
+                   history=["sunny", "rainy"])
+
+
+class TestTemplateInputs:
+    def test_analyze_referenced_fields(self):
+        assert analyze("{arg.city} {arg.document[title]}") == {"city": True, "document": {"title": True}}
+        assert analyze("{arg.history[0]} {arg.document[title]} {arg.document}") == {
+            "history": True, "document": True}
+        assert analyze("{arg} {arg.city}") is None
+        assert analyze("{input}") == {}
+
+    def test_extract_only_referenced_fields(self):
+        values = TemplateInputs("{arg.city} {arg.document[title]}").extract(create_request())
+
+        assert values == SimpleNamespace(city="beijing", document={"title": "Weather"})
+
+    def test_render_same_prompt_as_full_dump(self):
+        template = "{arg.city}: {arg.document[title]} {arg.history[1]} {arg.history}"
+        request = create_request()
+
+        rendered = template.format(arg=TemplateInputs(template).extract(request))
+
+        assert rendered == template.format(arg=SimpleNamespace(**request.model_dump()))
+
+    def test_truncate_oversized_fields(self):
+        inputs = TemplateInputs("{arg.document[body]} {arg.history}", max_field_chars={"document": 10, "history": 8})
+        values = inputs.extract(create_request())
+
+        assert values.document["body"] == "xxxxxxxxxx... [truncated 9990 chars]"
+        assert values.history == "['sunny'... [truncated 10 chars]"
+
+    def test_agent_renders_referenced_fields(self):
+        model = FakeChatModel(responses=["ok"])
+        agent = Agent(name="summarizer", model=model, prompt_template="Summarize {arg.document[body]}",
+                      input_type=Request, max_field_chars={"document": 1000})
+
+        agent.run(create_request())
+
+        assert model.prompts[0].strip() == "Summarize " + "x" * 1000 + "... [truncated 9000 chars]"
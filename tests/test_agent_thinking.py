@@ -0,0 +1,86 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.testing import FakeChatModel
+from tudi.thinking import ThinkingBudget, ThinkTracker
+
+
+class Question(BaseModel):
+    text: str
+
+
+class Answer(BaseModel):
+    answer: str
+
+
+LONG_THINKING = "<think>" + "hmm " * 100 + "</think>" + '{"answer": "too late"}'
+
+
+def answer_after_prefill(prompt: str) -> str:
+    if "</think>" in prompt:
+        return '{"answer": "42"}'
+    return LONG_THINKING
+
+
+def create_agent(model: FakeChatModel, budget: ThinkingBudget) -> Agent:
+    return Agent(
+        name="thinker",
+        model=model,
+        prompt_template="Answer the question: {arg.text}",
+        input_type=Question,
+        output_type=Answer,
+        thinking_budget=budget
+    )
+
+
+class TestThinkingBudget:
+    def test_stop_thinking_over_budget(self):
+        model = FakeChatModel(respond=answer_after_prefill)
+        agent = create_agent(model, ThinkingBudget(max_tokens=10))
+
+        result = agent.run(Question(text="What is the answer?"))
+
+        assert result == Answer(answer="42")
+        assert model.calls == 2
+        assert "</think>" in model.prompts[1]
+        assert agent.last_run_metadata == {"thinking_tokens": 10, "answer_tokens": 2, "thinking_truncated": True}
+
+    def test_keep_thinking_within_budget(self):
+        model = FakeChatModel(responses=["<think>short</think>" + '{"answer": "42"}'])
+        agent = create_agent(model, ThinkingBudget(max_tokens=10))
+
+        result = agent.run(Question(text="What is the answer?"))
+
+        assert result == Answer(answer="42")
+        assert model.calls == 1
+        assert agent.last_run_metadata["thinking_truncated"] is False
+        assert agent.last_run_metadata["thinking_tokens"] == 1
+
+    def test_no_think_switch(self):
+        model = FakeChatModel(responses=['{"answer": "42"}'])
+        agent = create_agent(model, ThinkingBudget(max_tokens=0))
+
+        agent.run(Question(text="What is the answer?"))
+
+        assert model.prompts[0].endswith("/no_think")
+        assert agent.last_run_metadata["thinking_tokens"] == 0
+
+    def test_stop_thinking_in_arun(self):
+        model = FakeChatModel(respond=answer_after_prefill)
+        agent = create_agent(model, ThinkingBudget(max_tokens=5))
+
+        result = asyncio.run(agent.arun(Question(text="What is the answer?")))
+
+        assert result == Answer(answer="42")
+        assert model.calls == 2
+
+    def test_track_think_tags_split_across_chunks(self):
+        tracker = ThinkTracker()
+        for chunk in ["<think>", "a ", "b", "</th", "ink>", "answer"]:
+            tracker.feed(chunk)
+
+        assert tracker.inside is False
+        assert tracker.thinking_tokens == 5
+        assert tracker.answer_tokens == 1
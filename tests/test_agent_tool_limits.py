@@ -0,0 +1,190 @@
+import asyncio
+import json
+import re
+import threading
+import time
+
+import pytest
+from langchain_core.tools import tool
+
+from tudi import Agent
+from tudi.testing import FakeChatModel
+from tudi.tool_limits import ToolLimits, ToolTimeoutError, limit_tool, tool_limits
+
+RELEASE = threading.Event()
+
+
+@tool
+def slow_lookup(city: str) -> str:
+    """Looks up the weather of a city, slowly"""
+    RELEASE.wait(2)
+    return f"the weather of {city} is 24°C"
+
+
+@tool
+async def async_lookup(city: str) -> str:
+    """Looks up the weather of a city"""
+    await asyncio.sleep(0)
+    return f"the weather of {city} is 35°C"
+
+
+@tool
+async def async_slow_lookup(city: str) -> str:
+    """Looks up the weather of a city, slowly"""
+    await asyncio.sleep(2)
+    return f"the weather of {city} is 35°C"
+
+
+def action(name: str, tool_input: dict) -> str:
+    blob = json.dumps({"action": name, "action_input": tool_input})
+    return f"Thought: I should use {name}\nAction:\n```\n{blob}\n```"
+
+
+def planner(tool_name: str):
+    """假的ReAct模型：调用一次工具，然后把观察结果作为最终答案"""
+
+    def plan(prompt: str) -> str:
+        observations = re.findall(r"Observation: (.*)", prompt.split("Begin!", 1)[1])
+        if not observations:
+            return action(tool_name, {"city": "Beijing"})
+        return f"Thought: I now know the final answer\nFinal Answer: {observations[-1]}"
+
+    return plan
+
+
+def lookup_agent(tool_) -> Agent:
+    return Agent(name="lookup_agent", model=FakeChatModel(respond=planner(tool_.name)), tools=[tool_])
+
+
+@pytest.fixture(autouse=True)
+def reset_tools():
+    RELEASE.clear()
+    yield
+    RELEASE.set()
+    for tool_ in (slow_lookup, async_lookup, async_slow_lookup):
+        tool_.metadata = None
+
+
+class TestToolLimits:
+    def test_sync_timeout_becomes_observation(self):
+        limit_tool(slow_lookup, timeout=0.05)
+        started = time.monotonic()
+
+        assert lookup_agent(slow_lookup).run("weather in Beijing") == "Tool slow_lookup timed out after 0.05 seconds"
+        assert time.monotonic() - started < 1
+
+    def test_async_timeout_becomes_observation(self):
+        limit_tool(async_slow_lookup, timeout=0.05)
+
+        result = asyncio.run(lookup_agent(async_slow_lookup).arun("weather in Beijing"))
+        assert result == "Tool async_slow_lookup timed out after 0.05 seconds"
+
+    def test_sync_tool_does_not_block_loop(self):
+        ticks = []
+
+        async def ticker():
+            while not RELEASE.is_set():
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def main():
+            ticking = asyncio.create_task(ticker())
+            running = asyncio.create_task(lookup_agent(slow_lookup).arun("weather in Beijing"))
+            await asyncio.sleep(0.1)
+            RELEASE.set()
+            await ticking
+            return await running
+
+        assert asyncio.run(main()) == "the weather of Beijing is 24°C"
+        # 同步工具在线程池中等待时，事件循环仍在运行
+        assert len(ticks) > 3
+
+    def test_async_only_tool_in_sync_run(self):
+        assert lookup_agent(async_lookup).run("weather in Beijing") == "the weather of Beijing is 35°C"
+
+    def test_max_concurrency(self):
+        running = []
+        peak = []
+
+        def work():
+            running.append(1)
+            peak.append(len(running))
+            time.sleep(0.02)
+            running.pop()
+            return "done"
+
+        limits = ToolLimits(max_concurrency=2)
+        threads = [threading.Thread(target=limits.run, args=("work", work)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert max(peak) == 2
+
+    def test_waiting_for_slot_counts_towards_timeout(self):
+        limits = ToolLimits(timeout=0.05, max_concurrency=1)
+        with pytest.raises(ToolTimeoutError):
+            limits.run("slow", lambda: RELEASE.wait(2))
+
+        # 超时的调用仍在后台执行并占用名额
+        with pytest.raises(ToolTimeoutError):
+            limits.run("slow", lambda: "never")
+        RELEASE.set()
+
+    def test_async_max_concurrency(self):
+        running = []
+        peak = []
+
+        async def work():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        async def main():
+            limits = ToolLimits(max_concurrency=3)
+            await asyncio.gather(*(limits.arun("work", work) for _ in range(8)))
+
+        asyncio.run(main())
+        assert max(peak) == 3
+
+    def test_hung_tools_do_not_starve_other_tools(self):
+        hung = ToolLimits(timeout=0.01)
+        hang = threading.Event()
+
+        async def main():
+            for _ in range(40):
+                with pytest.raises(ToolTimeoutError):
+                    await hung.arun_sync("hung", lambda: hang.wait(2))
+            # 没有限制的同步工具不使用超时工具的线程池
+            return await asyncio.wait_for(lookup_agent(slow_lookup).arun("weather in Beijing"), 1)
+
+        RELEASE.set()
+        try:
+            assert asyncio.run(main()) == "the weather of Beijing is 24°C"
+        finally:
+            hang.set()
+
+    def test_waiting_for_slot_does_not_hold_threads(self):
+        limits = ToolLimits(timeout=0.2, max_concurrency=1)
+
+        async def main():
+            return await asyncio.gather(*(limits.arun_sync("slow", lambda: RELEASE.wait(2)) for _ in range(5)),
+                                        return_exceptions=True)
+
+        results = asyncio.run(main())
+        RELEASE.set()
+
+        assert sum(isinstance(result, ToolTimeoutError) for result in results) == 5
+        assert len(limits._executor._threads) == 1
+
+    def test_configuration(self):
+        limit_tool(async_lookup, timeout=3, max_concurrency=2)
+        limits = tool_limits(async_lookup)
+        assert (limits.timeout, limits.max_concurrency) == (3, 2)
+
+        with pytest.raises(ValueError):
+            ToolLimits(timeout=0)
+        with pytest.raises(ValueError):
+            ToolLimits(max_concurrency=0)
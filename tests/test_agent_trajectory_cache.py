@@ -0,0 +1,170 @@
+import asyncio
+import json
+import re
+
+import pytest
+from langchain_core.agents import AgentAction
+from langchain_core.tools import tool
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.testing import FakeChatModel
+from tudi.trajectory import TrajectoryCache, build_plan
+
+DEGREES = {"beijing": 24, "guangzhou": 35}
+TOOL_CALLS = []
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Gets the weather for a given city"""
+    TOOL_CALLS.append(("get_weather", city))
+    city = city.lower()
+    if city not in DEGREES:
+        return f"no weather data for {city}"
+    return f"the weather of {city} is {DEGREES[city]}°C"
+
+
+@tool
+def get_dressing_advice(degree: int) -> str:
+    """Gets dressing advice based on degree"""
+    TOOL_CALLS.append(("get_dressing_advice", degree))
+    return "Athleisure" if degree > 30 else "Smart Casual"
+
+
+def action(name: str, tool_input: dict) -> str:
+    blob = json.dumps({"action": name, "action_input": tool_input})
+    return f"Thought: I should use {name}\nAction:\n```\n{blob}\n```"
+
+
+def plan(prompt: str) -> str:
+    """假的ReAct模型：先查询天气，再按温度查询穿衣建议，最后给出答案"""
+    conversation = prompt.split("Begin!", 1)[1]
+    observations = re.findall(r"Observation: (.*)", conversation)
+    if not observations:
+        city = re.search(r"wear in (\w+)", conversation).group(1)
+        return action("get_weather", {"city": city})
+    degree = re.search(r"(-?\d+)°C", observations[0])
+    if len(observations) == 1 and degree:
+        return action("get_dressing_advice", {"degree": int(degree.group(1))})
+    return f"Thought: I now know the final answer\nFinal Answer: {observations[-1]}"
+
+
+def dressing_agent(model: FakeChatModel, cache: TrajectoryCache, **kwargs) -> Agent:
+    return Agent(
+        name="dressing_agent",
+        model=model,
+        tools=[get_weather, get_dressing_advice],
+        trajectory_cache=cache,
+        **kwargs
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_tool_calls():
+    TOOL_CALLS.clear()
+
+
+class TestTrajectoryCache:
+    def test_replay_with_substituted_arguments(self):
+        model = FakeChatModel(respond=plan)
+        cache = TrajectoryCache()
+        agent = dressing_agent(model, cache)
+
+        assert agent.run("What should I wear in Beijing today?") == "Smart Casual"
+        assert model.calls == 3
+        assert len(cache) == 1
+
+        TOOL_CALLS.clear()
+        assert agent.run("What should I wear in Guangzhou today?") == "Athleisure"
+        assert model.calls == 4
+        assert TOOL_CALLS == [("get_weather", "Guangzhou"), ("get_dressing_advice", 35)]
+        assert agent.last_run_metadata == {"stop_reason": "replayed", "iterations": 2}
+
+        stats = cache.stats("dressing_agent")
+        assert (stats.hits, stats.misses, stats.fallbacks, stats.recorded) == (1, 1, 0, 1)
+        assert stats.hit_rate == 0.5
+
+    def test_replay_async(self):
+        model = FakeChatModel(respond=plan)
+        agent = dressing_agent(model, TrajectoryCache())
+
+        asyncio.run(agent.arun("What should I wear in Beijing today?"))
+        result = asyncio.run(agent.arun("What should I wear in Guangzhou today?"))
+
+        assert result == "Athleisure"
+        assert model.calls == 4
+
+    def test_fallback_on_mismatch(self):
+        model = FakeChatModel(respond=plan)
+        cache = TrajectoryCache()
+        agent = dressing_agent(model, cache)
+        agent.run("What should I wear in Beijing today?")
+
+        # 天气工具的输出与记录的计划不符，回到完整的循环
+        assert agent.run("What should I wear in Atlantis today?") == "no weather data for atlantis"
+        assert model.calls == 5
+        assert agent.last_run_metadata["stop_reason"] == "finished"
+
+        stats = cache.stats()
+        assert (stats.hits, stats.fallbacks, stats.recorded) == (1, 1, 2)
+        assert stats.fallback_rate == 1.0
+
+    def test_different_request_misses(self):
+        model = FakeChatModel(respond=plan)
+        cache = TrajectoryCache()
+        agent = dressing_agent(model, cache)
+        agent.run("What should I wear in Beijing today?")
+        agent.run("What should I wear in Beijing tomorrow?")
+
+        assert model.calls == 6
+        assert cache.stats().hits == 0
+
+    def test_typed_output(self):
+        class Advice(BaseModel):
+            suggestion: str
+
+        model = FakeChatModel(respond=lambda prompt: '{"suggestion": "Athleisure"}'
+                              if "Final Answer: ```" in prompt else plan(prompt))
+        agent = dressing_agent(model, TrajectoryCache(), output_type=Advice)
+        agent.run("What should I wear in Beijing today?")
+
+        assert agent.run("What should I wear in Guangzhou today?") == Advice(suggestion="Athleisure")
+
+    def test_build_plan(self):
+        steps = [(AgentAction(tool="get_weather", tool_input={"city": "Beijing"}, log=""),
+                  "the weather of beijing is 24°C")]
+        built = build_plan("weather in Beijing, please", steps)
+
+        assert built.request.fullmatch("weather in Paris, please").group("r0") == "Paris"
+        assert built.request.fullmatch("weather in Paris") is None
+
+    def test_requires_tools(self):
+        with pytest.raises(ValueError):
+            Agent(name="agent", model=FakeChatModel(), trajectory_cache=TrajectoryCache())
+
+    def test_slots_match_whole_words(self):
+        steps = [(AgentAction(tool="convert", tool_input={"amount": 10, "to": "dollars"}, log=""), "9.2")]
+        built = build_plan("convert 10 euros to dollars", steps)
+
+        assert built.request.fullmatch("convert 25 euros to dollars").groupdict() == {"r0": "25", "r1": "dollars"}
+        # "EUR"只出现在"euros"中间，不能作为槽位，也不是请求中的原文
+        steps = [(AgentAction(tool="convert", tool_input={"amount": 10, "to": "EUR"}, log=""), "9.2")]
+        assert build_plan("convert 10 dollars to euros", steps) is None
+
+    def test_refuses_derived_arguments(self):
+        steps = [(AgentAction(tool="get_weather", tool_input={"city": "Beijing", "date": "2026-10-20"}, log=""),
+                  "sunny")]
+        cache = TrajectoryCache()
+
+        assert build_plan("weather in Beijing tomorrow", steps) is None
+        assert cache.record("weather_agent", "weather in Beijing tomorrow", steps) is None
+        assert len(cache) == 0
+
+    def test_slot_keeps_the_recorded_shape(self):
+        steps = [(AgentAction(tool="get_weather", tool_input={"city": "Beijing"}, log=""),
+                  "the weather of beijing is 24°C")]
+        built = build_plan("weather in Beijing tomorrow", steps)
+
+        assert built.request.fullmatch("weather in Shanghai tomorrow").group("r0") == "Shanghai"
+        assert built.request.fullmatch("weather in Shanghai and Paris tomorrow") is None
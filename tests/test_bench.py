@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, metrics, route
+from tudi.bench import fake_models, input_factory, latency_distribution, run_bench
+from tudi.cascade import ModelCascade
+from tudi.cli import main
+from tudi.serialization import sample_value
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+    raining: bool | None = None
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+    items: list[str]
+
+
+def dressing_agent(name: str) -> Agent:
+    return Agent(name=name, model=FakeChatModel(responses=["not used"]), prompt_template="{arg.degree}",
+                 input_type=WeatherReport, output_type=DressingAdvice)
+
+
+def create_flow() -> Flow:
+    weather = Agent(name="weather_agent", model=FakeChatModel(responses=["not json"]),
+                    prompt_template="Report the weather of {arg.city}",
+                    input_type=WeatherQuery, output_type=WeatherReport)
+    return Flow.start(weather, name="dressing").route(
+        FakeChatModel(responses=["unknown"]),
+        route("summer").then(dressing_agent("summer")),
+        route("winter").then(dressing_agent("winter")),
+        default(dressing_agent("default"))
+    )
+
+
+def sample_input(index: int) -> WeatherQuery:
+    return WeatherQuery(city=f"city-{index}")
+
+
+class TestBench:
+    def test_sample_value_matches_type(self):
+        assert sample_value(WeatherReport) == {"city": "sample", "degree": 0, "raining": False}
+        assert DressingAdvice.model_validate(sample_value(DressingAdvice))
+
+    def test_latency_distribution(self):
+        assert latency_distribution("0.2")() == 0.2
+        assert 0.1 <= latency_distribution("uniform:0.1,0.3", seed=1)() <= 0.3
+        with pytest.raises(ValueError):
+            latency_distribution("gamma:1")
+
+    def test_fake_models_cover_all_agents(self):
+        flow = create_flow()
+
+        assert fake_models(flow, latency_distribution("0")) == 5
+        assert len(list(flow._iter_agents())) == 4
+        assert isinstance(flow.run(WeatherQuery(city="beijing")), DressingAdvice)
+
+    def test_fake_models_replace_cascade_and_constrained_route(self):
+        cheap = FakeChatModel(responses=["not json"])
+        weather = Agent(name="weather_agent", model=FakeChatModel(responses=["not json"]),
+                        prompt_template="Report the weather of {arg.city}",
+                        input_type=WeatherQuery, output_type=WeatherReport, cascade=ModelCascade([cheap]))
+        router = FakeChatModel(responses=["unknown"])
+        flow = Flow.start(weather).route(router, route("summer").then(dressing_agent("summer")),
+                                         default(dressing_agent("default")), constrained=True)
+
+        fake_models(flow, latency_distribution("0"))
+
+        assert isinstance(flow.run(WeatherQuery(city="beijing")), DressingAdvice)
+        assert (cheap.calls, router.calls) == (0, 0)
+        assert weather.cascade.models[0].calls == 1
+
+    @pytest.mark.parametrize("mode", ["sync", "thread", "asyncio"])
+    def test_run_open_loop(self, mode):
+        flow = create_flow()
+        fake_models(flow, latency_distribution("0.01"))
+
+        report = run_bench(flow, sample_input, qps=200, requests=20, mode=mode)
+
+        assert report.completed == 20
+        assert report.errors == 0
+        assert report.latency.p50 >= 0.02
+        assert report.steps["dressing/0:Agent:weather_agent"]["count"] == 20
+        assert report.agents["weather_agent"]["count"] == 20
+
+    def test_asyncio_mode_limits_concurrency(self):
+        class SlowFlow:
+            running = peak = 0
+
+            def run(self, input_data):
+                raise AssertionError("arun should be used")
+
+            async def arun(self, input_data):
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+                await asyncio.sleep(0.05)
+                self.running -= 1
+
+        flow = SlowFlow()
+        report = run_bench(flow, sample_input, qps=1000, requests=40, mode="asyncio", max_workers=4)
+
+        assert report.completed == 40
+        assert flow.peak == 4
+
+    def test_keep_host_metrics(self):
+        metrics.registry.reset()
+        metrics.registry.enable()
+        metrics.registry.inc(metrics.MODEL_CALLS, agent="host")
+        metrics.registry.observe(metrics.AGENT_LATENCY, 1.0, agent="weather_agent")
+        try:
+            flow = create_flow()
+            fake_models(flow, latency_distribution("0"))
+            report = run_bench(flow, sample_input, qps=500, requests=5)
+
+            # 压测不清空已有的指标，报告只统计压测期间的增量
+            snapshot = metrics.registry.snapshot()
+            assert {"labels": {"agent": "host"}, "value": 1} in snapshot["counters"][metrics.MODEL_CALLS]
+            assert report.agents["weather_agent"]["count"] == 5
+        finally:
+            metrics.registry.disable()
+            metrics.registry.reset()
+
+    def test_restore_disabled_registry(self):
+        metrics.registry.reset()
+        flow = create_flow()
+        fake_models(flow, latency_distribution("0"))
+
+        run_bench(flow, sample_input, qps=500, requests=5)
+
+        assert not metrics.registry.enabled
+        assert metrics.registry.snapshot()["histograms"][metrics.AGENT_LATENCY] == []
+
+    def test_count_errors(self):
+        report = run_bench(create_flow(), input_factory([WeatherQuery(city="beijing")]), qps=500, requests=5)
+
+        assert report.completed == 0
+        assert report.error_rate == 1.0
+        assert report.error_types == {"OutputParserException": 5}
+
+    def test_cli_json_report(self, tmp_path, capsys):
+        samples = tmp_path / "samples.jsonl"
+        samples.write_text('{"city": "beijing"}\n{"city": "harbin"}\n')
+
+        main(["bench", "tests.test_bench:create_flow", "--inputs", str(samples), "--qps", "100",
+              "--requests", "10", "--fake-latency", "0.001", "--json", "-"])
+
+        report = json.loads(capsys.readouterr().out)
+        assert report["completed"] == 10
+        assert report["latency"]["p99"] >= report["latency"]["p50"]
@@ -0,0 +1,149 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from pydantic import BaseModel
+
+from tudi import Agent, Flow
+from tudi.distributed import DistributedFlow, RemoteExecutionError, SQLiteTaskQueue, Worker
+from tudi.serialization import dumps_typed, loads_typed
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    city: str
+    suggestion: str
+
+
+def report(prompt: str) -> str:
+    city = prompt.splitlines()[0].rsplit(" ", 1)[-1]
+    return f'{{"city": "{city}", "degree": {len(city)}}}'
+
+
+def advise(prompt: str) -> str:
+    city, degree = prompt.splitlines()[0].split(":")
+    suggestion = "T-shirt" if int(degree) > 6 else "Jacket"
+    return f'{{"city": "{city}", "suggestion": "{suggestion}"}}'
+
+
+def create_flow() -> Flow:
+    weather = Agent(
+        name="weather_agent",
+        model=FakeChatModel(respond=report),
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+    dressing = Agent(
+        name="dressing_agent",
+        model=FakeChatModel(respond=advise),
+        prompt_template="{arg.city}:{arg.degree}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+    return Flow.start(weather, name="dressing").next(dressing)
+
+
+def failing_flow() -> Flow:
+    def fail(_: str) -> str:
+        raise ValueError("model unavailable")
+
+    broken = Agent(name="broken", model=FakeChatModel(respond=fail), prompt_template="{arg.city}",
+                   input_type=WeatherQuery, output_type=WeatherReport)
+    return Flow.start(broken)
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.db")
+
+
+class TestDistributedFlow:
+    def test_typed_payload_round_trip(self):
+        payload = dumps_typed(WeatherReport(city="beijing", degree=24))
+
+        assert loads_typed(payload) == WeatherReport(city="beijing", degree=24)
+        assert loads_typed(dumps_typed({"city": "beijing"})) == {"city": "beijing"}
+
+    def test_payload_type_is_not_trusted(self):
+        data = {"city": "beijing", "degree": 24}
+
+        # 不是Pydantic模型、模块没有导入或与声明的类型不符时，不使用记录的类型
+        for type_path in ["subprocess:Popen", "tudi_missing_module:Model", f"{__name__}:WeatherQuery"]:
+            payload = json.dumps({"type": type_path, "data": data})
+            assert loads_typed(payload, WeatherReport) == WeatherReport(city="beijing", degree=24)
+        assert "tudi_missing_module" not in sys.modules
+
+    def test_run_steps_in_worker(self, queue_path):
+        queue = SQLiteTaskQueue(queue_path)
+        flow = create_flow()
+        runner = DistributedFlow(flow, queue)
+        run_id = runner.submit(WeatherQuery(city="guangzhou"))
+
+        worker = Worker(flow, queue)
+        while worker.run_once():
+            pass
+
+        assert runner.result(run_id, timeout=1) == DressingAdvice(city="guangzhou", suggestion="T-shirt")
+        assert worker.processed == 2
+
+    def test_retry_until_max_attempts(self, queue_path):
+        queue = SQLiteTaskQueue(queue_path, max_attempts=2, retry_delay=0)
+        flow = failing_flow()
+        runner = DistributedFlow(flow, queue)
+        run_id = runner.submit(WeatherQuery(city="beijing"))
+
+        worker = Worker(flow, queue)
+        while worker.run_once():
+            pass
+
+        assert worker.failed == 2
+        with pytest.raises(RemoteExecutionError, match="model unavailable"):
+            runner.result(run_id, timeout=1)
+
+    def test_redeliver_after_visibility_timeout(self, queue_path):
+        queue = SQLiteTaskQueue(queue_path, visibility_timeout=0.1)
+        queue.create_run("dressing", dumps_typed(WeatherQuery(city="beijing")))
+
+        crashed = queue.claim("dressing")
+        assert queue.claim("dressing") is None
+
+        time.sleep(0.15)
+        redelivered = queue.claim("dressing")
+
+        assert redelivered.id == crashed.id
+        assert redelivered.attempts == 2
+        assert not queue.complete(crashed, result="{}")
+        assert queue.complete(redelivered, result="{}")
+
+    def test_multiple_worker_processes(self, queue_path):
+        queue = SQLiteTaskQueue(queue_path)
+        runner = DistributedFlow(create_flow(), queue)
+        cities = ["beijing", "guangzhou", "harbin", "xian", "chengdu", "shanghai"]
+        run_ids = [runner.submit(WeatherQuery(city=city)) for city in cities]
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "tudi", "worker", "tests.test_distributed:create_flow",
+             "--queue", queue_path, "--processes", "3", "--idle-timeout", "1"],
+            cwd=root, stderr=subprocess.DEVNULL)
+        try:
+            results = [runner.result(run_id, timeout=30) for run_id in run_ids]
+        finally:
+            worker.wait(timeout=30)
+
+        assert [r.city for r in results] == cities
+        assert results[2].suggestion == "Jacket"
+        assert queue.pending_tasks() == 0
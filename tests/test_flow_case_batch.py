@@ -0,0 +1,221 @@
+import json
+from typing import Any, List
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, route, when
+from tudi.runlog import RunLog
+from tudi.statements import columns
+from tudi.step_cache import StepCache
+from tudi.testing import FakeChatModel
+
+DEGREES = {"beijing": 24, "guangzhou": 35, "shenzhen": 33, "harbin": -5}
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+class BatchCountingModel(FakeChatModel):
+    """记录批量调用的次数和每批的大小"""
+
+    batch_sizes: List[int] = []
+
+    def batch(self, inputs: List[Any], *args: Any, **kwargs: Any) -> List[Any]:
+        self.batch_sizes.append(len(inputs))
+        return super().batch(inputs, *args, **kwargs)
+
+
+def report(prompt: str) -> str:
+    city = prompt.splitlines()[0].split()[-1]
+    if city == "atlantis":
+        return "not json"
+    return json.dumps({"city": city, "degree": DEGREES[city]})
+
+
+def weather_agent(model: FakeChatModel) -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=model,
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+
+
+def advice_agent(name: str, model: FakeChatModel) -> Agent:
+    return Agent(
+        name=name,
+        model=model,
+        prompt_template="Dressing advice for {arg.degree}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+def advice(suggestion: str) -> BatchCountingModel:
+    return BatchCountingModel(responses=[json.dumps({"suggestion": suggestion})])
+
+
+CITIES = ["beijing", "guangzhou", "harbin", "shenzhen", "beijing", "guangzhou", "harbin"]
+
+
+class TestFlowCaseBatch:
+    def test_partition_by_branch(self):
+        weather_model = BatchCountingModel(respond=report)
+        hot_model, cold_model, mild_model = advice("shorts"), advice("coat"), advice("shirt")
+        flow = Flow.start(weather_agent(weather_model)).case(
+            when(lambda report: report.degree > 30).then(advice_agent("hot_agent", hot_model)),
+            when(lambda report: report.degree < 0).then(advice_agent("cold_agent", cold_model)),
+            default(advice_agent("mild_agent", mild_model))
+        )
+
+        results = flow.run_batch([WeatherQuery(city=city) for city in CITIES])
+
+        expected = {"beijing": "shirt", "guangzhou": "shorts", "shenzhen": "shorts", "harbin": "coat"}
+        assert [result.suggestion for result in results] == [expected[city] for city in CITIES]
+        assert weather_model.batch_sizes == [7]
+        assert hot_model.batch_sizes == [3]
+        assert cold_model.batch_sizes == [2]
+        assert mild_model.batch_sizes == [2]
+        assert results == [flow.run(WeatherQuery(city=city)) for city in CITIES]
+
+    def test_vectorized_predicate(self):
+        seen = []
+
+        def hot(cols):
+            seen.append(cols)
+            return [degree > 30 for degree in cols["degree"]]
+
+        hot_model, mild_model = advice("shorts"), advice("shirt")
+        flow = Flow.start(weather_agent(FakeChatModel(respond=report))).case(
+            when(hot, vectorized=True).then(advice_agent("hot_agent", hot_model)),
+            default(advice_agent("mild_agent", mild_model))
+        )
+
+        results = flow.run_batch([WeatherQuery(city=city) for city in CITIES])
+
+        assert [result.suggestion for result in results] == \
+            ["shirt", "shorts", "shirt", "shorts", "shirt", "shorts", "shirt"]
+        assert len(seen) == 1
+        assert seen[0]["city"] == CITIES
+        assert hot_model.batch_sizes == [3]
+        # 单个输入执行时，向量化的条件收到只有一行的列
+        assert flow.run(WeatherQuery(city="shenzhen")).suggestion == "shorts"
+        assert seen[-1] == {"city": ["shenzhen"], "degree": [33]}
+
+    def test_later_conditions_only_see_remaining_inputs(self):
+        seen = []
+
+        def warm(cols):
+            seen.extend(cols["city"])
+            return [True] * len(cols["city"])
+
+        flow = Flow.start(weather_agent(FakeChatModel(respond=report))).case(
+            when(lambda report: report.degree > 30).then(advice_agent("hot_agent", advice("shorts"))),
+            when(warm, vectorized=True).then(advice_agent("warm_agent", advice("shirt")))
+        )
+        flow.run_batch([WeatherQuery(city=city) for city in CITIES])
+
+        assert seen == ["beijing", "harbin", "beijing", "harbin"]
+
+    def test_failed_items(self):
+        flow = Flow.start(weather_agent(FakeChatModel(respond=report))).case(
+            default(advice_agent("mild_agent", advice("shirt")))
+        )
+        inputs = [WeatherQuery(city="beijing"), WeatherQuery(city="atlantis"), WeatherQuery(city="harbin")]
+
+        results = flow.run_batch(inputs, return_exceptions=True)
+        assert results[0].suggestion == "shirt"
+        assert isinstance(results[1], OutputParserException)
+        assert results[2].suggestion == "shirt"
+
+        with pytest.raises(OutputParserException):
+            flow.run_batch(inputs)
+
+    def test_route_batch(self):
+        router = BatchCountingModel(respond=lambda prompt: "hot" if "35" in prompt or "33" in prompt else "mild")
+        hot_model, mild_model = advice("shorts"), advice("shirt")
+        flow = Flow.start(weather_agent(FakeChatModel(respond=report))).route(
+            router,
+            route("hot", "hot weather").then(advice_agent("hot_agent", hot_model)),
+            default(advice_agent("mild_agent", mild_model))
+        )
+
+        results = flow.run_batch([WeatherQuery(city=city) for city in CITIES])
+
+        assert [result.suggestion for result in results] == \
+            ["shirt", "shorts", "shirt", "shorts", "shirt", "shorts", "shirt"]
+        # 相同的输入只分类一次
+        assert router.batch_sizes == [4]
+        assert hot_model.batch_sizes == [3]
+        assert mild_model.batch_sizes == [4]
+
+    def test_route_batch_failed_classification(self):
+        def classify(prompt: str) -> str:
+            if "-5" in prompt:
+                raise ConnectionError("router down")
+            return "mild"
+
+        flow = Flow.start(weather_agent(FakeChatModel(respond=report))).route(
+            FakeChatModel(respond=classify),
+            route("hot", "hot weather").then(advice_agent("hot_agent", advice("shorts"))),
+            default(advice_agent("mild_agent", advice("shirt")))
+        )
+        inputs = [WeatherQuery(city="beijing"), WeatherQuery(city="harbin")]
+
+        results = flow.run_batch(inputs, return_exceptions=True)
+        assert results[0].suggestion == "shirt"
+        assert isinstance(results[1], ConnectionError)
+
+        with pytest.raises(ConnectionError):
+            flow.run_batch(inputs)
+
+    def test_branch_type_mismatch_is_returned(self):
+        flow = Flow.start(weather_agent(FakeChatModel(respond=report))).case(
+            when(lambda report: report.degree > 30).then(advice_agent("hot_agent", advice("shorts")))
+            .to_output(lambda advice: advice.suggestion),
+            default(advice_agent("mild_agent", advice("shirt")))
+        )
+
+        results = flow.run_batch([WeatherQuery(city="beijing"), WeatherQuery(city="guangzhou")],
+                                 return_exceptions=True)
+
+        assert results[0].suggestion == "shirt"
+        assert isinstance(results[1], TypeError)
+
+    def test_batch_records_runs_and_uses_step_cache(self, tmp_path):
+        weather_model = BatchCountingModel(respond=report)
+        cache = StepCache()
+        inputs = [WeatherQuery(city="beijing"), WeatherQuery(city="atlantis")]
+
+        with RunLog(str(tmp_path / "runs.log")) as run_log:
+            flow = Flow.start(weather_agent(weather_model), name="batch", run_log=run_log,
+                              step_cache=cache).case(default(advice_agent("mild_agent", advice("shirt"))))
+            flow.run_batch(inputs, return_exceptions=True)
+            results = flow.run_batch(inputs, return_exceptions=True)
+            assert run_log.flush(timeout=5)
+            kinds = [event["kind"] for event in run_log.query(flow="batch")]
+
+        assert results[0].suggestion == "shirt"
+        assert isinstance(results[1], OutputParserException)
+        # 成功的输入第二次直接复用，失败的输入重新执行
+        assert weather_model.batch_sizes == [2, 1]
+        assert kinds.count("run_start") == 4
+        assert kinds.count("run_end") == 2
+        assert kinds.count("run_error") == 2
+
+    def test_columns(self):
+        assert columns([WeatherQuery(city="a"), WeatherQuery(city="b")]) == {"city": ["a", "b"]}
+        assert columns([1, 2]) == [1, 2]
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, when
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+    summary: str
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+REPORT = '{"city": "guangzhou", "degree": 35, "summary": "hot and humid with a chance of afternoon showers"}'
+
+
+def weather_agent() -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=FakeChatModel(responses=[REPORT]),
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+
+
+def dressing_agent(name: str, suggestion: str) -> Agent:
+    return Agent(
+        name=name,
+        model=FakeChatModel(responses=[f'{{"suggestion": "{suggestion}"}}']),
+        prompt_template="You are a stylist. Give a dressing code for {arg.degree}°C",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+class TestEarlyRouting:
+    def test_route_before_upstream_completes(self):
+        seen = []
+
+        def is_hot(report):
+            seen.append(set(report.model_fields_set))
+            return report.degree > 30
+
+        flow = Flow.start(weather_agent()).case(
+            when(is_hot).then(dressing_agent("summer", "Athleisure")),
+            default(dressing_agent("default", "Smart Casual")),
+            depends_on=["degree"]
+        )
+
+        assert flow.run(WeatherQuery(city="guangzhou")).suggestion == "Athleisure"
+        assert "summary" not in seen[0]
+
+    def test_prefill_chosen_branch(self):
+        summer = dressing_agent("summer", "Athleisure")
+        winter = dressing_agent("winter", "Down jacket")
+        flow = Flow.start(weather_agent()).case(
+            when(lambda report: report.degree > 30).then(summer),
+            when(lambda report: report.degree < 10).then(winter),
+            depends_on=["degree"]
+        )
+
+        flow.run(WeatherQuery(city="guangzhou"))
+
+        # 声明depends_on时默认预填充所选分支
+        assert flow._tasks[1].warmup is True
+        deadline = time.monotonic() + 2
+        while summer.model.calls < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert summer.model.prompts[:2].count("You are a stylist. Give a dressing code for ") == 1
+        assert winter.model.calls == 0
+
+    def test_warmup_can_be_disabled(self):
+        summer = dressing_agent("summer", "Athleisure")
+        flow = Flow.start(weather_agent()).case(
+            when(lambda report: report.degree > 30).then(summer),
+            depends_on=["degree"],
+            warmup=False
+        )
+
+        flow.run(WeatherQuery(city="guangzhou"))
+
+        assert summer.model.calls == 1
+        assert flow._tasks[1].warmup is False
+
+    def test_fall_back_to_final_output(self):
+        flow = Flow.start(weather_agent()).case(
+            when(lambda report: "showers" in report.summary).then(dressing_agent("rain", "Umbrella")),
+            default(dressing_agent("default", "Smart Casual")),
+            depends_on=["degree"]
+        )
+
+        assert flow.run(WeatherQuery(city="guangzhou")).suggestion == "Umbrella"
+
+    def test_reject_unknown_fields(self):
+        with pytest.raises(ValueError, match="humidity"):
+            Flow.start(weather_agent()).case(
+                when(lambda report: report.humidity > 80).then(dressing_agent("rain", "Umbrella")),
+                depends_on=["humidity"]
+            )
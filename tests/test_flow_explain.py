@@ -0,0 +1,135 @@
+from langchain_core.tools import tool
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, route, when
+from tudi.budget import AgentBudget
+from tudi.runlog import RunLog
+from tudi.testing import FakeChatModel
+from tudi.usage import estimate_tokens
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Gets the weather for a given city"""
+    return f"the weather of {city} is 24°C"
+
+
+def weather_agent(**kwargs) -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=FakeChatModel(responses=['{"city": "beijing", "degree": 32}']),
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport,
+        **kwargs
+    )
+
+
+def advice_agent(name: str) -> Agent:
+    return Agent(
+        name=name,
+        model=FakeChatModel(responses=['{"suggestion": "shorts"}']),
+        prompt_template="Dressing advice for {arg.degree}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+def tool_agent(**kwargs) -> Agent:
+    return Agent(
+        name="tool_agent",
+        model=FakeChatModel(),
+        prompt_template="Dressing advice for {arg.degree} in {arg.city}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice,
+        tools=[get_weather],
+        **kwargs
+    )
+
+
+class TestFlowExplain:
+    def test_single_call_agent(self):
+        estimate = Flow.start(weather_agent()).explain()
+
+        step = estimate.steps[0]
+        agent = step.agents[0]
+        assert (agent.mode, agent.min_calls, agent.max_calls) == ("single", 1, 1)
+        assert "Report the weather of" in agent.prompt
+        # 格式说明是prompt骨架的一部分
+        assert '"degree"' in agent.prompt
+        assert agent.prompt_tokens == estimate_tokens(agent.prompt)
+        assert (estimate.min_calls, estimate.max_calls) == (1, 1)
+
+    def test_tool_agent_loop_and_reformat(self):
+        estimate = Flow.start(tool_agent(budget=AgentBudget(max_iterations=4, early_stopping_method="generate")))\
+            .explain()
+
+        agent = estimate.steps[0].agents[0]
+        assert agent.mode == "react"
+        assert "get_weather" in agent.prompt and "Gets the weather for a given city" in agent.prompt
+        # 至少一次ReAct调用加上一次重新格式化，最多4次迭代、一次生成最终答案和一次重新格式化
+        assert (agent.min_calls, agent.max_calls) == (2, 6)
+        assert agent.min_prompt_tokens == agent.prompt_tokens + agent.reformat_tokens
+        assert agent.max_prompt_tokens == 5 * agent.prompt_tokens + agent.reformat_tokens
+
+    def test_unbounded_loop(self):
+        estimate = Flow.start(tool_agent(budget=AgentBudget(max_iterations=None))).explain()
+
+        assert estimate.max_calls is None
+        total = str(estimate).splitlines()[2]
+        assert total.split()[:2] == ["total", "2+"]
+
+    def test_case_best_and_worst_branch(self):
+        flow = Flow.start(weather_agent()).case(
+            when(lambda report: report.degree > 30).then(advice_agent("hot_agent")),
+            default(tool_agent())
+        )
+        estimate = flow.explain(count_tokens=lambda text: len(text.split()))
+
+        case = estimate.steps[1]
+        assert [agent.agent for agent in case.agents] == ["hot_agent", "tool_agent"]
+        assert (case.min_calls, case.max_calls) == (1, 16)
+        assert (estimate.min_calls, estimate.max_calls) == (2, 17)
+        assert case.agents[0].prompt_tokens == len(case.agents[0].prompt.split())
+
+    def test_case_without_default_may_skip(self):
+        flow = Flow.start(weather_agent()).case(when(lambda report: report.degree > 30).then(advice_agent("hot")))
+        assert flow.explain().steps[1].min_calls == 0
+
+    def test_route_adds_classification_call(self):
+        flow = Flow.start(weather_agent()).route(
+            FakeChatModel(responses=["hot"]),
+            route("hot", "hot weather").then(advice_agent("hot_agent")),
+            default(advice_agent("mild_agent"))
+        )
+        step = flow.explain().steps[1]
+
+        assert (step.min_calls, step.max_calls) == (2, 2)
+        assert step.min_prompt_tokens > sum(agent.prompt_tokens for agent in step.agents) / 2
+
+    def test_measured_latency(self, tmp_path):
+        with RunLog(str(tmp_path / "runs.log")) as run_log:
+            flow = Flow.start(weather_agent(), name="weather", run_log=run_log)
+            flow.run(WeatherQuery(city="beijing"))
+            flow.run(WeatherQuery(city="beijing"))
+            assert run_log.flush(timeout=5)
+
+            estimate = flow.explain()
+
+        assert estimate.steps[0].measured_runs == 2
+        assert estimate.steps[0].measured_latency >= 0
+        assert estimate.measured_runs == 2
+        assert "(n=2)" in str(estimate)
@@ -0,0 +1,90 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, route
+from tudi.testing import FakeChatModel
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+def dressing_agent(name: str, suggestion: str) -> Agent:
+    return Agent(
+        name=name,
+        model=FakeChatModel(responses=[f'{{"suggestion": "{suggestion}"}}']),
+        prompt_template="Give a dressing code for {arg.degree}°C",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+def weather_agent(degree: int) -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=FakeChatModel(responses=[f'{{"city": "guangzhou", "degree": {degree}}}']),
+        prompt_template="Answer the weather report: {input}",
+        output_type=WeatherReport
+    )
+
+
+def classify(prompt: str) -> str:
+    degree = int(prompt.split('"degree":')[1].split("}")[0])
+    if degree > 30:
+        return "<think>it is hot</think>Summer."
+    if degree < 10:
+        return "winter"
+    return "I am not sure"
+
+
+def create_flow(degree: int, router: FakeChatModel, constrained: bool = False) -> Flow:
+    return Flow.start(weather_agent(degree)).route(
+        router,
+        route("summer", "hot weather above 30°C").then(dressing_agent("summer", "Athleisure")),
+        route("winter", "cold weather below 10°C").then(dressing_agent("winter", "Down jacket")),
+        default(dressing_agent("default", "Smart Casual")),
+        constrained=constrained
+    )
+
+
+class TestFlowRoute:
+    def test_route_by_model_label(self):
+        router = FakeChatModel(respond=classify)
+
+        assert create_flow(35, router).run("guangzhou").suggestion == "Athleisure"
+        assert create_flow(5, router).run("harbin").suggestion == "Down jacket"
+        assert "- summer: hot weather above 30°C" in router.prompts[0]
+
+    def test_fall_back_to_default(self):
+        result = create_flow(20, FakeChatModel(respond=classify)).run("beijing")
+
+        assert result.suggestion == "Smart Casual"
+
+    def test_cache_classification(self):
+        router = FakeChatModel(respond=classify)
+        flow = create_flow(35, router)
+
+        flow.run("guangzhou")
+        flow.run("guangzhou")
+
+        assert router.calls == 1
+
+    def test_constrained_classification(self):
+        class StructuredModel(FakeChatModel):
+            def with_structured_output(self, schema, **kwargs):
+                assert schema.model_json_schema()["properties"]["label"]["enum"] == ["summer", "winter"]
+                return RunnableLambda(lambda _: schema(label="winter"))
+
+        flow = create_flow(35, StructuredModel(), constrained=True)
+
+        assert flow.run("guangzhou").suggestion == "Down jacket"
+
+    def test_reject_branches_without_agent(self):
+        with pytest.raises(ValueError, match="then"):
+            Flow.start(weather_agent(35)).route(FakeChatModel(), route("summer"))
@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, when
+from tudi.step_cache import StepCache, fingerprint
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+def weather_agent(degree: int = 32) -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=FakeChatModel(responses=[json.dumps({"city": "beijing", "degree": degree})]),
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+
+
+def advice_agent(prompt_template: str = "Dressing advice for {arg.degree}") -> Agent:
+    return Agent(
+        name="advice_agent",
+        model=FakeChatModel(responses=['{"suggestion": "shorts"}']),
+        prompt_template=prompt_template,
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+def dressing_flow(cache: StepCache, weather: Agent, advice: Agent) -> Flow:
+    return Flow.start(weather, name="dressing", step_cache=cache).next(advice)
+
+
+QUERY = WeatherQuery(city="beijing")
+
+
+class TestStepCache:
+    def test_rerun_reuses_all_steps(self):
+        cache = StepCache()
+        weather, advice = weather_agent(), advice_agent()
+        flow = dressing_flow(cache, weather, advice)
+
+        first = flow.run(QUERY)
+        second = flow.run(QUERY)
+
+        assert first == second == DressingAdvice(suggestion="shorts")
+        assert (weather.model.calls, advice.model.calls) == (1, 1)
+        assert cache.stats("dressing/0:Agent:weather_agent").hits == 1
+        assert (cache.stats().hits, cache.stats().misses) == (2, 2)
+
+    def test_changed_step_reruns_only_that_step(self):
+        cache = StepCache()
+        dressing_flow(cache, weather_agent(), advice_agent()).run(QUERY)
+
+        # 重新构建Flow，只修改最后一步的prompt
+        weather, advice = weather_agent(), advice_agent("What to wear at {arg.degree} degrees?")
+        dressing_flow(cache, weather, advice).run(QUERY)
+
+        assert (weather.model.calls, advice.model.calls) == (0, 1)
+
+    def test_changed_upstream_output_reruns_downstream(self):
+        cache = StepCache()
+        dressing_flow(cache, weather_agent(32), advice_agent()).run(QUERY)
+
+        weather, advice = weather_agent(12), advice_agent()
+        dressing_flow(cache, weather, advice).run(QUERY)
+
+        assert (weather.model.calls, advice.model.calls) == (1, 1)
+        assert advice.model.prompts[0].startswith("Dressing advice for 12")
+
+    def test_changed_mapper_reruns_downstream(self):
+        cache = StepCache()
+        flow = Flow.start(weather_agent(), name="dressing", step_cache=cache).map(
+            lambda report: WeatherReport(city=report.city.upper(), degree=report.degree)).next(advice_agent())
+        flow.run(QUERY)
+
+        advice = advice_agent()
+        changed = Flow.start(weather_agent(), name="dressing", step_cache=cache).map(
+            lambda report: WeatherReport(city=report.city.title(), degree=report.degree)).next(advice)
+        changed.run(QUERY)
+
+        # mapper的源码变了所以重新执行，输出变化后下游也重新执行
+        assert advice.model.calls == 1
+        assert advice.model.prompts[0].startswith("Dressing advice for 32")
+
+    def test_unchanged_upstream_output_skips_downstream(self):
+        cache = StepCache()
+        dressing_flow(cache, weather_agent(), advice_agent()).run(QUERY)
+
+        weather = Agent(
+            name="weather_agent",
+            model=FakeChatModel(responses=[json.dumps({"city": "beijing", "degree": 32})]),
+            prompt_template="What is the weather in {arg.city}?",
+            input_type=WeatherQuery,
+            output_type=WeatherReport
+        )
+        advice = advice_agent()
+        dressing_flow(cache, weather, advice).run(QUERY)
+
+        # 上游重新执行但输出相同，下游直接复用
+        assert (weather.model.calls, advice.model.calls) == (1, 0)
+
+    def test_case_predicate_is_part_of_fingerprint(self):
+        hot = Flow.start(weather_agent()).case(
+            when(lambda report: report.degree > 30).then(advice_agent()), default(advice_agent()))
+        warm = Flow.start(weather_agent()).case(
+            when(lambda report: report.degree > 20).then(advice_agent()), default(advice_agent()))
+
+        assert fingerprint(hot._tasks[1]) != fingerprint(warm._tasks[1])
+        assert fingerprint(hot._tasks[0]) == fingerprint(warm._tasks[0])
+
+    def test_persistent_store(self, tmp_path):
+        path = str(tmp_path / "steps.db")
+        cache = StepCache(path)
+        dressing_flow(cache, weather_agent(), advice_agent()).run(QUERY)
+        cache.close()
+
+        cache = StepCache(path)
+        weather, advice = weather_agent(), advice_agent()
+        result = dressing_flow(cache, weather, advice).run(QUERY)
+
+        assert result == DressingAdvice(suggestion="shorts")
+        assert (weather.model.calls, advice.model.calls) == (0, 0)
+        assert len(cache) == 2
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_async_run(self):
+        cache = StepCache()
+        weather, advice = weather_agent(), advice_agent()
+        flow = dressing_flow(cache, weather, advice)
+
+        asyncio.run(flow.arun(QUERY))
+        result = asyncio.run(flow.arun(QUERY))
+
+        assert result == DressingAdvice(suggestion="shorts")
+        assert (weather.model.calls, advice.model.calls) == (1, 1)
+
+    def test_results_that_do_not_round_trip_are_not_cached(self):
+        cache = StepCache()
+        mapped = []
+
+        def to_pair(report: WeatherReport) -> tuple:
+            mapped.append(report)
+            return report.city, report.degree
+
+        flow = Flow.start(weather_agent(), name="pairs", step_cache=cache).map(to_pair).map(
+            lambda pair: f"{type(pair).__name__}:{pair[0]}")
+
+        assert flow.run(QUERY) == flow.run(QUERY) == "tuple:beijing"
+        # tuple会被还原为list，所以每次都重新执行
+        assert len(mapped) == 2
+        assert not cache.put("key", {1, 2})
+        assert not cache.put("key", ("beijing", 32))
+        assert cache.put("key", QUERY, WeatherQuery)
+
+    def test_fingerprint_computed_once_per_step(self, monkeypatch):
+        import tudi.flow
+        calls = []
+        monkeypatch.setattr(tudi.flow, "fingerprint", lambda task: calls.append(task) or fingerprint(task))
+        flow = dressing_flow(StepCache(), weather_agent(), advice_agent())
+
+        for _ in range(3):
+            flow.run(QUERY)
+
+        assert len(calls) == 2
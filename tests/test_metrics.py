@@ -0,0 +1,185 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.tools import tool
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, metrics, when
+from tudi.batching import MicroBatching
+from tudi.consistency import SelfConsistency
+from tudi.testing import FakeChatModel
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+@tool
+def get_weather(city: str) -> str:
+    """Gets the weather for a given city"""
+    return f"the weather of {city} is 35°C"
+
+
+@pytest.fixture
+def registry():
+    metrics.registry.reset()
+    metrics.registry.enable()
+    yield metrics.registry
+    metrics.registry.disable()
+    metrics.registry.reset()
+
+
+def dressing_agent(name: str, suggestion: str) -> Agent:
+    return Agent(
+        name=name,
+        model=FakeChatModel(responses=[f'{{"suggestion": "{suggestion}"}}']),
+        prompt_template="Give a dressing code for {arg.degree}°C",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+def create_flow(degree: int) -> Flow:
+    weather_agent = Agent(
+        name="weather_agent",
+        model=FakeChatModel(responses=[f'{{"city": "guangzhou", "degree": {degree}}}']),
+        prompt_template="Answer the weather report: {input}",
+        output_type=WeatherReport
+    )
+    return Flow.start(weather_agent, name="weather_flow").case(
+        when(lambda weather: weather.degree > 30).then(dressing_agent("summer_dressing", "Athleisure")),
+        default(dressing_agent("default_dressing", "Smart Casual"))
+    )
+
+
+def values(snapshot: dict, name: str) -> dict:
+    return {tuple(sorted(item["labels"].items())): item.get("value", item.get("count"))
+            for item in snapshot["counters"].get(name, snapshot["histograms"].get(name, []))}
+
+
+class TestMetrics:
+    def test_record_flow_agents_and_branches(self, registry):
+        flow = create_flow(35)
+        flow.run("guangzhou")
+        flow.run("guangzhou")
+
+        snapshot = registry.snapshot()
+        assert values(snapshot, metrics.CASE_BRANCHES) == {(("branch", "when[0]:summer_dressing"),): 2}
+        assert values(snapshot, metrics.MODEL_CALLS)[(("agent", "weather_agent"),)] == 2
+        assert values(snapshot, metrics.AGENT_LATENCY)[(("agent", "summer_dressing"),)] == 2
+        assert values(snapshot, metrics.STEP_LATENCY) == {
+            (("flow", "weather_flow"), ("step", "0:Agent:weather_agent")): 2,
+            (("flow", "weather_flow"), ("step", "1:CaseStatement")): 2,
+        }
+        assert values(snapshot, metrics.PROMPT_TOKENS)[(("agent", "weather_agent"),)] > 0
+
+    def test_record_default_branch(self, registry):
+        create_flow(20).run("beijing")
+
+        assert values(registry.snapshot(), metrics.CASE_BRANCHES) == {
+            (("branch", "default:default_dressing"),): 1
+        }
+
+    def test_record_parse_failures(self, registry):
+        agent = dressing_agent("broken", "x")
+        agent.model.responses = ["not json"]
+
+        with pytest.raises(OutputParserException):
+            agent.run(WeatherReport(city="beijing", degree=20))
+
+        snapshot = registry.snapshot()
+        assert values(snapshot, metrics.PARSE_FAILURES) == {(("agent", "broken"),): 1}
+        assert values(snapshot, metrics.AGENT_RUNS) == {(("agent", "broken"), ("outcome", "parse_failure")): 1}
+
+    def test_record_agent_batch(self, registry):
+        agent = dressing_agent("batch", "x")
+        agent.model.respond = lambda prompt: "not json" if "-5" in prompt else '{"suggestion": "coat"}'
+
+        results = agent.run_batch([WeatherReport(city="beijing", degree=20),
+                                   WeatherReport(city="harbin", degree=-5)], return_exceptions=True)
+
+        assert isinstance(results[1], OutputParserException)
+        snapshot = registry.snapshot()
+        assert values(snapshot, metrics.AGENT_RUNS) == {
+            (("agent", "batch"), ("outcome", "success")): 1,
+            (("agent", "batch"), ("outcome", "parse_failure")): 1,
+        }
+        assert values(snapshot, metrics.MODEL_CALLS) == {(("agent", "batch"),): 2}
+        assert values(snapshot, metrics.PROMPT_TOKENS)[(("agent", "batch"),)] > 0
+
+    def test_estimate_prompt_tokens_per_concurrent_call(self, registry):
+        class NoUsageModel(FakeChatModel):
+            def _usage(self, prompt: str, text: str) -> None:
+                return None
+
+        def respond(prompt: str) -> str:
+            time.sleep(0.05)
+            return '{"suggestion": "coat"}'
+
+        report = WeatherReport(city="beijing", degree=20)
+        single = dressing_agent("single", "x")
+        single.replace_model(NoUsageModel(respond=respond))
+        single.run(report)
+        sampled = dressing_agent("sampled", "x")
+        sampled.replace_model(NoUsageModel(respond=respond))
+        sampled.self_consistency = SelfConsistency(samples=4, agree=4)
+        sampled.run(report)
+
+        # 并发的采样各自估算prompt的token数，不会丢失或重复计算
+        tokens = values(registry.snapshot(), metrics.PROMPT_TOKENS)
+        assert tokens[(("agent", "sampled"),)] == 4 * tokens[(("agent", "single"),)] > 0
+
+    def test_record_micro_batched_agent(self, registry):
+        agent = Agent(name="micro", model=FakeChatModel(responses=['{"suggestion": "coat"}']),
+                      prompt_template="Give a dressing code for {arg.degree}°C", input_type=WeatherReport,
+                      output_type=DressingAdvice, micro_batching=MicroBatching(max_batch_size=4, max_wait=1))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(agent.run, [WeatherReport(city="beijing", degree=i) for i in range(4)]))
+
+        snapshot = registry.snapshot()
+        assert agent._batcher.batches == 1
+        assert values(snapshot, metrics.MODEL_CALLS) == {(("agent", "micro"),): 4}
+        assert values(snapshot, metrics.PROMPT_TOKENS)[(("agent", "micro"),)] > 0
+
+    def test_record_tool_calls(self, registry):
+        action = '''Action:
+```
+{"action": "get_weather", "action_input": "guangzhou"}
+```'''
+        agent = Agent(name="weather_agent", model=FakeChatModel(responses=[action, "Final Answer: 35°C"]),
+                      tools=[get_weather])
+
+        agent.run("What is the weather in Guangzhou?")
+
+        snapshot = registry.snapshot()
+        assert values(snapshot, metrics.TOOL_CALLS) == {(("agent", "weather_agent"), ("tool", "get_weather")): 1}
+        assert values(snapshot, metrics.MODEL_CALLS) == {(("agent", "weather_agent"),): 2}
+
+    def test_render_prometheus(self, registry):
+        registry.inc(metrics.MODEL_CALLS, agent='say "hi"')
+        registry.observe(metrics.TOOL_LATENCY, 0.2, agent="a", tool="t")
+
+        text = registry.render_prometheus()
+
+        assert "# TYPE tudi_model_calls_total counter" in text
+        assert 'tudi_model_calls_total{agent="say \\"hi\\""} 1' in text
+        assert 'tudi_tool_latency_seconds_bucket{agent="a",tool="t",le="0.1"} 0' in text
+        assert 'tudi_tool_latency_seconds_bucket{agent="a",tool="t",le="0.25"} 1' in text
+        assert 'tudi_tool_latency_seconds_bucket{agent="a",tool="t",le="+Inf"} 1' in text
+        assert 'tudi_tool_latency_seconds_count{agent="a",tool="t"} 1' in text
+
+    def test_record_nothing_when_disabled(self):
+        metrics.registry.reset()
+        create_flow(35).run("guangzhou")
+
+        snapshot = metrics.registry.snapshot()
+        assert all(not items for items in snapshot["counters"].values())
+        assert all(not items for items in snapshot["histograms"].values())
@@ -0,0 +1,181 @@
+import asyncio
+import gzip
+import threading
+import time
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, when
+from tudi.runlog import RunLog
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+def dressing_flow(run_log: RunLog) -> Flow:
+    weather_agent = Agent(
+        name="weather_agent",
+        model=FakeChatModel(respond=lambda prompt: '{"city": "beijing", "degree": 32}'),
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+    hot_agent = Agent(
+        name="hot_agent",
+        model=FakeChatModel(responses=['{"suggestion": "shorts"}']),
+        prompt_template="Dressing advice for {arg.degree}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+    cold_agent = Agent(
+        name="cold_agent",
+        model=FakeChatModel(responses=['{"suggestion": "coat"}']),
+        prompt_template="Dressing advice for {arg.degree}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+    return (Flow.start(weather_agent, name="dressing", run_log=run_log)
+            .case(when(lambda report: report.degree > 30).then(hot_agent), default(cold_agent)))
+
+
+class TestRunLog:
+    @pytest.mark.parametrize("format", ["jsonl", "sqlite"])
+    def test_record_flow_run(self, tmp_path, format):
+        with RunLog(str(tmp_path / "runs.log"), format=format) as run_log:
+            flow = dressing_flow(run_log)
+            result = flow.run(WeatherQuery(city="beijing"))
+            assert run_log.flush(timeout=5)
+
+            events = run_log.query(flow="dressing")
+            assert [event["kind"] for event in events] == ["run_start", "step", "branch", "step", "run_end"]
+            assert len({event["run_id"] for event in events}) == 1
+            assert events[0]["input"] == {"city": "beijing"}
+            assert events[1]["agent"] == "weather_agent"
+            assert events[1]["output"] == {"city": "beijing", "degree": 32}
+            assert events[2]["branch"] == "when[0]:hot_agent"
+            assert events[2]["agent"] == "hot_agent"
+            assert events[-1]["output"] == result.model_dump()
+            assert all(event["duration"] >= 0 for event in events if "duration" in event)
+
+    def test_query_by_agent_and_time(self, tmp_path):
+        with RunLog(str(tmp_path / "runs.db"), format="sqlite") as run_log:
+            flow = dressing_flow(run_log)
+            flow.run(WeatherQuery(city="beijing"))
+            run_log.flush(timeout=5)
+            middle = time.time()
+            flow.run(WeatherQuery(city="shanghai"))
+            run_log.flush(timeout=5)
+
+            assert len(run_log.query(agent="hot_agent")) == 2
+            assert run_log.query(agent="cold_agent") == []
+            assert [event["input"] for event in run_log.query(since=middle) if event["kind"] == "run_start"] == \
+                [{"city": "shanghai"}]
+
+            runs = run_log.runs(agent="hot_agent")
+            assert len(runs) == 2
+            assert all(events[-1]["kind"] == "run_end" for events in runs.values())
+
+    def test_record_async_run_and_failure(self, tmp_path):
+        with RunLog(str(tmp_path / "runs.log")) as run_log:
+            flow = dressing_flow(run_log)
+            asyncio.run(flow.arun(WeatherQuery(city="beijing")))
+
+            failing = Flow.start(Agent(
+                name="broken_agent",
+                model=FakeChatModel(responses=["not json"]),
+                prompt_template="Report the weather of {arg.city}",
+                input_type=WeatherQuery,
+                output_type=WeatherReport
+            ), run_log=run_log)
+            with pytest.raises(OutputParserException):
+                failing.run(WeatherQuery(city="beijing"))
+            run_log.flush(timeout=5)
+
+            kinds = [event["kind"] for event in run_log.query(flow="dressing")]
+            assert kinds == ["run_start", "step", "branch", "step", "run_end"]
+            errors = run_log.query(flow="broken_agent")
+            assert [event["kind"] for event in errors] == ["run_start", "run_error"]
+
+    def test_rotate(self, tmp_path):
+        path = tmp_path / "runs.log"
+        with RunLog(str(path), batch_size=1, max_bytes=200, backup_count=2) as run_log:
+            flow = dressing_flow(run_log)
+            for _ in range(5):
+                flow.run(WeatherQuery(city="beijing"))
+                run_log.flush(timeout=5)
+
+            assert (tmp_path / "runs.log.1").exists()
+            assert (tmp_path / "runs.log.2").exists()
+            assert not (tmp_path / "runs.log.3").exists()
+            events = run_log.query()
+            assert 0 < len(events) < 25
+            assert events == sorted(events, key=lambda event: event["ts"])
+
+    def test_drop_when_full(self, tmp_path):
+        with RunLog(str(tmp_path / "runs.log"), capacity=3, flush_interval=60) as run_log:
+            accepted = [run_log.emit({"ts": time.time(), "kind": "test", "index": i}) for i in range(10)]
+            assert accepted[:3] == [True] * 3
+            assert run_log.dropped == 7
+            run_log.flush(timeout=5)
+            assert [event["index"] for event in run_log.query()] == [0, 1, 2]
+
+    def test_block_when_full(self, tmp_path):
+        with RunLog(str(tmp_path / "runs.log"), capacity=2, policy="block", flush_interval=0.05) as run_log:
+            emitter = threading.Thread(target=lambda: [run_log.emit({"ts": time.time(), "index": i})
+                                                       for i in range(20)])
+            emitter.start()
+            emitter.join(timeout=5)
+            assert not emitter.is_alive()
+            run_log.flush(timeout=5)
+
+            assert run_log.dropped == 0
+            assert [event["index"] for event in run_log.query()] == list(range(20))
+
+    def test_flush_waits_for_events_being_written(self, tmp_path):
+        with RunLog(str(tmp_path / "runs.log"), batch_size=1, flush_interval=60) as run_log:
+            for i in range(50):
+                run_log.emit({"ts": time.time(), "index": i})
+                # 后台线程可能正在写上一批，flush返回时刚追加的事件也必须已经写出
+                assert run_log.flush(timeout=5)
+                assert run_log.written == i + 1
+
+    def test_log_write_errors(self, tmp_path, caplog, monkeypatch):
+        with RunLog(str(tmp_path / "runs.log"), flush_interval=60) as run_log:
+            monkeypatch.setattr(run_log._writer, "write", lambda events: 1 / 0)
+            run_log.emit({"ts": time.time(), "index": 0})
+
+            assert run_log.flush(timeout=5)
+            assert run_log.written == 0
+            assert "run log events" in caplog.text
+
+    def test_query_while_last_member_is_being_written(self, tmp_path):
+        path = tmp_path / "runs.log"
+        with RunLog(str(path), flush_interval=60) as run_log:
+            run_log.emit({"ts": time.time(), "index": 0})
+            assert run_log.flush(timeout=5)
+            member = gzip.compress(b'{"ts": 1, "index": 1}\n')
+            for cut in (5, len(member) // 2):
+                with open(path, "ab") as f:
+                    f.write(member[:cut])
+                assert [event["index"] for event in run_log.query()] == [0]
+                # 还原为只有完整成员的文件
+                path.write_bytes(path.read_bytes()[:-cut])
+
+    def test_invalid_options(self, tmp_path):
+        with pytest.raises(ValueError):
+            RunLog(str(tmp_path / "runs.log"), format="csv")
+        with pytest.raises(ValueError):
+            RunLog(str(tmp_path / "runs.log"), policy="wait")
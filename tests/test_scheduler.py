@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, metrics
+from tudi.batching import MicroBatching
+from tudi.scheduler import ModelScheduler, current_schedule, scheduling
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+def queue_calls(scheduler: ModelScheduler, calls, order: list) -> list:
+    """依次让每个调用进入队列，等它排上队后再启动下一个，保证入队顺序确定"""
+    threads = []
+    for label, priority, tenant in calls:
+        def run(label=label, priority=priority, tenant=tenant):
+            with scheduler.slot(priority, tenant):
+                order.append(label)
+
+        depth = scheduler.queue_depth()
+        thread = threading.Thread(target=run)
+        thread.start()
+        while scheduler.queue_depth() == depth:
+            time.sleep(0.001)
+        threads.append(thread)
+    return threads
+
+
+def run_while_blocked(scheduler: ModelScheduler, calls) -> list:
+    order = []
+    with scheduler.slot():
+        threads = queue_calls(scheduler, calls, order)
+    for thread in threads:
+        thread.join(timeout=5)
+    return order
+
+
+class TestModelScheduler:
+    def test_interactive_before_batch(self):
+        scheduler = ModelScheduler()
+        order = run_while_blocked(scheduler, [
+            ("batch-1", "batch", "etl"),
+            ("batch-2", "batch", "etl"),
+            ("interactive", "interactive", "chat"),
+        ])
+        assert order == ["interactive", "batch-1", "batch-2"]
+
+    def test_weighted_fair_queuing_across_tenants(self):
+        scheduler = ModelScheduler(weights={"a": 2})
+        calls = [(f"a{i}", "batch", "a") for i in range(6)] + [(f"b{i}", "batch", "b") for i in range(6)]
+        order = run_while_blocked(scheduler, calls)
+
+        first = [label[0] for label in order[:6]]
+        assert first.count("a") == 4
+        assert first.count("b") == 2
+        assert order[2] == "b0"
+
+    def test_starvation_guard(self):
+        scheduler = ModelScheduler(max_wait=0.05)
+        order = []
+        with scheduler.slot():
+            threads = queue_calls(scheduler, [("batch", "batch", "etl")], order)
+            time.sleep(0.1)
+            threads += queue_calls(scheduler, [("interactive", "interactive", "chat")], order)
+        for thread in threads:
+            thread.join(timeout=5)
+        assert order == ["batch", "interactive"]
+
+    def test_async_cancel_while_queued(self):
+        scheduler = ModelScheduler()
+
+        async def main():
+            async with scheduler.aslot():
+                waiting = asyncio.create_task(scheduler.aslot().__aenter__())
+                await asyncio.sleep(0.01)
+                assert scheduler.queue_depth() == 1
+                waiting.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await waiting
+                assert scheduler.queue_depth() == 0
+            async with scheduler.aslot():
+                assert scheduler.running == 1
+
+        asyncio.run(main())
+        assert scheduler.running == 0
+
+    def test_invalid_options(self):
+        with pytest.raises(ValueError):
+            ModelScheduler(max_concurrency=0)
+        with pytest.raises(ValueError):
+            ModelScheduler(weights={"a": 0})
+        with pytest.raises(ValueError):
+            with ModelScheduler().slot("urgent"):
+                pass
+
+
+class TestScheduledChatModel:
+    @pytest.fixture
+    def registry(self):
+        metrics.registry.reset()
+        metrics.registry.enable()
+        yield metrics.registry
+        metrics.registry.disable()
+        metrics.registry.reset()
+
+    def test_agents_share_scheduled_model(self, registry):
+        scheduler = ModelScheduler(max_concurrency=1)
+        model = scheduler.wrap(FakeChatModel(responses=['{"city": "beijing", "degree": 24}'], latency=0.05))
+        agent = Agent(
+            name="weather_agent",
+            model=model,
+            prompt_template="Report the weather of {arg.city}",
+            input_type=WeatherQuery,
+            output_type=WeatherReport
+        )
+        flow = Flow.start(agent)
+
+        def batch_job():
+            with scheduling("batch", tenant="reports"):
+                for _ in range(3):
+                    flow.run(WeatherQuery(city="beijing"))
+
+        jobs = [threading.Thread(target=batch_job) for _ in range(2)]
+        for job in jobs:
+            job.start()
+        result = asyncio.run(agent.arun(WeatherQuery(city="beijing")))
+        for job in jobs:
+            job.join(timeout=10)
+
+        assert result == WeatherReport(city="beijing", degree=24)
+        assert model.bound.calls == 7
+        assert scheduler.running == 0
+        snapshot = registry.snapshot()
+        waits = snapshot["histograms"][metrics.SCHEDULER_WAIT]
+        assert {item["labels"]["priority"]: item["count"] for item in waits} == {"batch": 6, "interactive": 1}
+        depths = {item["labels"]["priority"]: item["value"]
+                  for item in snapshot["gauges"][metrics.SCHEDULER_QUEUE_DEPTH]}
+        assert depths == {"batch": 0, "interactive": 0}
+
+    def test_micro_batches_keep_caller_schedule(self, registry):
+        scheduler = ModelScheduler(max_concurrency=4)
+        schedules = []
+        model = FakeChatModel(respond=lambda prompt: schedules.append(current_schedule())
+                              or '{"city": "beijing", "degree": 24}')
+        agent = Agent(
+            name="weather_agent",
+            model=scheduler.wrap(model),
+            prompt_template="Report the weather of {arg.city}",
+            input_type=WeatherQuery,
+            output_type=WeatherReport,
+            micro_batching=MicroBatching(max_batch_size=2, max_wait=1)
+        )
+
+        def run(priority: str) -> WeatherReport:
+            with scheduling(priority, tenant=f"{priority}-tenant"):
+                return agent.run(WeatherQuery(city="beijing"))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(run, ["batch", "interactive", "batch", "interactive"]))
+
+        # 不同优先级的调用分到不同的批次，模型调用按各自调用方的优先级和租户排队
+        assert results == [WeatherReport(city="beijing", degree=24)] * 4
+        assert agent._batcher.batches == 2
+        assert sorted(schedules) == [("batch", "batch-tenant")] * 2 + [("interactive", "interactive-tenant")] * 2
+        waits = registry.snapshot()["histograms"][metrics.SCHEDULER_WAIT]
+        assert {item["labels"]["priority"]: item["count"] for item in waits} == {"batch": 2, "interactive": 2}
+
+    def test_stream_holds_slot(self):
+        scheduler = ModelScheduler()
+        model = scheduler.wrap(FakeChatModel(responses=["a b c"]))
+
+        chunks = []
+        for chunk in model.stream("hello"):
+            assert scheduler.running == 1
+            chunks.append(chunk.content)
+        assert "".join(chunks) == "a b c"
+        assert scheduler.running == 0
@@ -0,0 +1,147 @@
+import hashlib
+import re
+
+import numpy as np
+import pytest
+from pydantic import BaseModel
+
+from tudi import Agent
+from tudi.semantic_cache import LshIndex, SemanticCache, VectorIndex
+from tudi.testing import FakeChatModel
+
+STOP_WORDS = {"the", "a", "an", "is", "what", "in", "please", "tell", "me", "of"}
+
+
+def embed(text: str) -> list[float]:
+    """确定性的词袋哈希embedding"""
+    vector = [0.0] * 64
+    for word in re.findall(r"\w+", text.lower()):
+        if word in STOP_WORDS:
+            continue
+        bucket = int(hashlib.md5(word.encode()).hexdigest(), 16) % 64
+        vector[bucket] += 1.0
+    return vector
+
+
+class Question(BaseModel):
+    text: str
+
+
+class Answer(BaseModel):
+    answer: str
+
+
+def create_agent(cache: SemanticCache, model: FakeChatModel, name: str = "qa") -> Agent:
+    return Agent(
+        name=name,
+        model=model,
+        prompt_template="Answer: {arg.text}",
+        input_type=Question,
+        output_type=Answer,
+        cache=cache
+    )
+
+
+class TestSemanticCache:
+    def test_hit_for_similar_prompt(self):
+        model = FakeChatModel(responses=['{"answer": "24"}'])
+        cache = SemanticCache(embed, threshold=0.9)
+        agent = create_agent(cache, model)
+
+        first = agent.run(Question(text="What is the weather in Beijing?"))
+        second = agent.run(Question(text="Please tell me the weather of Beijing"))
+
+        assert first == second == Answer(answer="24")
+        assert model.calls == 1
+        assert cache.stats.hits == 1
+        assert cache.stats.hit_rate == 0.5
+
+    def test_miss_for_different_prompt(self):
+        model = FakeChatModel(responses=['{"answer": "24"}', '{"answer": "35"}'])
+        agent = create_agent(SemanticCache(embed, threshold=0.9), model)
+
+        agent.run(Question(text="What is the weather in Beijing?"))
+        result = agent.run(Question(text="What is the weather in Guangzhou?"))
+
+        assert result.answer == "35"
+        assert model.calls == 2
+
+    def test_scoped_per_agent(self):
+        cache = SemanticCache(embed)
+        model = FakeChatModel(responses=['{"answer": "24"}'])
+        create_agent(cache, model, name="first").run(Question(text="weather in Beijing"))
+        create_agent(cache, model, name="second").run(Question(text="weather in Beijing"))
+
+        assert model.calls == 2
+
+    def test_evict_least_recently_used(self):
+        cache = SemanticCache(embed, max_size=2)
+        cache.store("scope", "beijing", "a")
+        cache.store("scope", "guangzhou", "b")
+        cache.lookup("scope", "beijing")
+        cache.store("scope", "shanghai", "c")
+
+        assert len(cache) == 2
+        assert cache.lookup("scope", "guangzhou") is None
+        assert cache.lookup("scope", "beijing") == "a"
+        assert cache.stats.evictions == 1
+
+    def test_report_false_hit(self):
+        model = FakeChatModel(responses=['{"answer": "24"}', '{"answer": "25"}'])
+        cache = SemanticCache(embed, threshold=0.5)
+        agent = create_agent(cache, model)
+        agent.run(Question(text="weather in Beijing today"))
+        agent.run(Question(text="weather in Beijing tomorrow"))
+
+        agent.report_false_cache_hit(Question(text="weather in Beijing tomorrow"))
+
+        assert cache.stats.false_hits == 1
+        assert cache.stats.false_hit_rate == 1.0
+        assert len(cache) == 0
+
+    def test_persist_to_disk(self, tmp_path):
+        path = str(tmp_path / "cache.json")
+        cache = SemanticCache(embed, path=path)
+        cache.store("scope", "weather in Beijing", {"answer": "24"})
+        cache.save()
+
+        loaded = SemanticCache(embed, path=path)
+
+        assert loaded.lookup("scope", "weather in Beijing", Answer) == Answer(answer="24")
+
+    def test_lsh_index_finds_nearest(self):
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((200, 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        exact, lsh = VectorIndex(16), LshIndex(16)
+        for i, vector in enumerate(vectors):
+            exact.add(i, vector)
+            lsh.add(i, vector)
+
+        assert lsh.search(vectors[42]) == exact.search(vectors[42])
+
+    def test_switch_to_ann_index(self):
+        cache = SemanticCache(embed, ann_threshold=2)
+        for word in ["beijing", "guangzhou", "shanghai"]:
+            cache.store("scope", word, word)
+
+        assert isinstance(cache._indexes["scope"], LshIndex)
+        assert cache.lookup("scope", "shanghai") == "shanghai"
+
+    def test_remove_keeps_indexes_consistent(self):
+        rng = np.random.default_rng(2)
+        vectors = rng.standard_normal((300, 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        exact, lsh = VectorIndex(16, capacity=1), LshIndex(16)
+        for i, vector in enumerate(vectors):
+            exact.add(i, vector)
+            lsh.add(i, vector)
+        for i in range(0, 300, 3):
+            exact.remove(i)
+            lsh.remove(i)
+
+        assert len(exact) == len(lsh) == 200
+        assert exact.search(vectors[0])[0] != 0
+        for i in (1, 2, 149, 299):
+            assert exact.search(vectors[i]) == (i, pytest.approx(1.0))
+            assert lsh.search(vectors[i]) == (i, pytest.approx(1.0))
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+from pydantic import BaseModel
+
+from tudi import Agent, Flow
+from tudi.serving import FlowServer
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+def create_flow(latency: float = 0.0) -> Flow:
+    weather_agent = Agent(
+        name="weather agent",
+        model=FakeChatModel(responses=['{"city": "beijing", "degree": 24}'], latency=latency),
+        prompt_template="Answer the weather report: {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport
+    )
+    return Flow.start(weather_agent)
+
+
+async def request(port: int, method: str, path: str, payload=None) -> tuple[int, dict]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = b"" if payload is None else json.dumps(payload).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                 + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(content)
+
+
+def run_with_server(server: FlowServer, scenario):
+    async def main():
+        await server.start()
+        try:
+            return await scenario(server.port)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+class TestServing:
+    def test_run_flow(self):
+        server = FlowServer(create_flow(), port=0)
+
+        status, body = run_with_server(server, lambda port: request(port, "POST", "/run", {"city": "beijing"}))
+
+        assert status == 200
+        assert body == {"output": {"city": "beijing", "degree": 24}}
+
+    def test_reject_invalid_input(self):
+        server = FlowServer(create_flow(), port=0)
+
+        status, body = run_with_server(server, lambda port: request(port, "POST", "/run", {"town": "beijing"}))
+
+        assert status == 422
+        assert "city" in body["error"]
+
+    def test_health_and_stats(self):
+        server = FlowServer(create_flow(), port=0)
+
+        async def scenario(port):
+            await request(port, "POST", "/run", {"city": "beijing"})
+            return await request(port, "GET", "/health"), await request(port, "GET", "/stats")
+
+        health, stats = run_with_server(server, scenario)
+
+        assert health == (200, {"status": "ok"})
+        assert stats[0] == 200
+        assert stats[1]["completed"] == 1
+        assert stats[1]["in_flight"] == 0
+
+    def test_shed_load_when_queue_is_full(self):
+        server = FlowServer(create_flow(latency=0.3), port=0, max_in_flight=1, max_queue=1)
+
+        async def scenario(port):
+            return await asyncio.gather(*[request(port, "POST", "/run", {"city": "beijing"}) for _ in range(4)])
+
+        statuses = sorted(status for status, _ in run_with_server(server, scenario))
+
+        assert statuses.count(200) == 2
+        assert statuses.count(429) == 2
+        assert server.stats.rejected == 2
+
+    def test_overlong_header_gets_a_response(self):
+        async def scenario(port):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /health HTTP/1.1\r\nX-Long: " + b"a" * 100_000 + b"\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return int(response.split()[1])
+
+        assert run_with_server(FlowServer(create_flow(), port=0), scenario) == 431
+
+    def test_unexpected_error_returns_500(self, monkeypatch):
+        def fail(value, value_type=None):
+            raise TypeError("not serializable")
+
+        monkeypatch.setattr("tudi.serving.to_jsonable", fail)
+
+        async def scenario(port):
+            return await request(port, "POST", "/run", {"city": "beijing"})
+
+        status, body = run_with_server(FlowServer(create_flow(), port=0), scenario)
+        assert status == 500
+        assert body == {"error": "TypeError: not serializable"}
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+from tudi import Agent, Flow
+from tudi.singleflight import SingleFlight, input_key
+from tudi.testing import FakeChatModel
+
+
+class WeatherQuery(BaseModel):
+    city: str
+    options: dict = {}
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+def weather_agent(model: FakeChatModel, single_flight: bool = True) -> Agent:
+    return Agent(
+        name="weather_agent",
+        model=model,
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport,
+        single_flight=single_flight
+    )
+
+
+def slow_model(response: str = '{"city": "beijing", "degree": 24}') -> FakeChatModel:
+    return FakeChatModel(responses=[response], latency=0.2)
+
+
+class TestSingleFlight:
+    def test_input_key_is_canonical(self):
+        assert input_key(WeatherQuery(city="a", options={"x": 1, "y": 2})) == \
+            input_key(WeatherQuery(city="a", options={"y": 2, "x": 1}))
+        assert input_key(WeatherQuery(city="a")) != input_key(WeatherQuery(city="b"))
+
+    def test_collapse_concurrent_agent_calls(self):
+        model = slow_model()
+        agent = weather_agent(model)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(agent.run, [WeatherQuery(city="beijing")] * 8))
+
+        assert all(result == results[0] for result in results)
+        assert model.calls == 1
+        assert agent.single_flight.collapsed == 7
+
+    def test_share_exception(self):
+        agent = weather_agent(slow_model("not json"))
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(agent.run, WeatherQuery(city="beijing")) for _ in range(4)]
+
+        for future in futures:
+            with pytest.raises(OutputParserException):
+                future.result()
+        assert agent.single_flight.executed == 1
+
+    def test_run_again_after_completion(self):
+        model = FakeChatModel(responses=['{"city": "beijing", "degree": 24}'])
+        agent = weather_agent(model)
+
+        agent.run(WeatherQuery(city="beijing"))
+        agent.run(WeatherQuery(city="beijing"))
+
+        assert model.calls == 2
+
+    def test_collapse_async_flow_calls(self):
+        model = slow_model()
+        flow = Flow.start(weather_agent(model, single_flight=False), single_flight=True)
+
+        async def main():
+            return await asyncio.gather(*[flow.arun(WeatherQuery(city="beijing")) for _ in range(5)],
+                                        flow.arun(WeatherQuery(city="harbin")))
+
+        results = asyncio.run(main())
+
+        assert results[0].degree == 24
+        assert model.calls == 2
+        assert flow.single_flight.collapsed == 4
+
+    def test_async_exception_reaches_all_callers(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        async def fail():
+            started.set()
+            await asyncio.sleep(0.05)
+            raise ValueError("boom")
+
+        async def main():
+            return await asyncio.gather(*[flight.ado("key", fail) for _ in range(3)], return_exceptions=True)
+
+        results = asyncio.run(main())
+
+        assert [type(result) for result in results] == [ValueError] * 3
+        assert (flight.executed, flight.collapsed) == (1, 2)
+
+    def test_cancelling_leader_does_not_fail_followers(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "sunny"
+
+        async def main():
+            leader = asyncio.create_task(flight.ado("key", fetch))
+            await asyncio.sleep(0)
+            followers = [asyncio.create_task(flight.ado("key", fetch)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            results = await asyncio.gather(leader, *followers, return_exceptions=True)
+            return [type(result) if isinstance(result, BaseException) else result for result in results]
+
+        assert asyncio.run(main()) == [asyncio.CancelledError, "sunny", "sunny"]
+        assert (flight.executed, flight.collapsed) == (1, 2)
+
+    def test_cancelling_all_callers_cancels_the_call(self):
+        flight = SingleFlight()
+        finished = []
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            finished.append(True)
+
+        async def main():
+            callers = [asyncio.create_task(flight.ado("key", fetch)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            await asyncio.sleep(0.1)
+            return await flight.ado("key", lambda: asyncio.sleep(0, "again"))
+
+        assert asyncio.run(main()) == "again"
+        assert finished == []
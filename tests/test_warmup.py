@@ -0,0 +1,96 @@
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from tudi import Agent, Flow, default, route, when
+from tudi.cascade import ModelCascade
+from tudi.scheduler import ModelScheduler
+from tudi.testing import FakeChatModel
+from tudi.warmup import minimal_model
+
+
+class WeatherQuery(BaseModel):
+    city: str
+
+
+class WeatherReport(BaseModel):
+    city: str
+    degree: int
+
+
+class DressingAdvice(BaseModel):
+    suggestion: str
+
+
+class LimitedChatModel(FakeChatModel):
+    num_predict: Optional[int] = None
+    keep_alive: Optional[str] = None
+
+
+def report_agent(name: str, model: FakeChatModel, **kwargs) -> Agent:
+    return Agent(
+        name=name,
+        model=model,
+        prompt_template="Report the weather of {arg.city}",
+        input_type=WeatherQuery,
+        output_type=WeatherReport,
+        **kwargs
+    )
+
+
+def advice_agent(name: str, model: FakeChatModel) -> Agent:
+    return Agent(
+        name=name,
+        model=model,
+        prompt_template="Dressing advice for {arg.degree}",
+        input_type=WeatherReport,
+        output_type=DressingAdvice
+    )
+
+
+class TestWarmup:
+    def test_warmup_distinct_models_of_flow(self):
+        shared = FakeChatModel(responses=["ok"], latency=0.2)
+        hot = FakeChatModel(responses=["ok"], latency=0.2)
+        router = FakeChatModel(responses=["cold"], latency=0.2)
+        cheap = FakeChatModel(responses=["ok"], latency=0.2)
+
+        flow = (Flow.start(report_agent("weather_agent", shared, cascade=ModelCascade([cheap])))
+                .case(when(lambda report: report.degree > 30).then(advice_agent("hot_agent", hot)),
+                      default(advice_agent("mild_agent", shared)))
+                .next(Flow.start(advice_agent("nested_agent", shared)).map(lambda advice: advice))
+                .route(router, route("cold").then(advice_agent("cold_agent", shared)),
+                       default(advice_agent("warm_agent", hot))))
+
+        started = time.perf_counter()
+        reports = flow.warmup()
+        elapsed = time.perf_counter() - started
+
+        assert len(reports) == 4
+        assert all(report.error is None and report.seconds >= 0.2 for report in reports)
+        assert elapsed < 0.6
+        assert [model.calls for model in (shared, hot, router, cheap)] == [1, 1, 1, 1]
+        assert shared.prompts == ["ping"]
+
+    def test_agent_warmup_reports_errors(self):
+        def fail(prompt: str) -> str:
+            raise ConnectionError("model not loaded")
+
+        agent = report_agent("weather_agent", FakeChatModel(respond=fail))
+        [report] = agent.warmup()
+
+        assert report.model == "FakeChatModel"
+        assert report.error == "ConnectionError: model not loaded"
+
+    def test_minimal_model_with_keep_alive(self):
+        model = LimitedChatModel(responses=["ok"])
+        warm = minimal_model(model, keep_alive="30m")
+        assert warm.num_predict == 1
+        assert warm.keep_alive == "30m"
+        assert model.num_predict is None
+
+        scheduled = ModelScheduler().wrap(model)
+        assert minimal_model(scheduled, keep_alive="30m").bound.num_predict == 1
+        unlimited = FakeChatModel()
+        assert minimal_model(unlimited, keep_alive="30m") is unlimited
@@ -1,7 +1,8 @@
 from tudi.statements.case import default, when
+from tudi.statements.route import route
 
 from .agent import Agent
 from .flow import Flow
 
-__all__ = ['Agent', 'Flow', 'when', 'default']
+__all__ = ['Agent', 'Flow', 'when', 'default', 'route']
 
@@ -0,0 +1,5 @@
+import sys
+
+from tudi.cli import main
+
+sys.exit(main())
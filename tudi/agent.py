@@ -1,10 +1,17 @@
-from types import SimpleNamespace
-from typing import Any, Callable, List, Optional, Type, TypeVar
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Type, TypeVar, Union
 
-from langchain.agents import AgentExecutor, create_react_agent
+from langchain.agents.format_scratchpad import format_log_to_str
 from langchain.agents.output_parsers import ReActJsonSingleInputOutputParser
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.output_parsers import BaseOutputParser, PydanticOutputParser, StrOutputParser
+from langchain_core.prompt_values import PromptValue
 from langchain_core.prompts import (
     BasePromptTemplate,
     ChatPromptTemplate,
@@ -16,13 +23,36 @@ from langchain_core.runnables import Runnable, RunnablePassthrough
 from langchain_core.tools import render_text_description_and_args
 from pydantic import BaseModel
 
+from tudi import consistency, metrics, thinking
+from tudi.batching import MicroBatcher, MicroBatching
+from tudi.budget import AgentBudget, create_executor
+from tudi.cascade import ModelCascade
+from tudi.consistency import SelfConsistency
 from tudi.output_parsers import ThinkTagRemoverOutputParser
+from tudi.scheduler import current_schedule
+from tudi.scratchpad import Scratchpad
+from tudi.semantic_cache import SemanticCache, cache_scope
+from tudi.serialization import sample_value
+from tudi.singleflight import SingleFlight, input_key
+from tudi.streaming import PartialOutput, final_output, output_stream
+from tudi.templates import TemplateInputs
+from tudi.thinking import ThinkingBudget
+from tudi.tool_limits import ToolTimeoutError, acall_tool, call_tool
+from tudi.trajectory import TrajectoryCache
+from tudi.usage import track_message, tracked
+from tudi.warmup import ModelWarmup, warmup_models
 
-from .base import Task
+from .base import Task, batch_results
+
+logger = logging.getLogger(__name__)
 
 InputT = TypeVar('InputT', bound=BaseModel)
 OutputT = TypeVar('OutputT', bound=BaseModel)
 
+PROMPT_LAYOUTS = ("inline", "prefix_stable")
+
+_run_metadata: ContextVar[Optional[dict]] = ContextVar("tudi_run_metadata", default=None)
+
 
 class Agent(Task):
     def __init__(self,
@@ -31,9 +61,39 @@ class Agent(Task):
                  prompt_template: Optional[str] = None,
                  input_type: Optional[Type[InputT]] = None,
                  output_type: Optional[Type[OutputT]] = None,
-                 tools: Optional[List[Callable]] = None):
+                 tools: Optional[List[Callable]] = None,
+                 micro_batching: Optional[MicroBatching] = None,
+                 cache: Optional[SemanticCache] = None,
+                 scratchpad: Optional[Scratchpad] = None,
+                 budget: Optional[AgentBudget] = None,
+                 thinking_budget: Optional[ThinkingBudget] = None,
+                 cascade: Optional[ModelCascade] = None,
+                 max_field_chars: Optional[Dict[str, int]] = None,
+                 prompt_layout: str = "inline",
+                 single_flight: bool = False,
+                 trajectory_cache: Optional[TrajectoryCache] = None,
+                 self_consistency: Optional[SelfConsistency] = None):
         if input_type and not prompt_template:
             raise ValueError("prompt_template must be provided when input_type is set")
+        if micro_batching and tools:
+            raise ValueError("micro_batching is only supported for agents without tools")
+        if scratchpad and not tools:
+            raise ValueError("scratchpad is only supported for agents with tools")
+        if budget and not tools:
+            raise ValueError("budget is only supported for agents with tools")
+        if trajectory_cache is not None and not tools:
+            raise ValueError("trajectory_cache is only supported for agents with tools")
+        if thinking_budget and (tools or micro_batching):
+            raise ValueError("thinking_budget is only supported for agents without tools or micro_batching")
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"prompt_layout must be one of {', '.join(PROMPT_LAYOUTS)}")
+        if thinking_budget and prompt_layout == "prefix_stable":
+            raise ValueError("thinking_budget is only supported with the inline prompt layout")
+        if cascade and (tools or micro_batching or thinking_budget):
+            raise ValueError("cascade is only supported for agents without tools, micro_batching or thinking_budget")
+        if self_consistency and (tools or micro_batching or thinking_budget or cascade):
+            raise ValueError("self_consistency is only supported for agents without tools, micro_batching, "
+                             "thinking_budget or cascade")
 
         self.name = name
         self.model = model
@@ -43,9 +103,22 @@ class Agent(Task):
         base_parser = PydanticOutputParser(pydantic_object=output_type) if output_type else StrOutputParser()
         self.output_parser = ThinkTagRemoverOutputParser(parser=base_parser) if base_parser else None
         self.tools = tools or []
+        self.scratchpad = scratchpad
+        self.budget = budget
+        self.thinking_budget = thinking_budget
+        self.cascade = cascade
+        self.trajectory_cache = trajectory_cache
+        self.self_consistency = self_consistency
+        self._template_inputs = TemplateInputs(prompt_template, max_field_chars)
+        self.prompt_layout = prompt_layout
+        self.single_flight = SingleFlight(name) if single_flight else None
         self._prompt_template = self._init_prompt_template(prompt_template, tools, self.output_parser)
         self._runnable = self._init_runnable(model, tools, self._prompt_template)
         self._result_template = self._init_result_template()
+        # 不同调度优先级和租户的调用不合并，批次按调用方的scheduling排队
+        self._batcher = MicroBatcher(self._run_batch, micro_batching, key=current_schedule) if micro_batching else None
+        self.cache = cache
+        self._cache_scope = cache_scope(name, output_type)
 
     @property
     def input_type(self) -> Type[InputT]:
@@ -61,11 +134,17 @@ class Agent(Task):
 
         return self._create_agent_prompt()
 
-    def _init_result_template(self) -> Optional[PromptTemplate]:
+    def _init_result_template(self) -> Optional[BasePromptTemplate]:
         if not self.output_type:
             return None
 
-        from tudi.prompts import TYPED_RESULT_PROMPT
+        from tudi.prompts import TYPED_RESULT_INPUT, TYPED_RESULT_INSTRUCTIONS, TYPED_RESULT_PROMPT
+        if self.prompt_layout == "prefix_stable":
+            return ChatPromptTemplate.from_messages([
+                SystemMessagePromptTemplate.from_template(TYPED_RESULT_INSTRUCTIONS),
+                HumanMessagePromptTemplate.from_template(TYPED_RESULT_INPUT),
+            ]).partial(format_instructions=self.output_parser.get_format_instructions())
+
         return PromptTemplate.from_template(
             template=TYPED_RESULT_PROMPT,
             partial_variables={"format_instructions": self.output_parser.get_format_instructions()}
@@ -75,38 +154,437 @@ class Agent(Task):
         if not tools:
             return model
 
-        agent = create_react_agent(model, tools, prompt_template,
-                                   tools_renderer=render_text_description_and_args,
-                                   output_parser=ReActJsonSingleInputOutputParser())
-        return AgentExecutor(agent=agent, tools=tools, verbose=True)
+        self._react_prompt = prompt_template.partial(
+            tools=render_text_description_and_args(list(tools)),
+            tool_names=", ".join([t.name for t in tools]),
+        )
+        agent = (
+            RunnablePassthrough.assign(agent_scratchpad=lambda x: self._format_scratchpad(x["intermediate_steps"]))
+            | self._react_prompt
+            | tracked(model.bind(stop=["\nObservation"]))
+            | ReActJsonSingleInputOutputParser()
+        )
+        return create_executor(agent, tools, self.budget, finalizer=self._force_final_answer,
+                               afinalizer=self._aforce_final_answer)
+
+    def prompt_prefix(self) -> List[BaseMessage]:
+        """prompt中与输入无关的前缀：开头的system消息，或者prompt_template第一个占位符之前的文本"""
+        template = self._react_prompt if self.tools else self._prompt_template
+        if isinstance(template, ChatPromptTemplate):
+            prefix = []
+            for message in template.messages:
+                if not isinstance(message, SystemMessagePromptTemplate):
+                    break
+                prefix.append(message.format(**template.partial_variables))
+            return prefix
+
+        constant = (self.prompt_template or "").split("{", 1)[0]
+        return [HumanMessage(constant)] if constant.strip() else []
+
+    def warmup(self, keep_alive: Union[str, int, None] = None) -> List[ModelWarmup]:
+        """预热Agent用到的模型（包括cascade中的各级模型），返回每个模型的预热耗时"""
+        self.prebuild()
+        return warmup_models(self.models(), keep_alive)
+
+    def models(self) -> List[BaseChatModel]:
+        return [*(self.cascade.models if self.cascade else []), self.model]
+
+    def prebuild(self) -> None:
+        """用示例输入渲染一次prompt，并解析一个示例结果，让模板和解析器提前完成首次调用时的初始化"""
+        try:
+            if self.input_type:
+                self._format_prompt(self.input_type.model_validate(sample_value(self.input_type)))
+            if self.output_type:
+                self._get_output_parser().parse(json.dumps(sample_value(self.output_type)))
+        except Exception as e:
+            logger.debug("Prebuilding %s failed: %s", self.name, e)
+
+    def replace_model(self, model: BaseChatModel, cascade_models: Optional[List[BaseChatModel]] = None) -> None:
+        """替换模型并重建调用链，例如压测时换成FakeChatModel；
+        有cascade时各级模型也一起替换，没有给出cascade_models时都换成model"""
+        if self.cascade:
+            tiers = cascade_models or [model] * len(self.cascade.models)
+            if len(tiers) != len(self.cascade.models):
+                raise ValueError(f"Expected {len(self.cascade.models)} cascade models, got {len(tiers)}")
+            self.cascade.models = list(tiers)
+        self.model = model
+        self._runnable = self._init_runnable(model, self.tools, self._prompt_template)
+
+    def _format_scratchpad(self, intermediate_steps) -> str:
+        if self.scratchpad:
+            return self.scratchpad.format(intermediate_steps)
+        return format_log_to_str(intermediate_steps)
+
+    def _force_final_answer(self, inputs: dict, intermediate_steps) -> str:
+        from tudi.prompts import FORCE_FINAL_ANSWER_PROMPT
+        return self._final_answer(inputs["input"], intermediate_steps, FORCE_FINAL_ANSWER_PROMPT)
+
+    async def _aforce_final_answer(self, inputs: dict, intermediate_steps) -> str:
+        from tudi.prompts import FORCE_FINAL_ANSWER_PROMPT
+        return await self._afinal_answer(inputs["input"], intermediate_steps, FORCE_FINAL_ANSWER_PROMPT)
+
+    def _final_answer(self, input_text: str, intermediate_steps, prompt: str) -> str:
+        chain = self._final_answer_chain()
+        scratchpad = self._format_scratchpad(intermediate_steps) + prompt
+        answer = chain.invoke({"input": input_text, "agent_scratchpad": scratchpad})
+        return answer.split("Final Answer:")[-1].strip()
+
+    async def _afinal_answer(self, input_text: str, intermediate_steps, prompt: str) -> str:
+        chain = self._final_answer_chain()
+        scratchpad = self._format_scratchpad(intermediate_steps) + prompt
+        answer = await chain.ainvoke({"input": input_text, "agent_scratchpad": scratchpad})
+        return answer.split("Final Answer:")[-1].strip()
+
+    def _final_answer_chain(self) -> Runnable:
+        return self._react_prompt | tracked(self.model) | self._get_output_parser()
+
+    @property
+    def last_run_metadata(self) -> dict:
+        """当前上下文中最近一次运行的附加信息，例如工具Agent的循环结束原因和token用量"""
+        return (_run_metadata.get() or {}).get(id(self), {})
+
+    def _set_run_metadata(self, metadata: dict) -> None:
+        _run_metadata.set({**(_run_metadata.get() or {}), id(self): metadata})
 
     def run(self, input_data: Any) -> Any:
         self._validate_input(input_data)
+        if self.single_flight is None:
+            return self._run_tracked(input_data)
+
+        return self.single_flight.do(input_key(input_data), lambda: self._run_tracked(input_data))
+
+    def _run_tracked(self, input_data: Any) -> Any:
+        if not metrics.registry.enabled:
+            return self._run_cached(input_data)
+
+        with metrics.track_agent(self.name):
+            return self._run_cached(input_data)
+
+    def _run_cached(self, input_data: Any) -> Any:
+        if self.cache is None:
+            return self._run(input_data)
+
+        prompt = self._as_input(input_data)
+        cached = self.cache.lookup(self._cache_scope, prompt, self.output_type)
+        if cached is not None:
+            return cached
+
+        result = self._run(input_data)
+        self.cache.store(self._cache_scope, prompt, result)
+        return result
+
+    def _run(self, input_data: Any) -> Any:
         if not self.tools:
             return self.process_without_tools(input_data)
 
         return self._process_with_tools(input_data)
 
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        """批量执行：没有工具、cascade、thinking_budget和self_consistency时，没有命中缓存的输入合并为一次模型的批量调用"""
+        if self.tools or self.cascade or self.thinking_budget or self.self_consistency:
+            return super().run_batch(inputs, return_exceptions)
+        for input_data in inputs:
+            self._validate_input(input_data)
+
+        if not metrics.registry.enabled:
+            return batch_results(self._run_batch_cached(inputs), return_exceptions)
+
+        with metrics.track_agent_batch(self.name, len(inputs)) as results:
+            results.extend(self._run_batch_cached(inputs))
+        return batch_results(results, return_exceptions)
+
+    def _run_batch_cached(self, inputs: List[Any]) -> List[Any]:
+        results: List[Any] = [None] * len(inputs)
+        missing = []
+        for index, input_data in enumerate(inputs):
+            cached = self._cached_result(input_data)
+            if cached is None:
+                missing.append(index)
+            else:
+                results[index] = cached
+
+        if missing:
+            outputs = self._run_batch([self._format_prompt(inputs[index]) for index in missing])
+            for index, output in zip(missing, outputs, strict=True):
+                results[index] = output
+                if self.cache is not None and not isinstance(output, Exception):
+                    self.cache.store(self._cache_scope, self._as_input(inputs[index]), output)
+        return results
+
+    async def arun(self, input_data: Any) -> Any:
+        self._validate_input(input_data)
+        if self.single_flight is None:
+            return await self._arun_tracked(input_data)
+
+        return await self.single_flight.ado(input_key(input_data), lambda: self._arun_tracked(input_data))
+
+    async def _arun_tracked(self, input_data: Any) -> Any:
+        if not metrics.registry.enabled:
+            return await self._arun_cached(input_data)
+
+        with metrics.track_agent(self.name):
+            return await self._arun_cached(input_data)
+
+    async def _arun_cached(self, input_data: Any) -> Any:
+        if self.cache is None:
+            return await self._arun(input_data)
+
+        prompt = self._as_input(input_data)
+        cached = self.cache.lookup(self._cache_scope, prompt, self.output_type)
+        if cached is not None:
+            return cached
+
+        result = await self._arun(input_data)
+        self.cache.store(self._cache_scope, prompt, result)
+        return result
+
+    async def _arun(self, input_data: Any) -> Any:
+        if not self.tools:
+            return await self._aprocess_without_tools(input_data)
+
+        return await self._aprocess_with_tools(input_data)
+
+    def stream(self, input_data: Any) -> Iterator[PartialOutput]:
+        """流式生成结果：依次返回逐步填充的部分结果，最后一个是经过完整校验的结果（final为True）"""
+        self._validate_input(input_data)
+        self._validate_streaming()
+        if not metrics.registry.enabled:
+            yield from self._stream(input_data)
+            return
+
+        with metrics.track_agent(self.name):
+            yield from self._stream(input_data)
+
+    def _stream(self, input_data: Any) -> Iterator[PartialOutput]:
+        cached = self._cached_result(input_data)
+        if cached is not None:
+            yield final_output(cached)
+            return
+
+        prompt = self._format_prompt(input_data)
+        stream = output_stream(self.output_type)
+        for chunk in self.model.stream(prompt):
+            partial = stream.feed(str(chunk.content))
+            if partial is not None:
+                yield partial
+        yield final_output(self._finish_stream(input_data, prompt, stream.text))
+
+    async def astream(self, input_data: Any) -> AsyncIterator[PartialOutput]:
+        self._validate_input(input_data)
+        self._validate_streaming()
+        if not metrics.registry.enabled:
+            async for partial in self._astream(input_data):
+                yield partial
+            return
+
+        with metrics.track_agent(self.name):
+            async for partial in self._astream(input_data):
+                yield partial
+
+    async def _astream(self, input_data: Any) -> AsyncIterator[PartialOutput]:
+        cached = self._cached_result(input_data)
+        if cached is not None:
+            yield final_output(cached)
+            return
+
+        prompt = self._format_prompt(input_data)
+        stream = output_stream(self.output_type)
+        async for chunk in self.model.astream(prompt):
+            partial = stream.feed(str(chunk.content))
+            if partial is not None:
+                yield partial
+        yield final_output(self._finish_stream(input_data, prompt, stream.text))
+
+    def _validate_streaming(self) -> None:
+        if self.tools or self.cascade or self.thinking_budget or self.self_consistency:
+            raise ValueError("stream is only supported for agents without tools, cascade, thinking_budget "
+                             "or self_consistency")
+
+    def _cached_result(self, input_data: Any) -> Any:
+        if self.cache is None:
+            return None
+        return self.cache.lookup(self._cache_scope, self._as_input(input_data), self.output_type)
+
+    def _finish_stream(self, input_data: Any, prompt: Union[PromptValue, str], text: str) -> Any:
+        track_message(AIMessage(text), prompt)
+        result = self._get_output_parser().parse(text)
+        if self.cache is not None:
+            self.cache.store(self._cache_scope, self._as_input(input_data), result)
+        return result
+
+    def _format_prompt(self, input_data: Any) -> Union[PromptValue, str]:
+        template_vars = self._prepare_template_vars(input_data)
+        if isinstance(self._prompt_template, ChatPromptTemplate):
+            return self._prompt_template.format_prompt(**template_vars)
+        return self._prompt_template.format(**template_vars)
+
+    def report_false_cache_hit(self, input_data: Any) -> None:
+        if self.cache is not None:
+            self.cache.report_false_hit(self._cache_scope, self._as_input(input_data))
+
     def _validate_input(self, input_data: Any) -> None:
         if self._input_type and not isinstance(input_data, self._input_type):
             raise TypeError(f"Input must be of type {self._input_type.__name__}")
 
     def process_without_tools(self, input_data) -> Any:
-        template_vars = self._prepare_template_vars(input_data)
-        formated = self._prompt_template.format(**template_vars)
-        chain = self._runnable | self._get_output_parser()
+        formated = self._format_prompt(input_data)
+        if self._batcher:
+            return self._batcher.submit(formated).result()
+        if self.cascade:
+            result, tier = self.cascade.invoke(formated, self._get_output_parser(), self.model)
+            self._set_run_metadata({"cascade_tier": tier})
+            return result
+        if self.self_consistency:
+            result = consistency.sample(self.model, formated, self._get_output_parser(), self.self_consistency)
+            self._set_run_metadata(result.metadata())
+            return result.value
+        if self.thinking_budget:
+            result = thinking.generate(self.model, formated, self.thinking_budget)
+            self._set_run_metadata(result.metadata())
+            return self._get_output_parser().parse(result.text)
+
+        chain = tracked(self._runnable) | self._get_output_parser()
         return chain.invoke(formated)
 
+    async def _aprocess_without_tools(self, input_data: Any) -> Any:
+        formated = self._format_prompt(input_data)
+        if self._batcher:
+            return await asyncio.wrap_future(self._batcher.submit(formated))
+        if self.cascade:
+            result, tier = await self.cascade.ainvoke(formated, self._get_output_parser(), self.model)
+            self._set_run_metadata({"cascade_tier": tier})
+            return result
+        if self.self_consistency:
+            result = await consistency.asample(self.model, formated, self._get_output_parser(),
+                                               self.self_consistency)
+            self._set_run_metadata(result.metadata())
+            return result.value
+        if self.thinking_budget:
+            result = await thinking.agenerate(self.model, formated, self.thinking_budget)
+            self._set_run_metadata(result.metadata())
+            return self._get_output_parser().parse(result.text)
+
+        chain = tracked(self._runnable) | self._get_output_parser()
+        return await chain.ainvoke(formated)
+
+    def _run_batch(self, prompts: List[Union[PromptValue, str]],
+                   contexts: Optional[List[contextvars.Context]] = None) -> List[Any]:
+        """批量调用模型；contexts是各项调用方的上下文（微批时），用量记录到各自调用方的作用域"""
+        messages = self.model.batch(prompts, return_exceptions=True)
+        parser = self._get_output_parser()
+        results = []
+        for index, (prompt, message) in enumerate(zip(prompts, messages, strict=True)):
+            if isinstance(message, Exception):
+                results.append(message)
+                continue
+            if contexts:
+                contexts[index].run(track_message, message, prompt)
+            else:
+                track_message(message, prompt)
+            try:
+                results.append(parser.invoke(message))
+            except Exception as e:
+                results.append(e)
+        return results
+
     def _process_with_tools(self, input_data: Any) -> Any:
-        chain = {"input": RunnablePassthrough()} | self._runnable | (lambda x: x["output"])
-        result = chain.invoke({"input": self._as_input(input_data)})
-        return self.return_as_tool_output(result)
+        request = self._as_input(input_data)
+        answer = self._replay_trajectory(request)
+        if answer is None:
+            chain = {"input": RunnablePassthrough()} | self._runnable
+            output = chain.invoke({"input": request})
+            answer = self._finish_tool_loop(request, output)
+        return self.return_as_tool_output(answer)
+
+    async def _aprocess_with_tools(self, input_data: Any) -> Any:
+        request = self._as_input(input_data)
+        result = await self._areplay_trajectory(request)
+        if result is None:
+            chain = {"input": RunnablePassthrough()} | self._runnable
+            output = await chain.ainvoke({"input": request})
+            result = self._finish_tool_loop(request, output)
+        if not self.output_type:
+            return str(result)
+
+        result_chain = self._result_template | tracked(self.model) | self.output_parser
+        return await result_chain.ainvoke({"input": result})
+
+    def _finish_tool_loop(self, request: str, output: dict) -> Any:
+        metadata = output["metadata"]
+        self._set_run_metadata(metadata)
+        if self.trajectory_cache is not None and metadata["stop_reason"] == "finished":
+            self.trajectory_cache.record(self.name, request, output["steps"])
+        return output["output"]
+
+    def _replay_trajectory(self, request: str) -> Optional[str]:
+        """命中轨迹缓存时直接执行记录的工具调用，只调用模型生成最终答案；回放失败时返回None"""
+        hit = self.trajectory_cache.lookup(self.name, request) if self.trajectory_cache is not None else None
+        if hit is None:
+            return None
+
+        from tudi.prompts import REPLAY_FINAL_ANSWER_PROMPT
+        plan, match = hit
+        try:
+            steps = plan.run(match, self._call_tool)
+            answer = self._final_answer(request, steps, REPLAY_FINAL_ANSWER_PROMPT)
+        except Exception as e:
+            logger.debug("Replaying trajectory of %s failed: %s", self.name, e)
+            self.trajectory_cache.fallback(self.name, plan)
+            return None
+        self._set_run_metadata({"stop_reason": "replayed", "iterations": len(steps)})
+        return answer
+
+    async def _areplay_trajectory(self, request: str) -> Optional[str]:
+        hit = self.trajectory_cache.lookup(self.name, request) if self.trajectory_cache is not None else None
+        if hit is None:
+            return None
+
+        from tudi.prompts import REPLAY_FINAL_ANSWER_PROMPT
+        plan, match = hit
+        try:
+            steps = await plan.arun(match, self._acall_tool)
+            answer = await self._afinal_answer(request, steps, REPLAY_FINAL_ANSWER_PROMPT)
+        except Exception as e:
+            logger.debug("Replaying trajectory of %s failed: %s", self.name, e)
+            self.trajectory_cache.fallback(self.name, plan)
+            return None
+        self._set_run_metadata({"stop_reason": "replayed", "iterations": len(steps)})
+        return answer
+
+    def _call_tool(self, name: str, tool_input: Any) -> Any:
+        tool = self._tool(name)
+        started = time.perf_counter()
+        try:
+            return call_tool(tool, lambda: tool.run(tool_input), lambda: tool.arun(tool_input))
+        except ToolTimeoutError as e:
+            return str(e)
+        finally:
+            if metrics.registry.enabled:
+                metrics.record_tool_call(name, time.perf_counter() - started)
+
+    async def _acall_tool(self, name: str, tool_input: Any) -> Any:
+        tool = self._tool(name)
+        started = time.perf_counter()
+        try:
+            return await acall_tool(tool, lambda: tool.run(tool_input), lambda: tool.arun(tool_input))
+        except ToolTimeoutError as e:
+            return str(e)
+        finally:
+            if metrics.registry.enabled:
+                metrics.record_tool_call(name, time.perf_counter() - started)
+
+    def _tool(self, name: str) -> Any:
+        from tudi.trajectory import TrajectoryMismatchError
+        for tool in self.tools:
+            if tool.name == name:
+                return tool
+        raise TrajectoryMismatchError(f"Unknown tool: {name}")
 
     def return_as_tool_output(self, result) -> Any:
         if not self.output_type:
             return str(result)
 
-        result_chain = self._result_template | self.model | self.output_parser
+        result_chain = self._result_template | tracked(self.model) | self.output_parser
         final_result = result_chain.invoke({"input": result})
         return final_result
 
@@ -128,7 +606,14 @@ class Agent(Task):
 
         return str(input_data)
 
-    def _create_template(self, prompt_template: str, output_parser: BaseOutputParser) -> PromptTemplate:
+    def _create_template(self, prompt_template: str, output_parser: BaseOutputParser) -> BasePromptTemplate:
+        if prompt_template and self.output_type and self.prompt_layout == "prefix_stable":
+            # 不变的格式说明放在开头的system消息中，每次请求不同的输入放在最后，便于模型服务复用前缀缓存
+            return ChatPromptTemplate.from_messages([
+                SystemMessagePromptTemplate.from_template("{format_instructions}"),
+                HumanMessagePromptTemplate.from_template(prompt_template),
+            ]).partial(format_instructions=output_parser.get_format_instructions())
+
         if prompt_template and output_parser:
             return PromptTemplate(
                 template=f"{prompt_template}\n{{format_instructions}}",
@@ -142,5 +627,5 @@ class Agent(Task):
 
     def _prepare_template_vars(self, input_data: Any) -> dict:
         if isinstance(input_data, BaseModel):
-            return {"arg": SimpleNamespace(**input_data.model_dump())}
+            return {"arg": self._template_inputs.extract(input_data)}
         return {"input": input_data}
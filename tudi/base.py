@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any, Type, TypeVar
+from typing import Any, List, Type, TypeVar
 
 from pydantic import BaseModel
 
@@ -11,6 +11,21 @@ class Runnable(ABC):
     def run(self, input_data: Any) -> Any:
         pass
 
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        """批量执行，按输入顺序返回结果；默认逐个调用run。
+
+        return_exceptions为True时失败项的结果是异常，其他项照常执行；否则遇到第一个异常时抛出。
+        """
+        results = []
+        for input_data in inputs:
+            try:
+                results.append(self.run(input_data))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
     @property
     @abstractmethod
     def input_type(self) -> Type[OutputT]:
@@ -22,6 +37,14 @@ class Runnable(ABC):
         pass
 
 
+def batch_results(results: List[Any], return_exceptions: bool) -> List[Any]:
+    if not return_exceptions:
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+    return results
+
+
 class Task(Runnable, ABC):
     pass
 
@@ -0,0 +1,104 @@
+import contextvars
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+@dataclass(frozen=True)
+class MicroBatching:
+    """微批配置：在max_wait秒内或凑够max_batch_size个请求后合并为一次批量调用"""
+    max_batch_size: int = 16
+    max_wait: float = 0.01
+
+    def __post_init__(self):
+        if self.max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if self.max_wait < 0:
+            raise ValueError("max_wait must not be negative")
+
+
+@dataclass
+class _Item:
+    value: Any
+    future: Future
+    context: contextvars.Context
+
+
+class MicroBatcher:
+    """把并发提交的请求合并成批，交给dispatch一次性处理。
+
+    dispatch接收一批输入和各自调用方的上下文，按相同顺序返回结果；某一项的结果是异常时只有对应的调用方会收到该异常。
+    批次总是在后台线程中执行，submit不会阻塞调用方（例如事件循环）。
+    设置key时，submit时key()的结果不同的请求（例如不同的调度优先级和租户）分到不同的批次，
+    批次在其中第一个调用方的上下文中执行。
+    """
+
+    def __init__(self,
+                 dispatch: Callable[[List[Any], List[contextvars.Context]], List[Any]],
+                 config: MicroBatching,
+                 key: Optional[Callable[[], Hashable]] = None):
+        self._dispatch = dispatch
+        self.config = config
+        self._key = key
+        self._lock = threading.Lock()
+        self._pending: Dict[Hashable, List[_Item]] = {}
+        self._timers: Dict[Hashable, threading.Timer] = {}
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        key = self._key() if self._key else None
+        batch = None
+        with self._lock:
+            pending = self._pending.setdefault(key, [])
+            pending.append(_Item(item, future, contextvars.copy_context()))
+            if len(pending) >= self.config.max_batch_size:
+                batch = self._take(key)
+            elif len(pending) == 1:
+                self._start_timer(key, pending)
+
+        if batch:
+            threading.Thread(target=self._run, args=(batch,), daemon=True).start()
+        return future
+
+    def _start_timer(self, key: Hashable, pending: List[_Item]) -> None:
+        timer = threading.Timer(self.config.max_wait, self._on_timeout, args=(key, pending))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def _on_timeout(self, key: Hashable, pending: List[_Item]) -> None:
+        with self._lock:
+            # 窗口已经因为凑满而提前发出
+            if self._pending.get(key) is not pending:
+                return
+            batch = self._take(key)
+
+        self._run(batch)
+
+    def _take(self, key: Hashable) -> List[_Item]:
+        batch = self._pending.pop(key)
+        self.batches += 1
+        self.items += len(batch)
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        return batch
+
+    def _run(self, batch: List[_Item]) -> None:
+        contexts = [entry.context for entry in batch]
+        try:
+            # 复制一份上下文执行，各项自己的上下文留给dispatch按项使用
+            results = contexts[0].copy().run(self._dispatch, [entry.value for entry in batch], contexts)
+        except Exception as e:
+            for entry in batch:
+                entry.future.set_exception(e)
+            return
+
+        for entry, result in zip(batch, results, strict=True):
+            if isinstance(result, Exception):
+                entry.future.set_exception(result)
+            else:
+                entry.future.set_result(result)
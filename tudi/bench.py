@@ -0,0 +1,353 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from itertools import cycle
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from tudi import metrics
+from tudi.base import Task
+from tudi.serialization import from_jsonable, sample_value
+from tudi.testing import FakeChatModel
+
+MODES = ("sync", "thread", "asyncio")
+
+
+def latency_distribution(spec: str, seed: Optional[int] = None) -> Callable[[], float]:
+    """解析延迟分布，单位为秒：
+    0.2 / fixed:0.2、uniform:LOW,HIGH、normal:MEAN,STDDEV、lognormal:MEDIAN,SIGMA、exponential:MEAN
+    """
+    kind, _, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    try:
+        params = [float(arg) for arg in args.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid latency distribution: '{spec}'") from None
+
+    rng = random.Random(seed)
+    expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+    if kind not in expected or len(params) != expected[kind]:
+        raise ValueError(f"Invalid latency distribution: '{spec}'")
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(math.log(params[0]), params[1])
+    return lambda: rng.expovariate(1 / params[0])
+
+
+def fake_models(flow: Task, latency: Callable[[], float]) -> int:
+    """把Flow中所有Agent（包括cascade的各级模型）和路由分类的模型替换为FakeChatModel，返回替换的Agent和路由的数量"""
+    from tudi.agent import Agent
+    from tudi.statements import RouteStatement
+    runnables = list(flow._iter_runnables()) if hasattr(flow, "_iter_runnables") else [flow]
+
+    replaced = 0
+    seen = set()
+    for runnable in runnables:
+        if id(runnable) in seen:
+            continue
+        seen.add(id(runnable))
+        if isinstance(runnable, Agent):
+            respond = _fake_response(runnable.output_type)
+            tiers = len(runnable.cascade.models) if runnable.cascade else 0
+            runnable.replace_model(FakeChatModel(respond=respond, latency=latency),
+                                   [FakeChatModel(respond=respond, latency=latency) for _ in range(tiers)])
+        elif isinstance(runnable, RouteStatement):
+            # 轮流返回各个label，让每个分支都被压测到；constrained的路由按结构化输出返回
+            labels = [json.dumps({"label": label}) if runnable.constrained else label for label in runnable.routes]
+            runnable.replace_model(FakeChatModel(responses=labels, latency=latency))
+        else:
+            continue
+        replaced += 1
+    return replaced
+
+
+def _fake_response(output_type: Optional[type]) -> Callable[[str], str]:
+    answer = json.dumps(sample_value(output_type)) if output_type else "sample"
+
+    def respond(prompt: str) -> str:
+        if "$JSON_BLOB" in prompt:
+            # 工具Agent的ReAct提示，直接给出最终答案
+            return f"Thought: I now know the final answer\nFinal Answer: {answer}"
+        return answer
+
+    return respond
+
+
+def load_inputs(path: str, input_type: Optional[type] = None) -> List[Any]:
+    """从JSONL文件加载样本输入，每行按input_type校验"""
+    with open(path, encoding="utf-8") as f:
+        inputs = [from_jsonable(json.loads(line), input_type) for line in f if line.strip()]
+    if not inputs:
+        raise ValueError(f"No inputs found in '{path}'")
+    return inputs
+
+
+@dataclass
+class LatencySummary:
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+    @classmethod
+    def of(cls, values: Sequence[float]) -> "LatencySummary":
+        if not values:
+            return cls(0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        ordered = sorted(values)
+        return cls(len(ordered), sum(ordered) / len(ordered), _percentile(ordered, 0.5),
+                   _percentile(ordered, 0.95), _percentile(ordered, 0.99), ordered[-1])
+
+
+@dataclass
+class BenchReport:
+    mode: str
+    target_qps: float
+    requests: int
+    completed: int
+    errors: int
+    duration: float
+    throughput: float
+    latency: LatencySummary
+    error_types: Dict[str, int] = field(default_factory=dict)
+    steps: Dict[str, dict] = field(default_factory=dict)
+    agents: Dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "error_rate": self.error_rate}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+
+    def render(self) -> str:
+        lines = [
+            f"mode={self.mode} target={self.target_qps:g} qps requests={self.requests}",
+            f"throughput: {self.throughput:.2f} req/s over {self.duration:.2f}s",
+            f"latency: {_format_summary(self.latency)}",
+            f"errors: {self.errors} ({self.error_rate:.1%})"
+            + "".join(f" {name}={count}" for name, count in self.error_types.items()),
+        ]
+        for title, rows in (("steps", self.steps), ("agents", self.agents)):
+            if rows:
+                lines.append(f"{title}:")
+                lines.extend(f"  {label}: count={row['count']} mean={_ms(row['mean'])} "
+                             f"p50={_ms(row['p50'])} p95={_ms(row['p95'])} p99={_ms(row['p99'])}"
+                             for label, row in rows.items())
+        return "\n".join(lines)
+
+
+def run_bench(flow: Task,
+              inputs: Callable[[int], Any],
+              qps: float,
+              requests: int,
+              mode: str = "thread",
+              max_workers: int = 32) -> BenchReport:
+    """以开环方式按目标QPS驱动Flow：第i个请求在start + i / qps时发出，不等待之前的请求完成。
+
+    延迟从计划发出的时间开始计算，因此排队等待也会计入延迟，能反映出Flow饱和后的真实表现。
+    每个步骤的耗时来自指标注册表在压测期间的增量；注册表原本关闭时，压测期间临时开启，结束后恢复原来的指标。
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if qps <= 0 or requests <= 0:
+        raise ValueError("qps and requests must be positive")
+
+    was_enabled = metrics.registry.enabled
+    saved = metrics.registry.save()
+    before = metrics.registry.snapshot()
+    metrics.registry.enable()
+    recorder = _Recorder()
+    try:
+        start = time.perf_counter() + 0.01
+        schedule = [start + i / qps for i in range(requests)]
+        if mode == "sync":
+            _drive_sync(flow, inputs, schedule, recorder)
+        elif mode == "thread":
+            _drive_threads(flow, inputs, schedule, recorder, max_workers)
+        else:
+            asyncio.run(_drive_asyncio(flow, inputs, schedule, recorder, max_workers))
+        duration = max(recorder.finished_at - start, 1e-9)
+        snapshot = _histogram_delta(metrics.registry.snapshot(), before)
+    finally:
+        if not was_enabled:
+            # 注册表原本是关闭的：恢复压测前的指标，不留下压测期间记录的数据
+            metrics.registry.disable()
+            metrics.registry.restore(saved)
+
+    return BenchReport(
+        mode=mode,
+        target_qps=qps,
+        requests=requests,
+        completed=len(recorder.latencies),
+        errors=sum(recorder.errors.values()),
+        duration=duration,
+        throughput=len(recorder.latencies) / duration,
+        latency=LatencySummary.of(recorder.latencies),
+        error_types=dict(recorder.errors),
+        steps=_histogram_rows(snapshot, metrics.STEP_LATENCY, lambda labels: f"{labels['flow']}/{labels['step']}"),
+        agents=_histogram_rows(snapshot, metrics.AGENT_LATENCY, lambda labels: labels["agent"]),
+    )
+
+
+def input_factory(samples: Sequence[Any]) -> Callable[[int], Any]:
+    """循环使用样本作为输入"""
+    iterator: Iterator[Any] = cycle(samples)
+    lock = threading.Lock()
+
+    def next_input(_: int) -> Any:
+        with lock:
+            return next(iterator)
+
+    return next_input
+
+
+class _Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.finished_at = 0.0
+
+    def record(self, scheduled: float, error: Optional[BaseException] = None) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            if error is None:
+                self.latencies.append(now - scheduled)
+            else:
+                name = type(error).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+            self.finished_at = max(self.finished_at, now)
+
+
+def _call(flow: Task, input_data: Any, scheduled: float, recorder: _Recorder) -> None:
+    try:
+        flow.run(input_data)
+    except Exception as e:
+        recorder.record(scheduled, e)
+    else:
+        recorder.record(scheduled)
+
+
+def _sleep_until(deadline: float) -> None:
+    delay = deadline - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _drive_sync(flow, inputs, schedule, recorder) -> None:
+    # 单线程依次执行，落后于计划时立即执行下一个请求
+    for index, scheduled in enumerate(schedule):
+        _sleep_until(scheduled)
+        _call(flow, inputs(index), scheduled, recorder)
+
+
+def _drive_threads(flow, inputs, schedule, recorder, max_workers) -> None:
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for index, scheduled in enumerate(schedule):
+            _sleep_until(scheduled)
+            pool.submit(_call, flow, inputs(index), scheduled, recorder)
+
+
+async def _drive_asyncio(flow, inputs, schedule, recorder, max_workers) -> None:
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    # 协程执行时线程池不起作用，用信号量限制同时执行的请求数；等待的时间计入延迟
+    slots = asyncio.Semaphore(max_workers)
+    arun = getattr(flow, "arun", None)
+
+    async def call(input_data, scheduled):
+        try:
+            async with slots:
+                if arun is not None:
+                    await arun(input_data)
+                else:
+                    await loop.run_in_executor(pool, flow.run, input_data)
+        except Exception as e:
+            recorder.record(scheduled, e)
+        else:
+            recorder.record(scheduled)
+
+    tasks = []
+    try:
+        for index, scheduled in enumerate(schedule):
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(call(inputs(index), scheduled)))
+        await asyncio.gather(*tasks)
+    finally:
+        pool.shutdown(wait=True)
+
+
+def _histogram_delta(after: dict, before: dict) -> dict:
+    """两次快照之间直方图的增量"""
+    histograms = {}
+    for name, series_list in after["histograms"].items():
+        previous = {tuple(sorted(series["labels"].items())): series
+                    for series in before["histograms"].get(name, [])}
+        histograms[name] = []
+        for series in series_list:
+            old = previous.get(tuple(sorted(series["labels"].items())))
+            if old is not None:
+                series = {**series, "count": series["count"] - old["count"], "sum": series["sum"] - old["sum"],
+                          "buckets": {bound: count - old["buckets"][bound]
+                                      for bound, count in series["buckets"].items()}}
+            histograms[name].append(series)
+    return {"histograms": histograms}
+
+
+def _histogram_rows(snapshot: dict, name: str, key: Callable[[dict], str]) -> Dict[str, dict]:
+    rows = {}
+    for series in snapshot["histograms"].get(name, []):
+        count = series["count"]
+        if not count:
+            continue
+        rows[key(series["labels"])] = {
+            "count": count,
+            "mean": series["sum"] / count,
+            "p50": _histogram_quantile(series["buckets"], count, 0.5),
+            "p95": _histogram_quantile(series["buckets"], count, 0.95),
+            "p99": _histogram_quantile(series["buckets"], count, 0.99),
+        }
+    return dict(sorted(rows.items()))
+
+
+def _histogram_quantile(buckets: Dict[float, int], count: int, q: float) -> float:
+    """按桶内线性插值估计分位数，与Prometheus的histogram_quantile一致"""
+    rank = q * count
+    lower, previous = 0.0, 0
+    for bound, cumulative in buckets.items():
+        if cumulative >= rank:
+            if bound == math.inf:
+                return lower
+            in_bucket = cumulative - previous
+            return lower + (bound - lower) * ((rank - previous) / in_bucket if in_bucket else 0)
+        lower, previous = bound, cumulative
+    return lower
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    index = max(0, math.ceil(q * len(ordered)) - 1)
+    return ordered[index]
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+
+def _format_summary(summary: LatencySummary) -> str:
+    return (f"p50={_ms(summary.p50)} p95={_ms(summary.p95)} p99={_ms(summary.p99)} "
+            f"mean={_ms(summary.mean)} max={_ms(summary.max)}")
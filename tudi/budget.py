@@ -0,0 +1,205 @@
+import json
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+
+from tudi import metrics
+from tudi.tool_limits import ToolTimeoutError, acall_tool, call_tool, is_async_tool
+from tudi.usage import UsageTracker, usage_scope
+
+EARLY_STOPPING_METHODS = ("force", "generate")
+
+
+@dataclass(frozen=True)
+class AgentBudget:
+    """工具Agent的ReAct循环预算。
+
+    - max_iterations / max_execution_time / max_total_tokens: 任一耗尽即停止循环
+    - max_repeated_actions: 连续重复同一个Action（工具和参数都相同）达到该次数时停止
+    - early_stopping_method: "force"直接返回停止说明；"generate"基于当前scratchpad再调用一次模型给出最终答案
+    """
+    max_iterations: Optional[int] = 15
+    max_execution_time: Optional[float] = None
+    max_total_tokens: Optional[int] = None
+    max_repeated_actions: Optional[int] = None
+    early_stopping_method: str = "force"
+
+    def __post_init__(self):
+        if self.early_stopping_method not in EARLY_STOPPING_METHODS:
+            raise ValueError(f"early_stopping_method must be one of {EARLY_STOPPING_METHODS}")
+        if self.max_repeated_actions is not None and self.max_repeated_actions < 2:
+            raise ValueError("max_repeated_actions must be at least 2")
+
+
+@dataclass
+class _LoopState:
+    usage: UsageTracker = field(default_factory=UsageTracker)
+    steps: List[Tuple[AgentAction, str]] = field(default_factory=list)
+    last_action: Optional[str] = None
+    repeats: int = 0
+    iterations: int = 0
+    finished: bool = False
+    stop_reason: Optional[str] = None
+    started: float = field(default_factory=time.perf_counter)
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "stop_reason": self.stop_reason or ("finished" if self.finished else "max_execution_time"),
+            "iterations": self.iterations,
+            "model_calls": self.usage.calls,
+            "prompt_tokens": self.usage.prompt_tokens,
+            "completion_tokens": self.usage.completion_tokens,
+            "total_tokens": self.usage.total_tokens,
+            "elapsed": time.perf_counter() - self.started,
+        }
+
+
+_loop_state: ContextVar[Optional[_LoopState]] = ContextVar("tudi_loop_state", default=None)
+
+
+class BudgetedAgentExecutor(AgentExecutor):
+    """在AgentExecutor的基础上增加token预算、重复Action检测和"generate"式提前结束，
+    并在输出中附带metadata说明循环是如何结束的"""
+
+    budget: AgentBudget = AgentBudget()
+    finalizer: Optional[Callable[[Dict[str, Any], List[Tuple[AgentAction, str]]], str]] = None
+    afinalizer: Optional[Callable[[Dict[str, Any], List[Tuple[AgentAction, str]]], Awaitable[str]]] = None
+
+    def _call(self, inputs: Dict[str, str],
+              run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        state = _LoopState()
+        token = _loop_state.set(state)
+        try:
+            with usage_scope(state.usage):
+                output = super()._call(inputs, run_manager=run_manager)
+                return self._finish(inputs, output, state)
+        finally:
+            _loop_state.reset(token)
+
+    async def _acall(self, inputs: Dict[str, str],
+                     run_manager: Optional[AsyncCallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        state = _LoopState()
+        token = _loop_state.set(state)
+        try:
+            with usage_scope(state.usage):
+                output = await super()._acall(inputs, run_manager=run_manager)
+                return await self._afinish(inputs, output, state)
+        finally:
+            _loop_state.reset(token)
+
+    def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+        state = _loop_state.get()
+        if state is None:
+            return super()._should_continue(iterations, time_elapsed)
+
+        state.iterations = iterations
+        budget = self.budget
+        if budget.max_iterations is not None and iterations >= budget.max_iterations:
+            state.stop_reason = "max_iterations"
+        elif budget.max_execution_time is not None and time_elapsed >= budget.max_execution_time:
+            state.stop_reason = "max_execution_time"
+        elif budget.max_total_tokens is not None and state.usage.total_tokens >= budget.max_total_tokens:
+            state.stop_reason = "max_total_tokens"
+        elif budget.max_repeated_actions is not None and state.repeats >= budget.max_repeated_actions:
+            state.stop_reason = "repeated_action"
+
+        return state.stop_reason is None
+
+    def _take_next_step(self, *args: Any, **kwargs: Any) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        return self._record_step(super()._take_next_step(*args, **kwargs))
+
+    async def _atake_next_step(self, *args: Any,
+                               **kwargs: Any) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        return self._record_step(await super()._atake_next_step(*args, **kwargs))
+
+    def _perform_agent_action(self, name_to_tool_map: Dict[str, Any], color_mapping: Dict[str, str],
+                              agent_action: AgentAction,
+                              run_manager: Optional[CallbackManagerForChainRun] = None) -> AgentStep:
+        perform = super()._perform_agent_action
+        aperform = super()._aperform_agent_action
+        tool = name_to_tool_map.get(agent_action.tool)
+        started = time.perf_counter()
+        try:
+            if tool is None:
+                return perform(name_to_tool_map, color_mapping, agent_action, run_manager)
+            return call_tool(tool, lambda: perform(name_to_tool_map, color_mapping, agent_action, run_manager),
+                             lambda: aperform(name_to_tool_map, color_mapping, agent_action))
+        except ToolTimeoutError as e:
+            # 超时作为观察结果交给模型，由模型决定重试还是换一种方式
+            return AgentStep(action=agent_action, observation=str(e))
+        finally:
+            if metrics.registry.enabled:
+                metrics.record_tool_call(agent_action.tool, time.perf_counter() - started)
+
+    async def _aperform_agent_action(self, name_to_tool_map: Dict[str, Any], color_mapping: Dict[str, str],
+                                     agent_action: AgentAction,
+                                     run_manager: Optional[AsyncCallbackManagerForChainRun] = None) -> AgentStep:
+        perform = super()._perform_agent_action
+        aperform = super()._aperform_agent_action
+        tool = name_to_tool_map.get(agent_action.tool)
+        started = time.perf_counter()
+        try:
+            if tool is None:
+                return await aperform(name_to_tool_map, color_mapping, agent_action, run_manager)
+            if run_manager and not is_async_tool(tool):
+                await run_manager.on_agent_action(agent_action, verbose=self.verbose, color="green")
+            return await acall_tool(tool, lambda: perform(name_to_tool_map, color_mapping, agent_action),
+                                    lambda: aperform(name_to_tool_map, color_mapping, agent_action, run_manager))
+        except ToolTimeoutError as e:
+            return AgentStep(action=agent_action, observation=str(e))
+        finally:
+            if metrics.registry.enabled:
+                metrics.record_tool_call(agent_action.tool, time.perf_counter() - started)
+
+    def _record_step(self, output: Union[AgentFinish, List[Tuple[AgentAction, str]]]):
+        state = _loop_state.get()
+        if state is None:
+            return output
+
+        if isinstance(output, AgentFinish):
+            state.finished = True
+            return output
+
+        state.steps.extend(output)
+        if len(output) == 1 and self._get_tool_return(output[0]) is not None:
+            state.finished = True
+
+        for action, _ in output:
+            signature = f"{action.tool}:{json.dumps(action.tool_input, sort_keys=True, default=str)}"
+            state.repeats = state.repeats + 1 if signature == state.last_action else 1
+            state.last_action = signature
+        return output
+
+    def _finish(self, inputs: Dict[str, Any], output: Dict[str, Any], state: _LoopState) -> Dict[str, Any]:
+        if self._should_finalize(state) and self.finalizer:
+            output = {**output, "output": self.finalizer(inputs, state.steps)}
+        return self._with_metadata(output, state)
+
+    async def _afinish(self, inputs: Dict[str, Any], output: Dict[str, Any], state: _LoopState) -> Dict[str, Any]:
+        # 异步循环中使用异步的finalizer，避免在事件循环中阻塞地调用模型
+        if self._should_finalize(state) and self.afinalizer:
+            output = {**output, "output": await self.afinalizer(inputs, state.steps)}
+        return self._with_metadata(output, state)
+
+    def _should_finalize(self, state: _LoopState) -> bool:
+        return not state.finished and self.budget.early_stopping_method == "generate"
+
+    @staticmethod
+    def _with_metadata(output: Dict[str, Any], state: _LoopState) -> Dict[str, Any]:
+        return {**output, "metadata": state.metadata(), "steps": list(state.steps)}
+
+
+def create_executor(agent: Any, tools: List[Any], budget: Optional[AgentBudget],
+                    finalizer: Optional[Callable] = None,
+                    afinalizer: Optional[Callable] = None) -> BudgetedAgentExecutor:
+    budget = budget or AgentBudget()
+    return BudgetedAgentExecutor(agent=agent, tools=tools, verbose=True, return_intermediate_steps=False,
+                                 max_iterations=budget.max_iterations,
+                                 max_execution_time=budget.max_execution_time,
+                                 budget=budget, finalizer=finalizer, afinalizer=afinalizer)
+
@@ -0,0 +1,147 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import BaseOutputParser
+
+from tudi import metrics
+from tudi.usage import track_message
+
+
+@dataclass
+class TierStats:
+    model: str
+    attempts: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    parse_failures: int = 0
+    errors: int = 0
+    latency: float = 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.attempts if self.attempts else 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.latency / self.attempts if self.attempts else 0.0
+
+
+class ModelCascade:
+    """按顺序尝试更便宜的模型，结果能被解析且通过检查时直接采用，否则升级到下一级。
+
+    models是比Agent自身模型更便宜的各级模型，Agent的model作为最后一级，它的结果总是被采用。
+    validator检查解析后的结果，confidence从模型返回的消息中计算置信度（例如基于logprobs），
+    低于min_confidence时升级。
+    """
+
+    def __init__(self,
+                 models: Sequence[BaseChatModel],
+                 validator: Optional[Callable[[Any], bool]] = None,
+                 confidence: Optional[Callable[[BaseMessage], float]] = None,
+                 min_confidence: float = 0.0):
+        if not models:
+            raise ValueError("At least one cascade model must be provided")
+
+        self.models = list(models)
+        self.validator = validator
+        self.confidence = confidence
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._stats: dict = {}
+
+    def invoke(self, prompt: str, parser: BaseOutputParser, final_model: BaseChatModel) -> Tuple[Any, int]:
+        """返回结果和采用结果的层级"""
+        tiers = self._tiers(final_model)
+        for tier, model in enumerate(tiers):
+            last = tier == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                message = track_message(model.invoke(prompt), prompt)
+                result = parser.invoke(message)
+            except OutputParserException:
+                self._record(tier, model, "parse_failure", started)
+                if last:
+                    raise
+                continue
+            except Exception:
+                self._record(tier, model, "error", started)
+                if last:
+                    raise
+                continue
+
+            if last or self._accept(message, result):
+                self._record(tier, model, "accepted", started)
+                return result, tier
+            self._record(tier, model, "rejected", started)
+
+    async def ainvoke(self, prompt: str, parser: BaseOutputParser, final_model: BaseChatModel) -> Tuple[Any, int]:
+        tiers = self._tiers(final_model)
+        for tier, model in enumerate(tiers):
+            last = tier == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                message = track_message(await model.ainvoke(prompt), prompt)
+                result = await parser.ainvoke(message)
+            except OutputParserException:
+                self._record(tier, model, "parse_failure", started)
+                if last:
+                    raise
+                continue
+            except Exception:
+                self._record(tier, model, "error", started)
+                if last:
+                    raise
+                continue
+
+            if last or self._accept(message, result):
+                self._record(tier, model, "accepted", started)
+                return result, tier
+            self._record(tier, model, "rejected", started)
+
+    def stats(self) -> List[TierStats]:
+        with self._lock:
+            return [TierStats(**vars(stats)) for _, stats in sorted(self._stats.items())]
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    def _tiers(self, final_model: BaseChatModel) -> List[BaseChatModel]:
+        return [*self.models, final_model]
+
+    def _accept(self, message: BaseMessage, result: Any) -> bool:
+        if self.validator and not self.validator(result):
+            return False
+        if self.confidence and self.confidence(message) < self.min_confidence:
+            return False
+        return True
+
+    def _record(self, tier: int, model: BaseChatModel, outcome: str, started: float) -> None:
+        latency = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats.get(tier)
+            if stats is None:
+                stats = self._stats[tier] = TierStats(model_name(model))
+            stats.attempts += 1
+            stats.latency += latency
+            if outcome == "accepted":
+                stats.accepted += 1
+            elif outcome == "rejected":
+                stats.rejected += 1
+            elif outcome == "parse_failure":
+                stats.parse_failures += 1
+            else:
+                stats.errors += 1
+
+        label = f"{tier}:{stats.model}"
+        metrics.registry.inc(metrics.CASCADE_ATTEMPTS, agent=metrics.current_agent(), tier=label, outcome=outcome)
+        metrics.registry.observe(metrics.CASCADE_LATENCY, latency, agent=metrics.current_agent(), tier=label)
+
+
+def model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
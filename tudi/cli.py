@@ -0,0 +1,153 @@
+import argparse
+import importlib
+import sys
+from typing import Any, List, Optional
+
+from tudi.base import Task
+
+
+def load_object(path: str) -> Any:
+    """按"module:attr"的形式加载对象，attr可以是用点分隔的属性路径"""
+    module_name, sep, attr_path = path.partition(":")
+    if not sep or not module_name or not attr_path:
+        raise ValueError(f"Expected 'module:attribute', got '{path}'")
+
+    obj = importlib.import_module(module_name)
+    for attr in attr_path.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def load_flow(path: str) -> Task:
+    flow = load_object(path)
+    if callable(flow) and not isinstance(flow, Task):
+        flow = flow()
+    if not isinstance(flow, Task):
+        raise TypeError(f"'{path}' is not a Flow or Agent")
+    return flow
+
+
+def _serve(args: argparse.Namespace) -> int:
+    from tudi import metrics
+    from tudi.serving import serve
+    flow = load_flow(args.flow)
+    if args.metrics:
+        metrics.registry.enable()
+    if args.warmup:
+        for report in flow.warmup(keep_alive=args.keep_alive):
+            status = f"failed: {report.error}" if report.error else "ready"
+            print(f"Warmed up {report.model} in {report.seconds:.2f}s ({status})", file=sys.stderr)
+    print(f"Serving {args.flow} on http://{args.host}:{args.port}", file=sys.stderr)
+    serve(flow, host=args.host, port=args.port,
+          max_in_flight=args.max_in_flight, max_queue=args.max_queue)
+    return 0
+
+
+def _worker(args: argparse.Namespace) -> int:
+    import multiprocessing
+
+    from tudi.distributed import run_worker
+    options = {"flow_key": args.flow_key, "idle_timeout": args.idle_timeout,
+               "visibility_timeout": args.visibility_timeout, "max_attempts": args.max_attempts}
+    print(f"Starting {args.processes} worker(s) for {args.flow} on {args.queue}", file=sys.stderr)
+    if args.processes == 1:
+        run_worker(args.flow, args.queue, **options)
+        return 0
+
+    processes = [multiprocessing.Process(target=run_worker, args=(args.flow, args.queue), kwargs=options)
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    return max(process.exitcode or 0 for process in processes)
+
+
+def _bench(args: argparse.Namespace) -> int:
+    from tudi import bench
+    flow = load_flow(args.flow)
+    if args.inputs:
+        inputs = bench.input_factory(bench.load_inputs(args.inputs, flow.input_type))
+    else:
+        inputs = load_object(args.factory)
+    if args.fake_latency:
+        bench.fake_models(flow, bench.latency_distribution(args.fake_latency, args.seed))
+
+    report = bench.run_bench(flow, inputs, qps=args.qps, requests=args.requests,
+                             mode=args.mode, max_workers=args.workers)
+    print(report.render(), file=sys.stderr)
+    if args.json == "-":
+        print(report.to_json())
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(report.to_json())
+    return 0
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tudi")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Serve a flow over HTTP/JSON")
+    serve_parser.add_argument("flow", help="Import path of the flow, e.g. 'myapp.flows:weather_flow'")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--max-in-flight", type=int, default=4,
+                              help="Maximum number of flow runs executing at the same time")
+    serve_parser.add_argument("--max-queue", type=int, default=64,
+                              help="Maximum number of requests waiting; more are rejected with 429")
+    serve_parser.add_argument("--metrics", action="store_true",
+                              help="Record runtime metrics and expose them on /metrics")
+    serve_parser.add_argument("--warmup", action="store_true",
+                              help="Load every model used by the flow before accepting requests")
+    serve_parser.add_argument("--keep-alive", default=None,
+                              help="How long the model server should keep warmed models loaded, e.g. '30m'")
+    serve_parser.set_defaults(handler=_serve)
+
+    worker_parser = subparsers.add_parser("worker", help="Execute flow steps pulled from a task queue")
+    worker_parser.add_argument("flow", help="Import path of the flow, e.g. 'myapp.flows:weather_flow'")
+    worker_parser.add_argument("--queue", default="tudi-queue.db", help="Path of the SQLite task queue")
+    worker_parser.add_argument("--flow-key", default=None,
+                               help="Queue key of the flow; defaults to the flow name")
+    worker_parser.add_argument("--processes", type=int, default=1, help="Number of worker processes")
+    worker_parser.add_argument("--visibility-timeout", type=float, default=60.0,
+                               help="Seconds before an unfinished step becomes visible to other workers")
+    worker_parser.add_argument("--max-attempts", type=int, default=3,
+                               help="Maximum attempts of a step before its run fails")
+    worker_parser.add_argument("--idle-timeout", type=float, default=None,
+                               help="Exit after the queue has been idle for this many seconds")
+    worker_parser.set_defaults(handler=_worker)
+
+    bench_parser = subparsers.add_parser("bench", help="Load-test a flow at a target request rate")
+    bench_parser.add_argument("flow", help="Import path of the flow, e.g. 'myapp.flows:weather_flow'")
+    source = bench_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--inputs", help="JSONL file with sample inputs, used round-robin")
+    source.add_argument("--factory", help="Import path of a function that builds the input for request i")
+    bench_parser.add_argument("--qps", type=float, default=10.0, help="Target request rate (open loop)")
+    bench_parser.add_argument("--requests", type=int, default=100, help="Total number of requests")
+    bench_parser.add_argument("--mode", choices=["sync", "thread", "asyncio"], default="thread")
+    bench_parser.add_argument("--workers", type=int, default=32,
+                              help="Maximum concurrent runs in thread and asyncio modes")
+    bench_parser.add_argument("--fake-latency", default=None,
+                              help="Replace models with fakes, e.g. '0.2', 'uniform:0.1,0.5', 'lognormal:0.3,0.5'")
+    bench_parser.add_argument("--seed", type=int, default=None, help="Seed of the fake latency distribution")
+    bench_parser.add_argument("--json", default=None, help="Write the report as JSON to this path ('-' for stdout)")
+    bench_parser.set_defaults(handler=_bench)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    if "." not in sys.path:
+        sys.path.insert(0, ".")
+    try:
+        return args.handler(args)
+    except KeyboardInterrupt:
+        return 130
@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.output_parsers import BaseOutputParser
+from pydantic import BaseModel
+
+from tudi import metrics
+from tudi.usage import track_message
+
+
+@dataclass(frozen=True)
+class SelfConsistency:
+    """自一致性投票：对同一个prompt并发采样samples次，解析后的结果中有agree个一致时立即返回，其余的采样被取消。
+
+    key把解析后的结果转换为比较用的值，默认逐字段比较（Pydantic模型按model_dump的结果）；
+    例如分类Agent只比较label字段时传入lambda result: result.label。
+    所有采样完成仍没有达到agree时返回票数最多的结果，全部失败时抛出最后一个异常。
+    模型需要设置大于0的temperature，否则各次采样的结果相同，投票没有意义。
+    """
+    samples: int = 5
+    agree: int = 3
+    key: Optional[Callable[[Any], Hashable]] = None
+
+    def __post_init__(self):
+        if self.samples < 1:
+            raise ValueError("samples must be at least 1")
+        if not 1 <= self.agree <= self.samples:
+            raise ValueError("agree must be between 1 and samples")
+
+
+@dataclass
+class ConsistencyResult:
+    value: Any
+    votes: int
+    completed: int
+    failed: int
+    agreed: bool
+
+    @property
+    def agreement(self) -> float:
+        """返回时已经完成并成功解析的采样中，与结果一致的比例"""
+        succeeded = self.completed - self.failed
+        return self.votes / succeeded if succeeded else 0.0
+
+    def metadata(self) -> dict:
+        return {
+            "samples_completed": self.completed,
+            "votes": self.votes,
+            "agreement": self.agreement,
+            "agreed": self.agreed,
+        }
+
+
+def sample(model: BaseChatModel, prompt: Any, parser: BaseOutputParser, config: SelfConsistency) -> ConsistencyResult:
+    """在线程中并发采样；达到一致后还没开始的采样被取消，已经发出的请求在后台完成，结果被丢弃"""
+    tally = _Tally(config)
+    pool = ThreadPoolExecutor(max_workers=config.samples, thread_name_prefix="tudi-consistency")
+    try:
+        futures = [pool.submit(contextvars.copy_context().run, _sample, model, prompt, parser)
+                   for _ in range(config.samples)]
+        for future in as_completed(futures):
+            error = future.exception()
+            result = tally.fail(error) if error is not None else tally.add(future.result())
+            if result is not None:
+                return result
+        return tally.finish()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def asample(model: BaseChatModel, prompt: Any, parser: BaseOutputParser,
+                  config: SelfConsistency) -> ConsistencyResult:
+    """并发采样，达到一致后取消其余的请求"""
+    tally = _Tally(config)
+    tasks = [asyncio.ensure_future(_asample(model, prompt, parser)) for _ in range(config.samples)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = tally.add(await next_done)
+            except Exception as e:
+                result = tally.fail(e)
+            if result is not None:
+                return result
+        return tally.finish()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def vote_key(value: Any) -> Hashable:
+    """默认的比较方式：Pydantic模型和其他结构化结果按JSON比较，字符串忽略首尾空白"""
+    if isinstance(value, BaseModel):
+        value = value.model_dump(mode="json")
+    if isinstance(value, str):
+        return value.strip()
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class _Tally:
+    def __init__(self, config: SelfConsistency):
+        self.config = config
+        self.key = config.key or vote_key
+        self.votes: Dict[Hashable, List[Any]] = {}
+        self.completed = 0
+        self.failed = 0
+        self.error: Optional[BaseException] = None
+
+    def add(self, value: Any) -> Optional[ConsistencyResult]:
+        self.completed += 1
+        votes = self.votes.setdefault(self.key(value), [])
+        votes.append(value)
+        if len(votes) >= self.config.agree:
+            return self._result(votes, agreed=True)
+        return None
+
+    def fail(self, error: BaseException) -> Optional[ConsistencyResult]:
+        self.completed += 1
+        self.failed += 1
+        self.error = error
+        return None
+
+    def finish(self) -> ConsistencyResult:
+        if not self.votes:
+            raise self.error
+        # 票数相同时取最先完成的结果
+        return self._result(max(self.votes.values(), key=len), agreed=False)
+
+    def _result(self, votes: List[Any], agreed: bool) -> ConsistencyResult:
+        result = ConsistencyResult(votes[0], len(votes), self.completed, self.failed, agreed)
+        agent = metrics.current_agent()
+        metrics.registry.inc(metrics.SELF_CONSISTENCY, agent=agent, outcome="agreed" if agreed else "plurality")
+        metrics.registry.observe(metrics.SELF_CONSISTENCY_AGREEMENT, result.agreement, agent=agent)
+        return result
+
+
+def _sample(model: BaseChatModel, prompt: Any, parser: BaseOutputParser) -> Any:
+    return parser.invoke(track_message(model.invoke(prompt), prompt))
+
+
+async def _asample(model: BaseChatModel, prompt: Any, parser: BaseOutputParser) -> Any:
+    return parser.invoke(track_message(await model.ainvoke(prompt), prompt))
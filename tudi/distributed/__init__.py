@@ -0,0 +1,9 @@
+from .queue import ClaimedTask, RunState, SQLiteTaskQueue, TaskQueue
+from .runner import DistributedFlow, RemoteExecutionError
+from .worker import Worker, run_worker
+
+__all__ = [
+    'ClaimedTask', 'RunState', 'TaskQueue', 'SQLiteTaskQueue',
+    'DistributedFlow', 'RemoteExecutionError',
+    'Worker', 'run_worker',
+]
@@ -0,0 +1,225 @@
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class ClaimedTask:
+    id: int
+    run_id: str
+    flow: str
+    step: int
+    payload: str
+    attempts: int
+    lease: str
+
+
+@dataclass
+class RunState:
+    run_id: str
+    status: str
+    result: Optional[str] = None
+    error: Optional[str] = None
+
+
+class TaskQueue(ABC):
+    """持久化的任务队列。
+
+    每个任务是Flow中的一个步骤；worker通过claim领取任务，领取后在visibility_timeout秒内不会被其他worker看到，
+    超时未完成的任务会重新可见并被重试，直到达到max_attempts。
+    complete/fail/extend都需要claim时得到的lease，过期的lease不会生效。
+    """
+
+    @abstractmethod
+    def create_run(self, flow: str, payload: str) -> str:
+        pass
+
+    @abstractmethod
+    def claim(self, flow: str) -> Optional[ClaimedTask]:
+        pass
+
+    @abstractmethod
+    def complete(self, task: ClaimedTask, next_payload: Optional[str] = None,
+                 result: Optional[str] = None) -> bool:
+        pass
+
+    @abstractmethod
+    def fail(self, task: ClaimedTask, error: str) -> bool:
+        pass
+
+    @abstractmethod
+    def extend(self, task: ClaimedTask) -> bool:
+        pass
+
+    @abstractmethod
+    def get_run(self, run_id: str) -> Optional[RunState]:
+        pass
+
+
+class SQLiteTaskQueue(TaskQueue):
+    def __init__(self, path: str, visibility_timeout: float = 60.0, max_attempts: int = 3,
+                 retry_delay: float = 1.0):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._local = threading.local()
+        self._init_schema()
+
+    def create_run(self, flow: str, payload: str) -> str:
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO runs (run_id, flow, status, created_at) VALUES (?, ?, ?, ?)",
+                         (run_id, flow, RUNNING, now))
+            conn.execute("INSERT INTO tasks (run_id, flow, step, payload, status, attempts, visible_at, created_at) "
+                         "VALUES (?, ?, 0, ?, ?, 0, ?, ?)", (run_id, flow, payload, PENDING, now, now))
+        return run_id
+
+    def claim(self, flow: str) -> Optional[ClaimedTask]:
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT id, run_id, step, payload, attempts FROM tasks "
+                    "WHERE flow = ? AND status IN (?, ?) AND visible_at <= ? ORDER BY id LIMIT 1",
+                    (flow, PENDING, RUNNING, now)).fetchone()
+                if row is None:
+                    return None
+
+                task_id, run_id, step, payload, attempts = row
+                if attempts >= self.max_attempts:
+                    # 已经用完重试次数的任务（worker崩溃导致lease过期）
+                    self._fail_run(conn, task_id, run_id, "Task exceeded max attempts", now)
+                    continue
+
+                lease = uuid.uuid4().hex
+                conn.execute("UPDATE tasks SET status = ?, attempts = attempts + 1, visible_at = ?, lease = ? "
+                             "WHERE id = ?", (RUNNING, now + self.visibility_timeout, lease, task_id))
+                return ClaimedTask(task_id, run_id, flow, step, payload, attempts + 1, lease)
+
+    def complete(self, task: ClaimedTask, next_payload: Optional[str] = None,
+                 result: Optional[str] = None) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            if not self._holds_lease(conn, task):
+                return False
+
+            conn.execute("UPDATE tasks SET status = ?, lease = NULL WHERE id = ?", (DONE, task.id))
+            if next_payload is not None:
+                conn.execute("INSERT INTO tasks (run_id, flow, step, payload, status, attempts, visible_at, "
+                             "created_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                             (task.run_id, task.flow, task.step + 1, next_payload, PENDING, now, now))
+            else:
+                conn.execute("UPDATE runs SET status = ?, result = ?, finished_at = ? WHERE run_id = ?",
+                             (DONE, result, now, task.run_id))
+        return True
+
+    def fail(self, task: ClaimedTask, error: str) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            if not self._holds_lease(conn, task):
+                return False
+
+            if task.attempts >= self.max_attempts:
+                self._fail_run(conn, task.id, task.run_id, error, now)
+            else:
+                conn.execute("UPDATE tasks SET status = ?, visible_at = ?, error = ?, lease = NULL WHERE id = ?",
+                             (PENDING, now + self.retry_delay * task.attempts, error, task.id))
+        return True
+
+    def extend(self, task: ClaimedTask) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET visible_at = ? WHERE id = ? AND lease = ? AND status = ?",
+                                  (time.time() + self.visibility_timeout, task.id, task.lease, RUNNING))
+            return cursor.rowcount == 1
+
+    def get_run(self, run_id: str) -> Optional[RunState]:
+        row = self._connection().execute("SELECT status, result, error FROM runs WHERE run_id = ?",
+                                         (run_id,)).fetchone()
+        return RunState(run_id, *row) if row else None
+
+    def pending_tasks(self, flow: Optional[str] = None) -> int:
+        query = "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)"
+        params = [PENDING, RUNNING]
+        if flow:
+            query += " AND flow = ?"
+            params.append(flow)
+        return self._connection().execute(query, params).fetchone()[0]
+
+    def _holds_lease(self, conn: sqlite3.Connection, task: ClaimedTask) -> bool:
+        row = conn.execute("SELECT lease, status FROM tasks WHERE id = ?", (task.id,)).fetchone()
+        return row is not None and row[0] == task.lease and row[1] == RUNNING
+
+    def _fail_run(self, conn: sqlite3.Connection, task_id: int, run_id: str, error: str, now: float) -> None:
+        conn.execute("UPDATE tasks SET status = ?, error = ?, lease = NULL WHERE id = ?", (FAILED, error, task_id))
+        conn.execute("UPDATE runs SET status = ?, error = ?, finished_at = ? WHERE run_id = ?",
+                     (FAILED, error, now, run_id))
+
+    def _init_schema(self) -> None:
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                flow TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                flow TEXT NOT NULL,
+                step INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL,
+                lease TEXT,
+                error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (flow, status, visible_at);
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self._connection())
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE事务，保证claim在多个进程之间互斥"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
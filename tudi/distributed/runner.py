@@ -0,0 +1,47 @@
+import time
+from typing import Any, Optional
+
+from tudi.base import Task
+from tudi.distributed.queue import DONE, FAILED, TaskQueue
+from tudi.serialization import dumps_typed, loads_typed
+
+
+class RemoteExecutionError(RuntimeError):
+    def __init__(self, run_id: str, error: Optional[str]):
+        super().__init__(f"Run {run_id} failed: {error}")
+        self.run_id = run_id
+        self.error = error
+
+
+class DistributedFlow:
+    """把Flow的输入提交到队列，由其他进程中的Worker逐步执行。
+
+    flow_key需要和Worker使用的一致，默认都使用Flow的名字。
+    """
+
+    def __init__(self, flow: Task, queue: TaskQueue, flow_key: Optional[str] = None,
+                 poll_interval: float = 0.05):
+        self.flow = flow
+        self.queue = queue
+        self.flow_key = flow_key or getattr(flow, "name", "flow")
+        self.poll_interval = poll_interval
+
+    def submit(self, input_data: Any) -> str:
+        return self.queue.create_run(self.flow_key, dumps_typed(input_data))
+
+    def result(self, run_id: str, timeout: Optional[float] = None) -> Any:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self.queue.get_run(run_id)
+            if state is None:
+                raise KeyError(f"Unknown run: {run_id}")
+            if state.status == DONE:
+                return loads_typed(state.result, self.flow.output_type)
+            if state.status == FAILED:
+                raise RemoteExecutionError(run_id, state.error)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Run {run_id} did not finish within {timeout} seconds")
+            time.sleep(self.poll_interval)
+
+    def run(self, input_data: Any, timeout: Optional[float] = None) -> Any:
+        return self.result(self.submit(input_data), timeout)
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+import traceback
+from typing import Any, Optional
+
+from tudi.base import Task
+from tudi.distributed.queue import ClaimedTask, TaskQueue
+from tudi.serialization import dumps_typed, loads_typed
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """从队列中领取Flow的步骤并执行。
+
+    每个任务只执行Flow中的一个步骤，结果序列化后作为下一个步骤的任务写回队列，
+    最后一个步骤的结果写入run。执行期间定期延长任务的可见时间，避免长时间运行的步骤被重复领取。
+    """
+
+    def __init__(self, flow: Task, queue: TaskQueue, flow_key: Optional[str] = None,
+                 poll_interval: float = 0.2):
+        self.flow = flow
+        self.queue = queue
+        self.flow_key = flow_key or getattr(flow, "name", "flow")
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.failed = 0
+        self._stopped = threading.Event()
+
+    @property
+    def steps(self) -> list:
+        # 单个Agent也可以分布式执行，只有一个步骤
+        return list(getattr(self.flow, "_tasks", [self.flow]))
+
+    def run_once(self) -> bool:
+        """领取并执行一个任务，队列中没有可执行的任务时返回False"""
+        task = self.queue.claim(self.flow_key)
+        if task is None:
+            return False
+
+        steps = self.steps
+        heartbeat = _Heartbeat(self.queue, task)
+        heartbeat.start()
+        try:
+            step = steps[task.step]
+            output = step.run(loads_typed(task.payload, step.input_type))
+        except Exception as e:
+            heartbeat.stop()
+            self.failed += 1
+            logger.warning("Step %s of run %s failed (attempt %s): %s", task.step, task.run_id, task.attempts, e)
+            self.queue.fail(task, "".join(traceback.format_exception_only(type(e), e)).strip())
+            return True
+        heartbeat.stop()
+
+        payload = dumps_typed(output)
+        if task.step + 1 < len(steps):
+            completed = self.queue.complete(task, next_payload=payload)
+        else:
+            completed = self.queue.complete(task, result=payload)
+        if not completed:
+            logger.warning("Lease of step %s in run %s expired, result discarded", task.step, task.run_id)
+        self.processed += 1
+        return True
+
+    def run_forever(self, idle_timeout: Optional[float] = None) -> None:
+        """持续处理任务；设置了idle_timeout时，连续空闲超过该时间后退出"""
+        idle_since = time.monotonic()
+        while not self._stopped.is_set():
+            if self.run_once():
+                idle_since = time.monotonic()
+                continue
+            if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                return
+            self._stopped.wait(self.poll_interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+class _Heartbeat:
+    def __init__(self, queue: TaskQueue, task: ClaimedTask):
+        self.queue = queue
+        self.task = task
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        interval = getattr(self.queue, "visibility_timeout", None)
+        if not interval:
+            return
+        self._thread = threading.Thread(target=self._run, args=(interval / 2,), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            if not self.queue.extend(self.task):
+                return
+
+
+def run_worker(flow_path: str, queue_path: str, flow_key: Optional[str] = None,
+               idle_timeout: Optional[float] = None, **queue_options: Any) -> None:
+    """在当前进程中加载Flow并运行一个worker，作为多进程worker的入口"""
+    from tudi.cli import load_flow
+    from tudi.distributed.queue import SQLiteTaskQueue
+
+    worker = Worker(load_flow(flow_path), SQLiteTaskQueue(queue_path, **queue_options), flow_key)
+    worker.run_forever(idle_timeout=idle_timeout)
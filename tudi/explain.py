@@ -0,0 +1,204 @@
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from tudi.budget import AgentBudget
+from tudi.serialization import sample_value
+from tudi.usage import estimate_tokens
+
+if TYPE_CHECKING:
+    from tudi.agent import Agent
+    from tudi.runlog import RunLog
+
+Tokenizer = Callable[[str], int]
+
+
+@dataclass
+class AgentEstimate:
+    """一个Agent每次运行的模型调用次数和prompt骨架的token数。
+
+    骨架是用示例输入渲染的prompt，包括格式说明和工具描述；ReAct循环中scratchpad逐步变长，
+    token数按每次调用都只发送骨架计算，是下限。max_calls为None表示循环没有次数上限。
+    """
+    agent: str
+    mode: str
+    prompt: str
+    prompt_tokens: int
+    min_calls: int
+    max_calls: Optional[int]
+    reformat_tokens: int = 0
+    notes: List[str] = field(default_factory=list)
+
+    @property
+    def min_prompt_tokens(self) -> int:
+        return self._tokens(self.min_calls)
+
+    @property
+    def max_prompt_tokens(self) -> Optional[int]:
+        return None if self.max_calls is None else self._tokens(self.max_calls)
+
+    def _tokens(self, calls: int) -> int:
+        # 重新格式化为output_type的调用在最后，不使用ReAct的prompt
+        if self.reformat_tokens and calls > 0:
+            return (calls - 1) * self.prompt_tokens + self.reformat_tokens
+        return calls * self.prompt_tokens
+
+
+@dataclass
+class StepEstimate:
+    """Flow中的一个步骤；分支语句的min/max取各个分支中最少和最多的一个"""
+    step: str
+    agents: List[AgentEstimate]
+    min_calls: int
+    max_calls: Optional[int]
+    min_prompt_tokens: int
+    max_prompt_tokens: Optional[int]
+    measured_latency: Optional[float] = None
+    measured_runs: int = 0
+
+
+@dataclass
+class FlowEstimate:
+    flow: str
+    steps: List[StepEstimate]
+    measured_latency: Optional[float] = None
+    measured_runs: int = 0
+
+    @property
+    def min_calls(self) -> int:
+        return sum(step.min_calls for step in self.steps)
+
+    @property
+    def max_calls(self) -> Optional[int]:
+        return _total(step.max_calls for step in self.steps)
+
+    @property
+    def min_prompt_tokens(self) -> int:
+        return sum(step.min_prompt_tokens for step in self.steps)
+
+    @property
+    def max_prompt_tokens(self) -> Optional[int]:
+        return _total(step.max_prompt_tokens for step in self.steps)
+
+    def __str__(self) -> str:
+        rows = [("step", "calls", "prompt tokens", "latency")]
+        for step in self.steps:
+            rows.append((step.step, _range(step.min_calls, step.max_calls),
+                         _range(step.min_prompt_tokens, step.max_prompt_tokens),
+                         _latency(step.measured_latency, step.measured_runs)))
+        rows.append(("total", _range(self.min_calls, self.max_calls),
+                     _range(self.min_prompt_tokens, self.max_prompt_tokens),
+                     _latency(self.measured_latency, self.measured_runs)))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+        for step in self.steps:
+            for agent in step.agents:
+                lines.extend(f"{agent.agent}: {note}" for note in agent.notes)
+        return "\n".join(lines)
+
+
+def explain_agent(agent: "Agent", count_tokens: Tokenizer = estimate_tokens) -> AgentEstimate:
+    sample = agent.input_type.model_validate(sample_value(agent.input_type)) if agent.input_type else "{input}"
+    notes = []
+    if agent.tools:
+        prompt = _text(agent._react_prompt.format_prompt(input=agent._as_input(sample), agent_scratchpad=""))
+        budget = agent.budget or AgentBudget()
+        max_calls = budget.max_iterations
+        if budget.early_stopping_method == "generate" and max_calls is not None:
+            max_calls += 1
+            notes.append("one more call to generate the final answer when the budget runs out")
+        min_calls = 1
+        reformat_tokens = 0
+        if agent.output_type:
+            reformat_tokens = count_tokens(_text(agent._result_template.format_prompt(input="{result}")))
+            min_calls += 1
+            max_calls = max_calls + 1 if max_calls is not None else None
+            notes.append("one more call to reformat the answer as " + agent.output_type.__name__)
+        if agent.trajectory_cache is not None:
+            notes.append("replayed trajectories make one call for the final answer")
+        estimate = AgentEstimate(agent.name, "react", prompt, count_tokens(prompt), min_calls, max_calls,
+                                 reformat_tokens, notes)
+    else:
+        prompt = _text(agent._format_prompt(sample))
+        mode, max_calls = "single", 1
+        if agent.cascade:
+            mode, max_calls = "cascade", len(agent.cascade.models) + 1
+        elif agent.self_consistency:
+            mode, max_calls = "self_consistency", agent.self_consistency.samples
+            notes.append(f"{max_calls} samples sent concurrently, returns when {agent.self_consistency.agree} agree")
+        elif agent.thinking_budget:
+            mode, max_calls = "thinking", 2
+            notes.append("one more call when thinking is cut off by the budget")
+        min_calls = agent.self_consistency.agree if agent.self_consistency else 1
+        estimate = AgentEstimate(agent.name, mode, prompt, count_tokens(prompt), min_calls, max_calls, notes=notes)
+
+    if agent.cache is not None:
+        estimate.min_calls = 0
+        notes.append("cache hits make no calls")
+    return estimate
+
+
+def measured_latencies(run_log: "RunLog", flow: str) -> Dict[str, List[float]]:
+    """已经写出的运行记录中每个步骤的耗时，run_end的耗时放在"total"下"""
+    durations: Dict[str, List[float]] = {}
+    for event in run_log.query(flow=flow):
+        if event["kind"] == "step":
+            durations.setdefault(event["step"], []).append(event["duration"])
+        elif event["kind"] == "run_end":
+            durations.setdefault("total", []).append(event["duration"])
+    return durations
+
+
+def combine(step: str, estimates: List[Any], branches: bool = False,
+            fixed_calls: int = 0, fixed_tokens: int = 0, may_skip: bool = False) -> StepEstimate:
+    """合并一个步骤中的估算：顺序执行时相加，分支时取最少和最多的分支；
+    fixed_*是与分支无关的开销（例如路由分类调用），may_skip表示可能没有分支被选中"""
+    agents = [agent for estimate in estimates for agent in _agents(estimate)]
+    mins = [(estimate.min_calls, estimate.min_prompt_tokens) for estimate in estimates]
+    maxes = [(estimate.max_calls, estimate.max_prompt_tokens) for estimate in estimates]
+    if not estimates:
+        min_calls = min_tokens = 0
+        max_calls, max_tokens = 0, 0
+    elif branches:
+        min_calls = 0 if may_skip else min(calls for calls, _ in mins)
+        min_tokens = 0 if may_skip else min(tokens for _, tokens in mins)
+        max_calls = None if any(calls is None for calls, _ in maxes) else max(calls for calls, _ in maxes)
+        max_tokens = None if any(tokens is None for _, tokens in maxes) else max(tokens for _, tokens in maxes)
+    else:
+        min_calls = sum(calls for calls, _ in mins)
+        min_tokens = sum(tokens for _, tokens in mins)
+        max_calls = _total(calls for calls, _ in maxes)
+        max_tokens = _total(tokens for _, tokens in maxes)
+    return StepEstimate(step, agents, min_calls + fixed_calls,
+                        None if max_calls is None else max_calls + fixed_calls,
+                        min_tokens + fixed_tokens, None if max_tokens is None else max_tokens + fixed_tokens)
+
+
+def _agents(estimate: Any) -> List[AgentEstimate]:
+    if isinstance(estimate, AgentEstimate):
+        return [estimate]
+    if isinstance(estimate, FlowEstimate):
+        return [agent for step in estimate.steps for agent in step.agents]
+    return list(estimate.agents)
+
+
+def _text(prompt: Any) -> str:
+    return prompt if isinstance(prompt, str) else prompt.to_string()
+
+
+def _total(values) -> Optional[int]:
+    total = 0
+    for value in values:
+        if value is None:
+            return None
+        total += value
+    return total
+
+
+def _range(low: int, high: Optional[int]) -> str:
+    if high is None:
+        return f"{low}+"
+    return str(low) if low == high else f"{low}-{high}"
+
+
+def _latency(seconds: Optional[float], runs: int) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms (n={runs})"
@@ -1,22 +1,52 @@
-from typing import Any, Callable, List, Optional, Type, TypeVar
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 
+from langchain_core.language_models.chat_models import BaseChatModel
 from pydantic import BaseModel
 
+from tudi import metrics
 from tudi.agent import Agent
+from tudi.explain import (
+    AgentEstimate,
+    FlowEstimate,
+    StepEstimate,
+    Tokenizer,
+    combine,
+    explain_agent,
+    measured_latencies,
+)
+from tudi.runlog import RunLog, RunRecorder
+from tudi.singleflight import SingleFlight, input_key
 from tudi.statements.case import When
+from tudi.step_cache import StepCache, fingerprint
+from tudi.streaming import PartialOutput, final_output
+from tudi.usage import estimate_tokens
+from tudi.warmup import ModelWarmup, prefill, warmup_models
 
-from .base import Runnable, Statement, Task
+from .base import Runnable, Statement, Task, batch_results
+
+logger = logging.getLogger(__name__)
 
 InputT = TypeVar('InputT', bound=BaseModel)
 OutputT = TypeVar('OutputT', bound=BaseModel)
 
 
 class Flow(Task):
-    def __init__(self, task: Task):
+    def __init__(self, task: Task, name: Optional[str] = None, single_flight: bool = False,
+                 run_log: Optional[RunLog] = None, step_cache: Optional[StepCache] = None):
         super().__init__()
         self._tasks: List[Runnable] = [task]
         self._input_type = task.input_type
+        self.name = name or getattr(task, "name", "flow")
+        self.single_flight = SingleFlight(self.name) if single_flight else None
+        self.run_log = run_log
+        self.step_cache = step_cache
+        self._fingerprints: Dict[int, str] = {}
 
+    @property
     def input_type(self) -> Type[InputT]:
         return self._input_type
 
@@ -28,8 +58,13 @@ class Flow(Task):
         return self._tasks[-1].output_type
 
     @classmethod
-    def start(cls, task: Task) -> 'Flow':
-        return cls(task)
+    def start(cls, task: Task, name: Optional[str] = None, single_flight: bool = False,
+              run_log: Optional[RunLog] = None, step_cache: Optional[StepCache] = None) -> 'Flow':
+        """single_flight为True时，并发的相同输入只执行一次，所有调用得到同一个结果；
+        run_log记录每次运行的输入、各步骤的输出、分支选择和耗时；
+        step_cache保存每个步骤的结果，步骤的定义和输入都没有变化时直接复用
+        """
+        return cls(task, name, single_flight, run_log, step_cache)
 
     def map(self, mapper: Callable[[Any], Any]) -> 'Flow':
         from tudi.statements import MapStatement
@@ -48,7 +83,9 @@ class Flow(Task):
         return self
 
     def _create_case_statement(self, conditions: list[When],
-                               output_type: Optional[Type] = None) -> Statement:
+                               output_type: Optional[Type] = None,
+                               depends_on: Optional[Sequence[str]] = None,
+                               warmup: Optional[bool] = None) -> Statement:
         from tudi.statements import CaseStatement
         for condition in conditions:
             if not condition.has_then():
@@ -58,7 +95,18 @@ class Flow(Task):
         # 检查所有分支的输出类型是否一致
         self._validate_case_branch_types(conditions, output_type)
 
-        return CaseStatement(conditions, output_type)
+        if depends_on:
+            self._validate_depends_on(depends_on)
+
+        return CaseStatement(conditions, output_type, depends_on, warmup)
+
+    def _validate_depends_on(self, depends_on: Sequence[str]) -> None:
+        upstream = self._tasks[-1].output_type
+        if not (isinstance(upstream, type) and issubclass(upstream, BaseModel)):
+            raise TypeError("depends_on requires the previous step to have a Pydantic output_type")
+        missing = [name for name in depends_on if name not in upstream.model_fields]
+        if missing:
+            raise ValueError(f"{upstream.__name__} has no fields: {', '.join(missing)}")
 
     def _validate_case_branch_types(self, conditions: list[When],
                                     output_type: Optional[Type] = None) -> None:
@@ -87,8 +135,30 @@ class Flow(Task):
                 raise TypeError(error_msg)
 
     def case(self, *conditions: When,
-             output_type: Optional[Type] = None) -> 'Flow':
-        statement = self._create_case_statement(list(conditions), output_type)
+             output_type: Optional[Type] = None,
+             depends_on: Optional[Sequence[str]] = None,
+             warmup: Optional[bool] = None) -> 'Flow':
+        """depends_on声明条件用到的上游字段，上游Agent流式输出这些字段后就提前选择分支并预填充该分支的prompt前缀；
+        warmup=False关闭预填充"""
+        statement = self._create_case_statement(list(conditions), output_type, depends_on, warmup)
+        self._tasks.append(statement)
+        self._on_new_runnable(statement)
+        return self
+
+    def route(self, model: BaseChatModel, *routes: When,
+              output_type: Optional[Type] = None,
+              prompt_template: Optional[str] = None,
+              constrained: bool = False,
+              cache_size: int = 256) -> 'Flow':
+        """由模型一次分类调用选择分支，分支用route(label, description).then(agent)声明"""
+        from tudi.statements import RouteStatement
+        for condition in routes:
+            if not condition.has_then():
+                raise ValueError("Condition must have an agent set using 'then' method")
+            condition.validate_type_compatibility(self._tasks[-1])
+        self._validate_case_branch_types(list(routes), output_type)
+
+        statement = RouteStatement(model, list(routes), output_type, prompt_template, constrained, cache_size)
         self._tasks.append(statement)
         self._on_new_runnable(statement)
         return self
@@ -105,11 +175,402 @@ class Flow(Task):
         validate_type_compatibility(last_agent, next_agent)
 
     def run(self, input_data: Any) -> Any:
+        if self.single_flight is not None:
+            return self.single_flight.do(input_key(input_data), lambda: self._run(input_data))
+        return self._run(input_data)
+
+    def _run(self, input_data: Any) -> Any:
+        recorder = self._start_recording(input_data)
+        try:
+            result = self._run_steps(input_data, len(self._tasks), recorder)
+        except Exception as e:
+            if recorder is not None:
+                recorder.fail(e)
+            raise
+        if recorder is not None:
+            recorder.finish(result)
+        return result
+
+    def _run_steps(self, input_data: Any, end: int, recorder: Optional[RunRecorder]) -> Any:
+        """依次执行前end个步骤"""
+        result = input_data
+        index = 0
+        while index < end:
+            # 使用步骤缓存时按步骤执行，命中缓存的上游步骤不需要流式输出
+            case = self._early_routed_case(index, end) if self.step_cache is None else None
+            if case is None:
+                result = self._run_step(index, result, recorder)
+                index += 1
+            else:
+                result = self._run_early_routed(index, case, result, recorder)
+                index += 2
+        return result
+
+    def _run_step(self, index: int, input_data: Any, recorder: Optional[RunRecorder] = None) -> Any:
+        if not metrics.registry.enabled and recorder is None and self.step_cache is None:
+            return self._tasks[index].run(input_data)
+
+        started = time.perf_counter()
+        try:
+            output = self._execute(index, input_data, recorder)
+        finally:
+            if metrics.registry.enabled:
+                self._observe_step(index, started)
+        self._record_step(recorder, index, output, started)
+        return output
+
+    def _execute(self, index: int, input_data: Any, recorder: Optional[RunRecorder]) -> Any:
+        if self.step_cache is None:
+            return self._execute_step(index, input_data, recorder)
+
+        key = self._step_key(index, input_data)
+        output_type = self._tasks[index].output_type
+        found, output = self.step_cache.get(self._step_scope(index), key, output_type)
+        if not found:
+            output = self._execute_step(index, input_data, recorder)
+            self.step_cache.put(key, output, output_type)
+        return output
+
+    async def _aexecute(self, index: int, input_data: Any, recorder: Optional[RunRecorder]) -> Any:
+        """异步执行一个步骤：Agent和嵌套Flow使用arun，其他步骤在线程中执行"""
+        runnable = self._unwrap(self._tasks[index])
+        if not isinstance(runnable, (Agent, Flow)):
+            return await asyncio.to_thread(self._execute, index, input_data, recorder)
+        if self.step_cache is None:
+            return await runnable.arun(input_data)
+
+        key = self._step_key(index, input_data)
+        output_type = self._tasks[index].output_type
+        found, output = self.step_cache.get(self._step_scope(index), key, output_type)
+        if not found:
+            output = await runnable.arun(input_data)
+            self.step_cache.put(key, output, output_type)
+        return output
+
+    def _step_key(self, index: int, input_data: Any) -> str:
+        # 指纹需要读取源码和模型参数，每个步骤只计算一次
+        if index not in self._fingerprints:
+            self._fingerprints[index] = fingerprint(self._tasks[index])
+        return self.step_cache.key(self._fingerprints[index], input_data)
+
+    def _step_scope(self, index: int) -> str:
+        return f"{self.name}/{self.step_label(index)}"
+
+    def _execute_step(self, index: int, input_data: Any, recorder: Optional[RunRecorder]) -> Any:
+        """执行一个步骤；记录运行时，分支语句的选择结果也会被记录"""
+        from tudi.statements import CaseStatement, RouteStatement
+        task = self._tasks[index]
+        if recorder is None or not isinstance(task, (CaseStatement, RouteStatement)):
+            return task.run(input_data)
+
+        condition, branch = task._select(input_data)
+        self._record_branch(recorder, index, condition, branch)
+        return task.run_selected(input_data, condition, branch)
+
+    def _start_recording(self, input_data: Any) -> Optional[RunRecorder]:
+        return self.run_log.start_run(self.name, input_data) if self.run_log is not None else None
+
+    def _record_branch(self, recorder: Optional[RunRecorder], index: int, condition, branch: str) -> None:
+        if recorder is not None:
+            recorder.branch(self.step_label(index), branch,
+                            condition.agent.name if condition and condition.agent else None)
+
+    def _record_step(self, recorder: Optional[RunRecorder], index: int, output: Any, started: float) -> None:
+        if recorder is None:
+            return
+        agent = self._unwrap(self._tasks[index])
+        recorder.step(self.step_label(index), agent.name if isinstance(agent, Agent) else None,
+                      output, time.perf_counter() - started)
+
+    def _observe_step(self, index: int, started: float) -> None:
+        metrics.registry.observe(metrics.STEP_LATENCY, time.perf_counter() - started,
+                                 flow=self.name, step=self.step_label(index))
+
+    def _early_routed_case(self, index: int, end: int):
+        """下一步是声明了depends_on的CaseStatement，并且当前步骤是可以流式输出的Agent时返回该CaseStatement"""
+        from tudi.statements import CaseStatement
+        if index + 1 >= end:
+            return None
+        case = self._tasks[index + 1]
+        if not isinstance(case, CaseStatement) or not case.depends_on:
+            return None
+
+        upstream = self._unwrap(self._tasks[index])
+        if not isinstance(upstream, Agent) or not _streamable(upstream):
+            return None
+        return case
+
+    def _run_early_routed(self, index: int, case, input_data: Any, recorder: Optional[RunRecorder] = None) -> Any:
+        upstream = self._unwrap(self._tasks[index])
+        started = time.perf_counter()
+        selection = None
+        output = None
+        for output in upstream.stream(input_data):
+            if selection is None and set(case.depends_on) <= set(output.completed):
+                selection = self._select_early(case, output.value)
+        if metrics.registry.enabled:
+            self._observe_step(index, started)
+
+        result = output.value
+        self._record_step(recorder, index, result, started)
+        # 条件可能用到了没有声明的字段，以完整结果为准
+        final_selection = case._select(result)
+        if selection is None or selection[1] != final_selection[1]:
+            logger.debug("Early routing of %s changed from %s to %s", self.step_label(index + 1),
+                         selection and selection[1], final_selection[1])
+
+        condition, branch = final_selection
+        self._record_branch(recorder, index + 1, condition, branch)
+
+        started = time.perf_counter()
+        try:
+            output = case.run_selected(result, condition, branch)
+        finally:
+            if metrics.registry.enabled:
+                self._observe_step(index + 1, started)
+        self._record_step(recorder, index + 1, output, started)
+        return output
+
+    def _select_early(self, case, partial: Any):
+        try:
+            selection = case._select(partial)
+        except Exception:
+            # 条件用到了还没有生成的字段，等待完整结果
+            return None
+
+        condition = selection[0]
+        if case.warmup and condition is not None and condition.agent is not None:
+            threading.Thread(target=_prefill_quietly, args=(condition.agent,), daemon=True).start()
+        return selection
+
+    @staticmethod
+    def _unwrap(task: Runnable) -> Runnable:
+        from tudi.statements import NextStatement
+        return task.runnable if isinstance(task, NextStatement) else task
+
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        """批量执行：每个步骤一次处理整批输入，Agent合并为批量调用，分支语句按选中的分支分组后批量执行。
+
+        return_exceptions为True时失败的输入不再进入后面的步骤，结果是对应的异常。
+        与run一样记录指标、运行记录（每个输入一次运行）和步骤缓存。
+        """
+        recorders = [self._start_recording(input_data) for input_data in inputs]
+        results = list(inputs)
+        alive = list(range(len(results)))
+        try:
+            for index in range(len(self._tasks)):
+                if not alive:
+                    break
+                started = time.perf_counter()
+                try:
+                    outputs = self._run_batch_step(index, [results[position] for position in alive],
+                                                   return_exceptions)
+                finally:
+                    if metrics.registry.enabled:
+                        self._observe_step(index, started)
+                for position, output in zip(alive, outputs, strict=True):
+                    results[position] = output
+                    if not isinstance(output, Exception):
+                        self._record_step(recorders[position], index, output, started)
+                alive = [position for position in alive if not isinstance(results[position], Exception)]
+        except Exception as e:
+            for position in alive:
+                if recorders[position] is not None:
+                    recorders[position].fail(e)
+            raise
+
+        for recorder, result in zip(recorders, results, strict=True):
+            if recorder is None:
+                continue
+            if isinstance(result, Exception):
+                recorder.fail(result)
+            else:
+                recorder.finish(result)
+        return batch_results(results, return_exceptions)
+
+    def _run_batch_step(self, index: int, inputs: List[Any], return_exceptions: bool) -> List[Any]:
+        task = self._tasks[index]
+        if self.step_cache is None:
+            return task.run_batch(inputs, return_exceptions)
+
+        keys = [self._step_key(index, input_data) for input_data in inputs]
+        outputs: List[Any] = [None] * len(inputs)
+        missing = []
+        for position, key in enumerate(keys):
+            found, outputs[position] = self.step_cache.get(self._step_scope(index), key, task.output_type)
+            if not found:
+                missing.append(position)
+        if missing:
+            computed = task.run_batch([inputs[position] for position in missing], return_exceptions)
+            for position, output in zip(missing, computed, strict=True):
+                outputs[position] = output
+                if not isinstance(output, Exception):
+                    self.step_cache.put(keys[position], output, task.output_type)
+        return outputs
+
+    async def arun(self, input_data: Any) -> Any:
+        """异步执行：Agent和嵌套Flow使用arun，其他步骤在线程中执行"""
+        if self.single_flight is not None:
+            return await self.single_flight.ado(input_key(input_data), lambda: self._arun(input_data))
+        return await self._arun(input_data)
+
+    async def _arun(self, input_data: Any) -> Any:
+        recorder = self._start_recording(input_data)
         result = input_data
-        for agent in self._tasks:
-            result = agent.run(result)
+        try:
+            for index in range(len(self._tasks)):
+                started = time.perf_counter()
+                try:
+                    result = await self._aexecute(index, result, recorder)
+                finally:
+                    if metrics.registry.enabled:
+                        self._observe_step(index, started)
+                self._record_step(recorder, index, result, started)
+        except Exception as e:
+            if recorder is not None:
+                recorder.fail(e)
+            raise
+        if recorder is not None:
+            recorder.finish(result)
         return result
 
+    def stream(self, input_data: Any) -> Iterator[PartialOutput]:
+        """执行前面的步骤后流式输出最后一个步骤的结果；最后一步不支持流式时（例如带工具的Agent）只输出最终结果。
+
+        与run一样记录指标、运行记录和步骤缓存；single_flight只合并前面的步骤，最后一步的流式输出不共享。
+        """
+        recorder = self._start_recording(input_data)
+        last = len(self._tasks) - 1
+        try:
+            if self.single_flight is not None:
+                upstream = self.single_flight.do(f"stream:{input_key(input_data)}",
+                                                 lambda: self._run_steps(input_data, last, recorder))
+            else:
+                upstream = self._run_steps(input_data, last, recorder)
+            output = yield from self._stream_step(last, upstream, recorder)
+        except Exception as e:
+            if recorder is not None:
+                recorder.fail(e)
+            raise
+        if recorder is not None:
+            recorder.finish(output)
+
+    def _stream_step(self, index: int, input_data: Any,
+                     recorder: Optional[RunRecorder]) -> Generator[PartialOutput, None, Any]:
+        """流式执行一个步骤，依次输出部分结果和最终结果，返回最终结果"""
+        task = self._tasks[index]
+        runnable = self._unwrap(task)
+        started = time.perf_counter()
+        found, output = False, None
+        try:
+            if self.step_cache is not None:
+                key = self._step_key(index, input_data)
+                found, output = self.step_cache.get(self._step_scope(index), key, task.output_type)
+            if not found:
+                if isinstance(runnable, Flow) or (isinstance(runnable, Agent) and _streamable(runnable)):
+                    for partial in runnable.stream(input_data):
+                        if partial.final:
+                            output = partial.value
+                        else:
+                            yield partial
+                else:
+                    output = self._execute_step(index, input_data, recorder)
+                if self.step_cache is not None:
+                    self.step_cache.put(key, output, task.output_type)
+        finally:
+            if metrics.registry.enabled:
+                self._observe_step(index, started)
+        self._record_step(recorder, index, output, started)
+        yield final_output(output)
+        return output
+
+    def warmup(self, keep_alive: Union[str, int, None] = None,
+               max_workers: Optional[int] = None) -> List[ModelWarmup]:
+        """预热Flow中用到的所有模型：包括各个分支、嵌套Flow和路由分类的模型。
+
+        先为每个Agent预先渲染模板和解析示例结果，再并发地对每个不同的模型发起一次最小的调用，
+        返回每个模型的预热耗时；keep_alive会传给支持它的模型服务（例如Ollama的"30m"）。
+        """
+        from tudi.statements import RouteStatement
+        models = []
+        for agent in self._iter_agents():
+            agent.prebuild()
+            models.extend(agent.models())
+        for runnable in self._iter_runnables():
+            if isinstance(runnable, RouteStatement):
+                models.append(runnable.model)
+        return warmup_models(models, keep_alive, max_workers)
+
+    def explain(self, count_tokens: Optional[Tokenizer] = None, run_log: Optional[RunLog] = None) -> FlowEstimate:
+        """不调用模型，静态估算每个步骤的模型调用次数和prompt的token数。
+
+        分支语句给出最少和最多的分支，ReAct循环按预算的max_iterations给出上限；
+        count_tokens默认按字符数估算，可以换成模型的tokenizer。
+        run_log（默认是Flow的run_log）中已经写出的运行记录给出每个步骤实测的平均耗时。
+        """
+        count_tokens = count_tokens or estimate_tokens
+        estimate = FlowEstimate(self.name, [self._explain_step(index, count_tokens)
+                                            for index in range(len(self._tasks))])
+        run_log = run_log if run_log is not None else self.run_log
+        if run_log is None:
+            return estimate
+
+        durations = measured_latencies(run_log, self.name)
+        for step in estimate.steps:
+            step.measured_latency, step.measured_runs = _mean(durations.get(step.step))
+        estimate.measured_latency, estimate.measured_runs = _mean(durations.get("total"))
+        return estimate
+
+    def _explain_step(self, index: int, count_tokens: Tokenizer) -> StepEstimate:
+        from tudi.statements import CaseStatement, RouteStatement
+        task = self._unwrap(self._tasks[index])
+        label = self.step_label(index)
+        if isinstance(task, (CaseStatement, RouteStatement)):
+            branches = task.conditions if isinstance(task, CaseStatement) else list(task.routes.values())
+            estimates = [_explain_runnable(condition.agent, count_tokens)
+                         for condition in [*branches, task.default]
+                         if condition is not None and condition.agent is not None]
+            if isinstance(task, CaseStatement):
+                return combine(label, estimates, branches=True, may_skip=task.default is None)
+            # 路由的分类调用
+            classify = task._prompt.format_prompt(input="{input}").to_string()
+            return combine(label, estimates, branches=True, fixed_calls=1, fixed_tokens=count_tokens(classify),
+                           may_skip=task.default is None)
+
+        estimate = _explain_runnable(task, count_tokens)
+        return combine(label, [estimate] if estimate is not None else [])
+
+    def step_label(self, index: int) -> str:
+        task = self._tasks[index]
+        from tudi.statements import NextStatement
+        if isinstance(task, NextStatement):
+            task = task.runnable
+        kind = type(task).__name__
+        name = getattr(task, "name", None)
+        return f"{index}:{kind}:{name}" if name else f"{index}:{kind}"
+
+    def _iter_runnables(self) -> Iterator[Runnable]:
+        """递归遍历Flow中的所有步骤，包括分支和嵌套Flow中的Agent"""
+        from tudi.statements import CaseStatement, NextStatement, RouteStatement
+        for task in self._tasks:
+            yield task
+            if isinstance(task, NextStatement):
+                yield from _iter_nested(task.runnable)
+            elif isinstance(task, (CaseStatement, RouteStatement)):
+                branches = task.conditions if isinstance(task, CaseStatement) else list(task.routes.values())
+                for condition in [*branches, task.default]:
+                    if condition is not None and condition.agent is not None:
+                        yield from _iter_nested(condition.agent)
+            elif isinstance(task, Flow):
+                yield from task._iter_runnables()
+
+    def _iter_agents(self) -> Iterator[Agent]:
+        seen = set()
+        for runnable in self._iter_runnables():
+            if isinstance(runnable, Agent) and id(runnable) not in seen:
+                seen.add(id(runnable))
+                yield runnable
+
     def _on_new_runnable(self, runnable: Runnable) -> None:
         self._set_previous_map_output_type()
 
@@ -124,3 +585,38 @@ class Flow(Task):
         from tudi.statements import MapStatement
         if isinstance(prev_task, MapStatement) and prev_task.output_type is None:
             prev_task.output_type = current_task.input_type
+
+
+def _streamable(agent: Agent) -> bool:
+    try:
+        agent._validate_streaming()
+    except ValueError:
+        return False
+    return True
+
+
+def _prefill_quietly(agent: Agent) -> None:
+    try:
+        prefill(agent.model, agent.prompt_prefix())
+    except Exception as e:
+        logger.debug("Prefill of %s failed: %s", agent.name, e)
+
+
+def _explain_runnable(runnable: Runnable, count_tokens: Tokenizer) -> Union[AgentEstimate, FlowEstimate, None]:
+    if isinstance(runnable, Agent):
+        return explain_agent(runnable, count_tokens)
+    if isinstance(runnable, Flow):
+        return runnable.explain(count_tokens)
+    return None
+
+
+def _mean(values: Optional[List[float]]) -> Tuple[Optional[float], int]:
+    if not values:
+        return None, 0
+    return sum(values) / len(values), len(values)
+
+
+def _iter_nested(runnable: Runnable) -> Iterator[Runnable]:
+    yield runnable
+    if isinstance(runnable, Flow):
+        yield from runnable._iter_runnables()
@@ -0,0 +1,327 @@
+import bisect
+import copy
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.exceptions import OutputParserException
+
+from tudi.usage import UsageTracker, usage_scope
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+AGENT_LATENCY = "tudi_agent_latency_seconds"
+AGENT_RUNS = "tudi_agent_runs_total"
+STEP_LATENCY = "tudi_flow_step_latency_seconds"
+MODEL_CALLS = "tudi_model_calls_total"
+PROMPT_TOKENS = "tudi_prompt_tokens_total"
+COMPLETION_TOKENS = "tudi_completion_tokens_total"
+PARSE_FAILURES = "tudi_parse_failures_total"
+CASE_BRANCHES = "tudi_case_branch_total"
+TOOL_CALLS = "tudi_tool_calls_total"
+TOOL_LATENCY = "tudi_tool_latency_seconds"
+CASCADE_ATTEMPTS = "tudi_cascade_attempts_total"
+CASCADE_LATENCY = "tudi_cascade_tier_latency_seconds"
+SINGLE_FLIGHT_COLLAPSED = "tudi_single_flight_collapsed_total"
+RUN_LOG_DROPPED = "tudi_run_log_dropped_total"
+SCHEDULER_QUEUE_DEPTH = "tudi_scheduler_queue_depth"
+SCHEDULER_WAIT = "tudi_scheduler_wait_seconds"
+TRAJECTORY_CACHE = "tudi_trajectory_cache_total"
+TOOL_TIMEOUTS = "tudi_tool_timeouts_total"
+SELF_CONSISTENCY = "tudi_self_consistency_total"
+STEP_CACHE = "tudi_step_cache_total"
+SELF_CONSISTENCY_AGREEMENT = "tudi_self_consistency_agreement_ratio"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, labels: LabelKey, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def snapshot(self) -> list:
+        return [{"labels": dict(labels), "value": value} for labels, value in self.values.items()]
+
+    def render(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, float] = {}
+
+    def set(self, labels: LabelKey, value: float) -> None:
+        self.values[labels] = value
+
+    def snapshot(self) -> list:
+        return [{"labels": dict(labels), "value": value} for labels, value in self.values.items()]
+
+    def render(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[LabelKey, list] = {}
+
+    def observe(self, labels: LabelKey, value: float) -> None:
+        # [各个桶的计数..., +Inf桶的计数, sum]
+        data = self.values.get(labels)
+        if data is None:
+            data = [0] * (len(self.buckets) + 1) + [0.0]
+            self.values[labels] = data
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def snapshot(self) -> list:
+        result = []
+        for labels, data in self.values.items():
+            counts = data[:-1]
+            result.append({
+                "labels": dict(labels),
+                "count": sum(counts),
+                "sum": data[-1],
+                "buckets": dict(zip([*self.buckets, math.inf], _cumulative(counts), strict=True)),
+            })
+        return result
+
+    def render(self) -> Iterator[str]:
+        for labels, data in self.values.items():
+            cumulative = _cumulative(data[:-1])
+            for bound, count in zip([*self.buckets, math.inf], cumulative, strict=True):
+                le = (("le", "+Inf" if bound == math.inf else _format_value(bound)),)
+                yield f"{self.name}_bucket{_format_labels(labels + le)} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(data[-1])}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative[-1]}"
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，默认关闭；关闭时记录函数只做一次布尔判断"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+        self._register_defaults()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._metrics = {}
+            self._register_defaults()
+
+    def save(self) -> Dict[str, object]:
+        """复制当前的所有指标，之后可以用restore恢复"""
+        with self._lock:
+            return copy.deepcopy(self._metrics)
+
+    def restore(self, saved: Dict[str, object]) -> None:
+        with self._lock:
+            self._metrics = copy.deepcopy(saved)
+
+    def counter(self, name: str, documentation: str = "") -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str = "") -> Gauge:
+        with self._lock:
+            return self._metrics.setdefault(name, Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str = "",
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+        metric = self._metrics.get(name) or self.counter(name)
+        with self._lock:
+            metric.inc(_label_key(labels), value)
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        metric = self._metrics.get(name) or self.gauge(name)
+        with self._lock:
+            metric.set(_label_key(labels), value)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        metric = self._metrics.get(name) or self.histogram(name)
+        with self._lock:
+            metric.observe(_label_key(labels), value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {name: metric.snapshot() for name, metric in self._metrics.items()
+                             if isinstance(metric, Counter)},
+                "gauges": {name: metric.snapshot() for name, metric in self._metrics.items()
+                           if isinstance(metric, Gauge)},
+                "histograms": {name: metric.snapshot() for name, metric in self._metrics.items()
+                               if isinstance(metric, Histogram)},
+            }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+                lines.append(f"# HELP {name} {metric.documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register_defaults(self) -> None:
+        self._metrics[AGENT_RUNS] = Counter(AGENT_RUNS, "Agent runs by outcome")
+        self._metrics[AGENT_LATENCY] = Histogram(AGENT_LATENCY, "Agent run latency in seconds")
+        self._metrics[STEP_LATENCY] = Histogram(STEP_LATENCY, "Flow step latency in seconds")
+        self._metrics[MODEL_CALLS] = Counter(MODEL_CALLS, "Model calls made by agents")
+        self._metrics[PROMPT_TOKENS] = Counter(PROMPT_TOKENS, "Prompt tokens sent by agents")
+        self._metrics[COMPLETION_TOKENS] = Counter(COMPLETION_TOKENS, "Completion tokens received by agents")
+        self._metrics[PARSE_FAILURES] = Counter(PARSE_FAILURES, "Output parser failures")
+        self._metrics[CASE_BRANCHES] = Counter(CASE_BRANCHES, "Case statement branch hits")
+        self._metrics[TOOL_CALLS] = Counter(TOOL_CALLS, "Tool calls made by agents")
+        self._metrics[TOOL_LATENCY] = Histogram(TOOL_LATENCY, "Tool call latency in seconds")
+        self._metrics[CASCADE_ATTEMPTS] = Counter(CASCADE_ATTEMPTS, "Model cascade attempts by tier and outcome")
+        self._metrics[CASCADE_LATENCY] = Histogram(CASCADE_LATENCY, "Model cascade tier latency in seconds")
+        self._metrics[SINGLE_FLIGHT_COLLAPSED] = Counter(SINGLE_FLIGHT_COLLAPSED,
+                                                         "Calls that joined an identical in-flight call")
+        self._metrics[RUN_LOG_DROPPED] = Counter(RUN_LOG_DROPPED, "Run log events dropped because the buffer was full")
+        self._metrics[SCHEDULER_QUEUE_DEPTH] = Gauge(SCHEDULER_QUEUE_DEPTH, "Model calls waiting in the scheduler")
+        self._metrics[SCHEDULER_WAIT] = Histogram(SCHEDULER_WAIT, "Time model calls waited in the scheduler")
+        self._metrics[TRAJECTORY_CACHE] = Counter(TRAJECTORY_CACHE,
+                                                  "Trajectory cache lookups by outcome (hit, miss, fallback)")
+        self._metrics[TOOL_TIMEOUTS] = Counter(TOOL_TIMEOUTS, "Tool calls that exceeded their timeout")
+        self._metrics[STEP_CACHE] = Counter(STEP_CACHE, "Flow step cache lookups by outcome (hit, miss)")
+        self._metrics[SELF_CONSISTENCY] = Counter(SELF_CONSISTENCY,
+                                                  "Self-consistency votes by outcome (agreed, plurality)")
+        self._metrics[SELF_CONSISTENCY_AGREEMENT] = Histogram(SELF_CONSISTENCY_AGREEMENT,
+                                                              "Share of completed samples agreeing with the answer",
+                                                              buckets=(0.2, 0.4, 0.6, 0.8, 1.0))
+
+
+registry = MetricsRegistry()
+
+_current_agent: ContextVar[Optional[str]] = ContextVar("tudi_current_agent", default=None)
+
+
+def current_agent() -> str:
+    return _current_agent.get() or "unknown"
+
+
+@contextmanager
+def track_agent(name: str) -> Iterator[None]:
+    token = _current_agent.set(name)
+    started = time.perf_counter()
+    outcome = "success"
+    usage = UsageTracker()
+    try:
+        with usage_scope(usage):
+            yield
+    except OutputParserException:
+        outcome = "parse_failure"
+        registry.inc(PARSE_FAILURES, agent=name)
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        _current_agent.reset(token)
+        registry.observe(AGENT_LATENCY, time.perf_counter() - started, agent=name)
+        registry.inc(AGENT_RUNS, agent=name, outcome=outcome)
+        registry.inc(MODEL_CALLS, usage.calls, agent=name)
+        registry.inc(PROMPT_TOKENS, usage.prompt_tokens, agent=name)
+        registry.inc(COMPLETION_TOKENS, usage.completion_tokens, agent=name)
+
+
+@contextmanager
+def track_agent_batch(name: str, size: int) -> Iterator[List[Any]]:
+    """批量执行的Agent：调用方把每一项的结果（或异常）放入返回的列表，每一项按各自的结果计入运行次数，
+    延迟是整批的耗时；整批失败时size项都记为error。模型调用和token数按整批累计"""
+    token = _current_agent.set(name)
+    started = time.perf_counter()
+    usage = UsageTracker()
+    results: List[Any] = []
+    outcomes = None
+    try:
+        with usage_scope(usage):
+            yield results
+    except Exception:
+        outcomes = ["error"] * size
+        raise
+    finally:
+        _current_agent.reset(token)
+        if outcomes is None:
+            outcomes = [_outcome(result) for result in results]
+        latency = time.perf_counter() - started
+        for outcome in outcomes:
+            if outcome == "parse_failure":
+                registry.inc(PARSE_FAILURES, agent=name)
+            registry.observe(AGENT_LATENCY, latency, agent=name)
+            registry.inc(AGENT_RUNS, agent=name, outcome=outcome)
+        registry.inc(MODEL_CALLS, usage.calls, agent=name)
+        registry.inc(PROMPT_TOKENS, usage.prompt_tokens, agent=name)
+        registry.inc(COMPLETION_TOKENS, usage.completion_tokens, agent=name)
+
+
+def _outcome(result: Any) -> str:
+    if isinstance(result, OutputParserException):
+        return "parse_failure"
+    return "error" if isinstance(result, Exception) else "success"
+
+
+def record_tool_call(tool: str, latency: float) -> None:
+    agent = current_agent()
+    registry.inc(TOOL_CALLS, agent=agent, tool=tool)
+    registry.observe(TOOL_LATENCY, latency, agent=agent, tool=tool)
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _cumulative(counts: Sequence[int]) -> list:
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
@@ -31,8 +31,28 @@ Final Answer: the final answer to the original input question
 
 Begin! Reminder to always use the exact characters `Final Answer` when responding.'''
 
-TYPED_RESULT_PROMPT = '''Transform the final answer to output format.
+TYPED_RESULT_INSTRUCTIONS = '''Transform the final answer to output format.
 
-{format_instructions}
+{format_instructions}'''
 
-The Final Answer: ```{input}```'''
+TYPED_RESULT_INPUT = '''The Final Answer: ```{input}```'''
+
+TYPED_RESULT_PROMPT = f'''{TYPED_RESULT_INSTRUCTIONS}
+
+{TYPED_RESULT_INPUT}'''
+
+
+FORCE_FINAL_ANSWER_PROMPT = '''I must stop using tools now and answer with what I have observed so far.
+Final Answer:'''
+
+REPLAY_FINAL_ANSWER_PROMPT = '''I now know the final answer
+Final Answer:'''
+
+ROUTER_PROMPT = '''Classify the input into exactly one of the following categories:
+
+{choices}
+
+Answer with the category name only, without any explanation.
+
+Input: {input}
+Category:'''
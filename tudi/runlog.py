@@ -0,0 +1,298 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from tudi import metrics
+from tudi.serialization import to_jsonable
+
+POLICIES = ("drop", "block")
+FORMATS = ("jsonl", "sqlite")
+
+logger = logging.getLogger(__name__)
+
+
+class RunLog:
+    """Flow执行记录：输入、每个步骤的输出、分支选择和耗时。
+
+    记录时只在锁内把事件追加到内存中的缓冲区，
+    后台线程按批取出事件，序列化后写入gzip压缩的JSONL文件或SQLite数据库，文件超过max_bytes后轮转，
+    最多保留backup_count个旧文件。缓冲区满时policy为drop则丢弃新事件，为block则等待后台线程写出。
+    事件中的对象在后台线程中才序列化，记录后不应再修改。
+    """
+
+    def __init__(self,
+                 path: str,
+                 format: str = "jsonl",
+                 capacity: int = 10_000,
+                 policy: str = "drop",
+                 batch_size: int = 256,
+                 flush_interval: float = 0.5,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 backup_count: int = 5):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        if capacity < 1 or batch_size < 1:
+            raise ValueError("capacity and batch_size must be at least 1")
+
+        self.path = path
+        self.format = format
+        self.capacity = capacity
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self.written = 0
+        self._buffer: Deque[dict] = deque()
+        # 保护缓冲区和还没有写出的事件数（包括后台线程正在写的批次）
+        self._lock = threading.Condition()
+        self._pending = 0
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._writer = _SqliteWriter(path) if format == "sqlite" else _JsonlWriter(path)
+        self._thread = threading.Thread(target=self._run, name="tudi-run-log", daemon=True)
+        self._thread.start()
+
+    def start_run(self, flow: str, input_data: Any) -> "RunRecorder":
+        recorder = RunRecorder(self, flow)
+        recorder.emit("run_start", input=input_data)
+        return recorder
+
+    def emit(self, event: dict) -> bool:
+        """追加一个事件，被丢弃时返回False"""
+        with self._lock:
+            if len(self._buffer) >= self.capacity and not self._closed:
+                if self.policy == "drop":
+                    self.dropped += 1
+                    metrics.registry.inc(metrics.RUN_LOG_DROPPED)
+                    return False
+                self._wakeup.set()
+                self._lock.wait_for(lambda: len(self._buffer) < self.capacity or self._closed)
+            if self._closed:
+                return False
+            self._buffer.append(event)
+            self._pending += 1
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待缓冲区中的事件全部写出"""
+        with self._lock:
+            self._wakeup.set()
+            return self._lock.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+        self._wakeup.set()
+        self._thread.join()
+        self._writer.close()
+
+    def __enter__(self) -> "RunLog":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def query(self,
+              flow: Optional[str] = None,
+              agent: Optional[str] = None,
+              run_id: Optional[str] = None,
+              since: Optional[float] = None,
+              until: Optional[float] = None) -> List[dict]:
+        """按Flow、Agent、run_id和时间范围（time.time()的秒数）查询已经写出的事件，按时间排序"""
+        filters = {key: value for key, value in {"flow": flow, "agent": agent, "run_id": run_id}.items()
+                   if value is not None}
+        events = self._writer.read(self.backup_count, filters, since, until)
+        return sorted(events, key=lambda event: event["ts"])
+
+    def runs(self, **filters: Any) -> Dict[str, List[dict]]:
+        """按run_id分组的事件；按agent过滤时返回包含该Agent的完整运行记录"""
+        run_ids = {event["run_id"] for event in self.query(**filters)}
+        grouped: Dict[str, List[dict]] = {run_id: [] for run_id in run_ids}
+        for event in self.query(flow=filters.get("flow")):
+            if event["run_id"] in grouped:
+                grouped[event["run_id"]].append(event)
+        return grouped
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+            with self._lock:
+                if self._closed and not self._buffer:
+                    return
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                batch = [self._buffer.popleft() for _ in range(min(len(self._buffer), self.batch_size))]
+                self._lock.notify_all()
+            if not batch:
+                return
+            try:
+                self._writer.write([_serialize(event) for event in batch])
+                self._writer.rotate(self.max_bytes, self.backup_count)
+                self.written += len(batch)
+            except Exception:
+                logger.exception("Writing %d run log events to %s failed", len(batch), self.path)
+            finally:
+                with self._lock:
+                    self._pending -= len(batch)
+                    self._lock.notify_all()
+
+
+class RunRecorder:
+    """一次Flow运行的记录器，所有事件共享同一个run_id"""
+
+    def __init__(self, log: RunLog, flow: str):
+        self.log = log
+        self.flow = flow
+        self.run_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+
+    def emit(self, kind: str, **fields: Any) -> None:
+        self.log.emit({"ts": time.time(), "run_id": self.run_id, "flow": self.flow, "kind": kind, **fields})
+
+    def step(self, step: str, agent: Optional[str], output: Any, duration: float) -> None:
+        self.emit("step", step=step, agent=agent, output=output, duration=duration)
+
+    def branch(self, step: str, branch: str, agent: Optional[str]) -> None:
+        self.emit("branch", step=step, branch=branch, agent=agent)
+
+    def finish(self, output: Any) -> None:
+        self.emit("run_end", output=output, duration=time.perf_counter() - self.started)
+
+    def fail(self, error: BaseException) -> None:
+        self.emit("run_error", error=f"{type(error).__name__}: {error}",
+                  duration=time.perf_counter() - self.started)
+
+
+def _serialize(event: dict) -> dict:
+    return {key: to_jsonable(value) for key, value in event.items()}
+
+
+class _JsonlWriter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, events: List[dict]) -> None:
+        # 每批写成一个gzip成员，多成员的gzip文件可以直接按顺序读出
+        lines = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(lines)
+
+    def rotate(self, max_bytes: int, backup_count: int) -> None:
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= max_bytes:
+            _shift_files(self.path, backup_count)
+
+    def read(self, backup_count: int, filters: dict, since: Optional[float],
+             until: Optional[float]) -> Iterator[dict]:
+        for path in _existing_files(self.path, backup_count):
+            for event in _read_members(path):
+                if (all(event.get(key) == value for key, value in filters.items())
+                        and (since is None or event["ts"] >= since)
+                        and (until is None or event["ts"] < until)):
+                    yield event
+
+    def close(self) -> None:
+        pass
+
+
+def _read_members(path: str) -> Iterator[dict]:
+    """读出文件中的事件；后台线程可能正在追加最后一个gzip成员，读到不完整的成员时当作文件结束"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                # 不完整成员中解压出的半行不算事件
+                if line.endswith("\n") and line.strip():
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile):
+            return
+
+
+class _SqliteWriter:
+    _COLUMNS = ("ts", "run_id", "flow", "kind", "step", "agent")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def write(self, events: List[dict]) -> None:
+        conn = self._connection()
+        rows = [(*[event.get(column) for column in self._COLUMNS], json.dumps(event, ensure_ascii=False))
+                for event in events]
+        with conn:
+            conn.executemany("INSERT INTO events (ts, run_id, flow, kind, step, agent, data) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def rotate(self, max_bytes: int, backup_count: int) -> None:
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= max_bytes:
+            self.close()
+            _shift_files(self.path, backup_count)
+
+    def read(self, backup_count: int, filters: dict, since: Optional[float],
+             until: Optional[float]) -> Iterator[dict]:
+        conditions = [f"{key} = ?" for key in filters]
+        params = list(filters.values())
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("ts < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        for path in _existing_files(self.path, backup_count):
+            conn = sqlite3.connect(path)
+            try:
+                for (data,) in conn.execute(f"SELECT data FROM events{where} ORDER BY id", params):
+                    yield json.loads(data)
+            finally:
+                conn.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # 只在后台写线程中使用
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "ts REAL, run_id TEXT, flow TEXT, kind TEXT, step TEXT, agent TEXT, data TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS events_flow ON events (flow, ts)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS events_run ON events (run_id)")
+        return self._conn
+
+
+def _shift_files(path: str, backup_count: int) -> None:
+    if backup_count <= 0:
+        os.remove(path)
+        return
+    for index in range(backup_count - 1, 0, -1):
+        source = f"{path}.{index}"
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _existing_files(path: str, backup_count: int) -> List[str]:
+    candidates = [f"{path}.{index}" for index in range(backup_count, 0, -1)] + [path]
+    return [candidate for candidate in candidates if os.path.exists(candidate)]
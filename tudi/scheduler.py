@@ -0,0 +1,267 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from tudi import metrics
+
+PRIORITIES = ("interactive", "batch")
+
+_schedule: ContextVar[Optional[Tuple[str, str]]] = ContextVar("tudi_schedule", default=None)
+
+
+@contextmanager
+def scheduling(priority: str, tenant: str = "default") -> Iterator[None]:
+    """设置当前上下文中模型调用的优先级和租户，例如批量任务使用scheduling("batch", tenant="reports")"""
+    token = _schedule.set((priority, tenant))
+    try:
+        yield
+    finally:
+        _schedule.reset(token)
+
+
+def current_schedule() -> Optional[Tuple[str, str]]:
+    """当前上下文通过scheduling设置的(优先级, 租户)，没有设置时为None"""
+    return _schedule.get()
+
+
+class _Waiter:
+    __slots__ = ("priority", "tenant", "enqueued", "notify", "granted")
+
+    def __init__(self, priority: str, tenant: str, notify: Callable[[], None]):
+        self.priority = priority
+        self.tenant = tenant
+        self.enqueued = time.monotonic()
+        self.notify = notify
+        self.granted = False
+
+
+class ModelScheduler:
+    """共享模型的调用调度：按优先级分类排队，同一类中按租户做加权公平排队。
+
+    最多max_concurrency个调用同时执行。空出槽位时先服务最高优先级类中的调用
+    （已经在执行的低优先级调用不会被中断），同一类中各租户按weights分配调用次数（默认权重为1）。
+    低优先级调用等待超过max_wait秒后不再让位，避免被饿死。
+    没有通过scheduling设置优先级的调用使用default_priority。
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 1,
+                 priorities: Sequence[str] = PRIORITIES,
+                 weights: Optional[Dict[str, float]] = None,
+                 max_wait: Optional[float] = 30.0,
+                 default_priority: Optional[str] = None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if not priorities:
+            raise ValueError("At least one priority must be provided")
+        if any(weight <= 0 for weight in (weights or {}).values()):
+            raise ValueError("weights must be positive")
+        if default_priority is not None and default_priority not in priorities:
+            raise ValueError(f"Unknown priority: {default_priority}")
+
+        self.max_concurrency = max_concurrency
+        self.priorities = tuple(priorities)
+        self.weights = dict(weights or {})
+        self.max_wait = max_wait
+        self.default_priority = default_priority or self.priorities[0]
+        self.running = 0
+        self._lock = threading.Lock()
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {priority: [] for priority in self.priorities}
+        # 每个优先级类的虚拟时间，以及各租户上一个调用的虚拟结束时间
+        self._virtual: Dict[str, float] = dict.fromkeys(self.priorities, 0.0)
+        self._finish: Dict[Tuple[str, str], float] = {}
+        self._sequence = itertools.count()
+
+    def wrap(self, model: BaseChatModel) -> "ScheduledChatModel":
+        return ScheduledChatModel(bound=model, scheduler=self)
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        with self._lock:
+            if priority is not None:
+                return len(self._queues[priority])
+            return sum(len(queue) for queue in self._queues.values())
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, tenant: Optional[str] = None) -> Iterator[None]:
+        """等待并占用一个执行槽位"""
+        granted = threading.Event()
+        waiter = self._enqueue(priority, tenant, granted.set)
+        granted.wait()
+        self._observe_wait(waiter)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: Optional[str] = None, tenant: Optional[str] = None) -> AsyncIterator[None]:
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        waiter = self._enqueue(priority, tenant, lambda: loop.call_soon_threadsafe(_resolve, granted))
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if not self._cancel(waiter):
+                self._release()
+            raise
+        self._observe_wait(waiter)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enqueue(self, priority: Optional[str], tenant: Optional[str], notify: Callable[[], None]) -> _Waiter:
+        current_priority, current_tenant = _schedule.get() or (self.default_priority, "default")
+        priority = priority or current_priority
+        tenant = tenant or current_tenant
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}")
+
+        waiter = _Waiter(priority, tenant, notify)
+        with self._lock:
+            # 虚拟结束时间 = max(类的虚拟时间, 租户上一个调用的结束时间) + 1/权重，按结束时间排队
+            start = max(self._virtual[priority], self._finish.get((priority, tenant), 0.0))
+            finish = start + 1.0 / self.weights.get(tenant, 1.0)
+            self._finish[(priority, tenant)] = finish
+            heapq.heappush(self._queues[priority], (finish, next(self._sequence), waiter))
+            self._dispatch()
+            self._report_depth(priority)
+        return waiter
+
+    def _release(self) -> None:
+        with self._lock:
+            self.running -= 1
+            self._dispatch()
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """取消还在排队的调用；已经得到槽位时返回False"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.priority]
+            queue[:] = [entry for entry in queue if entry[2] is not waiter]
+            heapq.heapify(queue)
+            self._report_depth(waiter.priority)
+            return True
+
+    def _dispatch(self) -> None:
+        while self.running < self.max_concurrency:
+            entry = self._next()
+            if entry is None:
+                return
+            finish, _, waiter = entry
+            self._virtual[waiter.priority] = max(self._virtual[waiter.priority],
+                                                 finish - 1.0 / self.weights.get(waiter.tenant, 1.0))
+            self.running += 1
+            waiter.granted = True
+            waiter.notify()
+            self._report_depth(waiter.priority)
+
+    def _next(self) -> Optional[Tuple[float, int, _Waiter]]:
+        starved = self._starved()
+        if starved is not None:
+            queue = self._queues[starved[2].priority]
+            queue.remove(starved)
+            heapq.heapify(queue)
+            return starved
+
+        for priority in self.priorities:
+            queue = self._queues[priority]
+            if queue:
+                return heapq.heappop(queue)
+        return None
+
+    def _starved(self) -> Optional[Tuple[float, int, _Waiter]]:
+        """等待超过max_wait的低优先级调用中最早的一个"""
+        if self.max_wait is None:
+            return None
+        deadline = time.monotonic() - self.max_wait
+        oldest = None
+        for priority in self.priorities[1:]:
+            for entry in self._queues[priority]:
+                if entry[2].enqueued <= deadline and (oldest is None or entry[2].enqueued < oldest[2].enqueued):
+                    oldest = entry
+        return oldest
+
+    def _report_depth(self, priority: str) -> None:
+        metrics.registry.set(metrics.SCHEDULER_QUEUE_DEPTH, len(self._queues[priority]), priority=priority)
+
+    def _observe_wait(self, waiter: _Waiter) -> None:
+        metrics.registry.observe(metrics.SCHEDULER_WAIT, time.monotonic() - waiter.enqueued,
+                                 priority=waiter.priority)
+
+
+class ScheduledChatModel(BaseChatModel):
+    """每次调用前向调度器申请槽位的模型，流式调用在输出结束前一直占用槽位"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    bound: BaseChatModel
+    scheduler: ModelScheduler
+
+    @property
+    def _llm_type(self) -> str:
+        return "tudi-scheduled"
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.bound, "model_name", None) or getattr(self.bound, "model", None) \
+            or type(self.bound).__name__
+
+    def _generate(self,
+                  messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        with self.scheduler.slot():
+            message = self.bound.invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self,
+                         messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        async with self.scheduler.aslot():
+            message = await self.bound.ainvoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self,
+                messages: List[BaseMessage],
+                stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        with self.scheduler.slot():
+            for message in self.bound.stream(messages, stop=stop, **kwargs):
+                chunk = ChatGenerationChunk(message=message)
+                if run_manager:
+                    run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+                yield chunk
+
+    async def _astream(self,
+                       messages: List[BaseMessage],
+                       stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async with self.scheduler.aslot():
+            async for message in self.bound.astream(messages, stop=stop, **kwargs):
+                chunk = ChatGenerationChunk(message=message)
+                if run_manager:
+                    await run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+                yield chunk
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,57 @@
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.agents import AgentAction
+
+Step = Tuple[AgentAction, str]
+
+
+@dataclass(frozen=True)
+class Scratchpad:
+    """控制ReAct循环中agent_scratchpad的大小。
+
+    - max_observation_chars: 单个Observation的最大字符数，超出部分截断并加上标记
+    - window: 只保留最近window步的完整Thought/Action/Observation，更早的步骤压缩为一行摘要
+    - summarizer: 自定义更早步骤的摘要方式，接收被压缩的步骤，返回摘要文本
+    """
+    max_observation_chars: Optional[int] = 2000
+    window: Optional[int] = None
+    summarizer: Optional[Callable[[List[Step]], str]] = None
+    summary_observation_chars: int = 100
+
+    def __post_init__(self):
+        if self.max_observation_chars is not None and self.max_observation_chars < 1:
+            raise ValueError("max_observation_chars must be at least 1")
+        if self.window is not None and self.window < 1:
+            raise ValueError("window must be at least 1")
+
+    def format(self, intermediate_steps: List[Step]) -> str:
+        older, recent = self._split(intermediate_steps)
+        thoughts = self._summarize(older) if older else ""
+        for action, observation in recent:
+            thoughts += action.log
+            thoughts += f"\nObservation: {self.truncate(str(observation))}\nThought: "
+        return thoughts
+
+    def truncate(self, observation: str, limit: Optional[int] = None) -> str:
+        limit = limit or self.max_observation_chars
+        if limit is None or len(observation) <= limit:
+            return observation
+
+        return f"{observation[:limit]}... [truncated {len(observation) - limit} chars]"
+
+    def _split(self, steps: List[Step]) -> Tuple[List[Step], List[Step]]:
+        if self.window is None or len(steps) <= self.window:
+            return [], steps
+
+        return steps[:-self.window], steps[-self.window:]
+
+    def _summarize(self, steps: List[Step]) -> str:
+        if self.summarizer:
+            return f"{self.summarizer(steps)}\n"
+
+        lines = [f"Earlier steps ({len(steps)}, summarized):"]
+        for action, observation in steps:
+            result = self.truncate(" ".join(str(observation).split()), self.summary_observation_chars)
+            lines.append(f"- {action.tool}({action.tool_input}) -> {result}")
+        return "\n".join(lines) + "\n"
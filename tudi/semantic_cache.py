@@ -0,0 +1,275 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from tudi.serialization import from_jsonable, to_jsonable
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy是可选依赖
+    np = None
+
+Embedding = Callable[[str], Sequence[float]]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    false_hits: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def false_hit_rate(self) -> float:
+        return self.false_hits / self.hits if self.hits else 0.0
+
+
+class VectorIndex:
+    """暴力搜索的余弦相似度索引，向量在加入时归一化。
+
+    向量存放在预先分配、按倍数扩容的数组中，删除时用最后一行填补空位，加入和删除都不需要复制所有向量。
+    """
+
+    def __init__(self, dimension: int, capacity: int = 64):
+        self.dimension = dimension
+        self._ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, entry_id: int, vector: "np.ndarray") -> None:
+        row = len(self._ids)
+        if row == len(self._vectors):
+            grown = np.zeros((max(row * 2, 1), self.dimension), dtype=np.float32)
+            grown[:row] = self._vectors
+            self._vectors = grown
+        self._vectors[row] = vector
+        self._ids.append(entry_id)
+        self._rows[entry_id] = row
+
+    def remove(self, entry_id: int) -> None:
+        row = self._rows.pop(entry_id)
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._vectors[row] = self._vectors[last]
+            self._ids[row] = moved
+            self._rows[moved] = row
+        self._ids.pop()
+
+    def vector(self, entry_id: int) -> "np.ndarray":
+        return self._vectors[self._rows[entry_id]]
+
+    def search(self, vector: "np.ndarray") -> Optional[Tuple[int, float]]:
+        if not self._ids:
+            return None
+        scores = self._vectors[:len(self._ids)] @ vector
+        best = int(np.argmax(scores))
+        return self._ids[best], float(scores[best])
+
+
+class LshIndex(VectorIndex):
+    """随机超平面LSH：先按哈希桶筛选候选，再在候选中精确计算相似度，适合条目较多的场景"""
+
+    def __init__(self, dimension: int, planes: int = 12, tables: int = 4, seed: int = 0):
+        super().__init__(dimension)
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((tables, planes, dimension)).astype(np.float32)
+        self._weights = 1 << np.arange(planes, dtype=np.int64)
+        self._buckets: List[Dict[int, set]] = [{} for _ in range(tables)]
+
+    def add(self, entry_id: int, vector: "np.ndarray") -> None:
+        super().add(entry_id, vector)
+        for table, key in enumerate(self._hash(vector)):
+            self._buckets[table].setdefault(key, set()).add(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        for table, key in enumerate(self._hash(self.vector(entry_id))):
+            bucket = self._buckets[table].get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[table][key]
+        super().remove(entry_id)
+
+    def search(self, vector: "np.ndarray") -> Optional[Tuple[int, float]]:
+        candidates = set()
+        for table, key in enumerate(self._hash(vector)):
+            candidates |= self._buckets[table].get(key, set())
+        if not candidates:
+            return None
+
+        ids = list(candidates)
+        scores = self._vectors[[self._rows[entry_id] for entry_id in ids]] @ vector
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+    def _hash(self, vector: "np.ndarray") -> List[int]:
+        bits = (self._planes @ vector) > 0
+        return (bits @ self._weights).tolist()
+
+
+@dataclass
+class _Entry:
+    scope: str
+    prompt: str
+    vector: "np.ndarray"
+    result: Any
+
+
+class SemanticCache:
+    """按语义相似度命中的结果缓存。
+
+    用可插拔的embedding函数把渲染后的prompt转换为向量，在同一个scope（agent名称+输出类型）内
+    查找最相似的已缓存prompt，相似度不低于threshold时直接返回缓存的结果。
+    条目数超过max_size时按最近最少使用淘汰；设置path后可以save到磁盘并在创建时自动加载。
+    条目数超过ann_threshold时改用LSH索引。
+    """
+
+    def __init__(self,
+                 embedding: Embedding,
+                 threshold: float = 0.92,
+                 max_size: int = 1024,
+                 path: Optional[str] = None,
+                 ann_threshold: Optional[int] = None):
+        if np is None:
+            raise ImportError("SemanticCache requires numpy, install it with `pip install tudi[semantic]`")
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.embedding = embedding
+        self.threshold = threshold
+        self.max_size = max_size
+        self.path = path
+        self.ann_threshold = ann_threshold
+        self.stats = CacheStats()
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._next_id = 0
+        self._served: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, scope: str, prompt: str, output_type: Optional[Type] = None) -> Optional[Any]:
+        vector = self._embed(prompt)
+        with self._lock:
+            index = self._indexes.get(scope)
+            found = index.search(vector) if index else None
+            if not found or found[1] < self.threshold:
+                self.stats.misses += 1
+                return None
+
+            entry_id, _ = found
+            self._entries.move_to_end(entry_id)
+            self.stats.hits += 1
+            self._remember_served(scope, prompt, entry_id)
+            result = self._entries[entry_id].result
+
+        return from_jsonable(result, output_type)
+
+    def store(self, scope: str, prompt: str, result: Any) -> None:
+        vector = self._embed(prompt)
+        with self._lock:
+            self._add(_Entry(scope, prompt, vector, to_jsonable(result)))
+
+    def report_false_hit(self, scope: str, prompt: str) -> None:
+        """标记某次命中是错误的：计入false_hits并移除命中的条目"""
+        with self._lock:
+            entry_id = self._served.pop((scope, prompt), None)
+            if entry_id is None:
+                return
+            self.stats.false_hits += 1
+            if entry_id in self._entries:
+                self._remove(entry_id)
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            raise ValueError("path must be provided to save the cache")
+
+        with self._lock:
+            data = {
+                "version": 1,
+                "entries": [
+                    {"scope": entry.scope, "prompt": entry.prompt,
+                     "vector": entry.vector.tolist(), "result": entry.result}
+                    for entry in self._entries.values()
+                ]
+            }
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> None:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        with self._lock:
+            for item in data.get("entries", []):
+                vector = np.asarray(item["vector"], dtype=np.float32)
+                self._add(_Entry(item["scope"], item["prompt"], vector, item["result"]))
+
+    def _add(self, entry: _Entry) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._index_for(entry.scope, len(entry.vector)).add(entry_id, entry.vector)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._indexes[entry.scope].remove(entry_id)
+
+    def _index_for(self, scope: str, dimension: int) -> VectorIndex:
+        index = self._indexes.get(scope)
+        if index is None:
+            index = VectorIndex(dimension)
+            self._indexes[scope] = index
+
+        if self.ann_threshold and not isinstance(index, LshIndex) and len(index) >= self.ann_threshold:
+            index = self._rebuild_as_lsh(index)
+            self._indexes[scope] = index
+        return index
+
+    def _rebuild_as_lsh(self, index: VectorIndex) -> LshIndex:
+        lsh = LshIndex(index.dimension)
+        for entry_id in list(index._ids):
+            lsh.add(entry_id, self._entries[entry_id].vector)
+        return lsh
+
+    def _remember_served(self, scope: str, prompt: str, entry_id: int) -> None:
+        self._served[(scope, prompt)] = entry_id
+        self._served.move_to_end((scope, prompt))
+        while len(self._served) > self.max_size:
+            self._served.popitem(last=False)
+
+    def _embed(self, prompt: str) -> "np.ndarray":
+        vector = np.asarray(self.embedding(prompt), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def cache_scope(name: str, output_type: Optional[Type]) -> str:
+    type_name = f"{output_type.__module__}.{output_type.__qualname__}" if output_type else "str"
+    return f"{name}:{type_name}"
@@ -0,0 +1,99 @@
+import json
+import sys
+import types
+import typing
+from collections import abc
+from enum import Enum
+from typing import Any, Optional, Type
+
+from pydantic import BaseModel, TypeAdapter
+
+
+def to_jsonable(value: Any, value_type: Optional[Type] = None) -> Any:
+    """把运行结果转换成可以直接json.dumps的数据，优先按声明的类型序列化"""
+    if value_type is not None and isinstance(value, value_type):
+        return TypeAdapter(value_type).dump_python(value, mode="json")
+
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+
+    return str(value)
+
+
+def from_jsonable(data: Any, value_type: Optional[Type] = None) -> Any:
+    """按声明的类型还原数据，没有类型时原样返回"""
+    if value_type is None:
+        return data
+
+    return TypeAdapter(value_type).validate_python(data)
+
+
+def sample_value(annotation: Any) -> Any:
+    """按类型注解生成一个合法的示例值，用于预构建、explain和假模型的回复"""
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if annotation is None or annotation is type(None):
+        return None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {name: sample_value(info.annotation) for name, info in annotation.model_fields.items()}
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return next(iter(annotation)).value
+    if origin is typing.Literal:
+        return args[0]
+    if origin in (typing.Union, types.UnionType):
+        return sample_value(next((arg for arg in args if arg is not type(None)), None))
+    if origin in (list, set, frozenset, tuple, abc.Sequence):
+        return []
+    if origin is dict:
+        return {}
+    if annotation is bool:
+        return False
+    if annotation is int:
+        return 0
+    if annotation is float:
+        return 0.0
+    return "sample"
+
+
+def dumps_typed(value: Any) -> str:
+    """序列化为带类型信息的json，Pydantic模型可以在另一个进程中按原类型还原"""
+    value_type = type(value)
+    type_path = f"{value_type.__module__}:{value_type.__qualname__}" if isinstance(value, BaseModel) else None
+    return json.dumps({"type": type_path, "data": to_jsonable(value)}, ensure_ascii=False)
+
+
+def loads_typed(text: str, value_type: Optional[Type] = None) -> Any:
+    """还原dumps_typed的结果，优先按声明的value_type还原。
+
+    数据可能来自队列或磁盘，记录的类型只在已经导入的模块中查找，并且必须是Pydantic模型；
+    声明了value_type时，记录的类型还必须是它的子类。
+    """
+    envelope = json.loads(text)
+    recorded = _lookup_model(envelope.get("type"))
+    if recorded is not None and (value_type is None or _is_subclass(recorded, value_type)):
+        value_type = recorded
+    return from_jsonable(envelope["data"], value_type)
+
+
+def _lookup_model(path: Optional[str]) -> Optional[Type[BaseModel]]:
+    if not isinstance(path, str) or "<locals>" in path:
+        return None
+
+    module_name, _, qualname = path.partition(":")
+    obj = sys.modules.get(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr, None)
+    return obj if _is_subclass(obj, BaseModel) else None
+
+
+def _is_subclass(obj: Any, base: Any) -> bool:
+    return isinstance(obj, type) and isinstance(base, type) and issubclass(obj, base)
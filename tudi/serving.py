@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Optional, Tuple
+
+from pydantic import ValidationError
+
+from tudi import metrics
+from tudi.base import Task
+from tudi.serialization import from_jsonable, to_jsonable
+
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServerStats:
+    accepted: int = 0
+    rejected: int = 0
+    invalid: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_flight: int = 0
+    total_latency: float = 0.0
+    started_at: float = field(default_factory=time.time)
+
+    def as_dict(self, queued: int) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "invalid": self.invalid,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "queued": queued,
+            "avg_latency": self.total_latency / finished if finished else 0.0,
+            "uptime": time.time() - self.started_at,
+        }
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FlowServer:
+    """基于asyncio的HTTP/JSON服务，在有界队列和有界并发下执行Flow。
+
+    - POST /run: 请求体按Flow的input_type校验，结果按output_type序列化
+    - GET /health: 健康检查
+    - GET /stats: 运行统计
+    - GET /metrics: Prometheus格式的指标（需要先启用tudi.metrics.registry）
+    队列满时直接返回429，不再继续排队。
+    """
+
+    def __init__(self,
+                 flow: Task,
+                 host: str = "127.0.0.1",
+                 port: int = 8000,
+                 max_in_flight: int = 4,
+                 max_queue: int = 64):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if max_queue < 1:
+            raise ValueError("max_queue must be at least 1")
+
+        self.flow = flow
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.stats = ServerStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._admitted = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._workers: list[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="tudi-serve")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_in_flight)]
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def snapshot(self) -> dict:
+        return self.stats.as_dict(self._queue.qsize() if self._queue else 0)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            input_data, future = await self._queue.get()
+            self.stats.in_flight += 1
+            started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor, self.flow.run, input_data)
+                self.stats.completed += 1
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.stats.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.stats.in_flight -= 1
+                self.stats.total_latency += time.perf_counter() - started
+                self._queue.task_done()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, path, body = await self._read_request(reader)
+                status, payload = await self._dispatch(method, path, body)
+                response = self._encode_response(status, payload)
+            except HttpError as e:
+                response = self._encode_response(e.status, {"error": e.message})
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            except Exception as e:
+                logger.exception("Handling request failed")
+                response = self._encode_response(HTTPStatus.INTERNAL_SERVER_ERROR,
+                                                 {"error": f"{type(e).__name__}: {e}"})
+            writer.write(response)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[HTTPStatus, Any]:
+        if path == "/health":
+            self._expect_method(method, "GET")
+            return HTTPStatus.OK, {"status": "ok"}
+
+        if path == "/stats":
+            self._expect_method(method, "GET")
+            return HTTPStatus.OK, self.snapshot()
+
+        if path == "/metrics":
+            self._expect_method(method, "GET")
+            return HTTPStatus.OK, metrics.registry.render_prometheus()
+
+        if path == "/run":
+            self._expect_method(method, "POST")
+            return await self._run(body)
+
+        raise HttpError(HTTPStatus.NOT_FOUND, f"Unknown path: {path}")
+
+    async def _run(self, body: bytes) -> Tuple[HTTPStatus, Any]:
+        input_data = self._parse_input(body)
+
+        # 正在执行的和排队的请求总数达到上限时直接拒绝
+        if self._admitted >= self.max_in_flight + self.max_queue:
+            self.stats.rejected += 1
+            raise HttpError(HTTPStatus.TOO_MANY_REQUESTS, "Server is busy, try again later")
+
+        future = asyncio.get_running_loop().create_future()
+        self._admitted += 1
+        self.stats.accepted += 1
+        self._queue.put_nowait((input_data, future))
+        try:
+            result = await future
+        except Exception as e:
+            raise HttpError(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}") from e
+        finally:
+            self._admitted -= 1
+
+        return HTTPStatus.OK, {"output": to_jsonable(result, self.flow.output_type)}
+
+    def _parse_input(self, body: bytes) -> Any:
+        try:
+            data = json.loads(body or b"null")
+        except json.JSONDecodeError as e:
+            self.stats.invalid += 1
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}") from e
+
+        try:
+            return from_jsonable(data, self.flow.input_type)
+        except ValidationError as e:
+            self.stats.invalid += 1
+            raise HttpError(HTTPStatus.UNPROCESSABLE_ENTITY, str(e)) from e
+
+    def _expect_method(self, method: str, expected: str) -> None:
+        if method != expected:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed, use {expected}")
+
+    async def _read_line(self, reader: asyncio.StreamReader) -> bytes:
+        try:
+            return await reader.readline()
+        except ValueError:
+            # 超过StreamReader的limit的行
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Request line or header is too long") from None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+        request_line = (await self._read_line(reader)).decode("latin-1").strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        method, target, _ = parts
+
+        headers = {}
+        while True:
+            line = (await self._read_line(reader)).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length") from None
+        if length > MAX_BODY_SIZE:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body is too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], body
+
+    def _encode_response(self, status: HTTPStatus, payload: Any) -> bytes:
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+        headers = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        if status == HTTPStatus.TOO_MANY_REQUESTS:
+            headers.append("Retry-After: 1")
+        return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+def serve(flow: Task, host: str = "127.0.0.1", port: int = 8000,
+          max_in_flight: int = 4, max_queue: int = 64) -> None:
+    server = FlowServer(flow, host=host, port=port, max_in_flight=max_in_flight, max_queue=max_queue)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pydantic import BaseModel
+
+from tudi import metrics
+from tudi.serialization import to_jsonable
+
+
+def input_key(value: Any) -> str:
+    """输入的规范化哈希：字段相同的模型得到相同的key，与dict中键的顺序无关"""
+    data = json.dumps(to_jsonable(value), sort_keys=True, ensure_ascii=False, default=str)
+    type_name = f"{type(value).__module__}.{type(value).__qualname__}" if isinstance(value, BaseModel) else ""
+    return hashlib.sha256(f"{type_name}:{data}".encode()).hexdigest()
+
+
+@dataclass
+class _AsyncCall:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlight:
+    """合并并发的相同调用：同一个key同时只执行一次，其他调用等待并得到同一个结果或异常。
+
+    线程中的调用使用do，协程中的调用使用ado；两者互不合并。
+    executed是实际执行的次数，collapsed是被合并掉的调用次数。
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.executed = 0
+        self.collapsed = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._async_calls: Dict[Tuple[int, str], _AsyncCall] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            self._count(leader)
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """共享的调用在单独的任务中执行：某个调用方被取消时只有它自己收到CancelledError，
+        所有调用方都被取消后才取消共享的调用"""
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        with self._lock:
+            call = self._async_calls.get(loop_key)
+            leader = call is None
+            if leader:
+                call = self._async_calls[loop_key] = _AsyncCall(loop.create_task(self._arun(loop_key, fn)))
+            call.waiters += 1
+            self._count(leader)
+
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.task.cancelled():
+                raise
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0
+                if abandoned and self._async_calls.get(loop_key) is call:
+                    # 之后的相同调用重新执行，不会加入已经被取消的调用
+                    del self._async_calls[loop_key]
+            if abandoned:
+                call.task.cancel()
+            raise
+
+    async def _arun(self, loop_key: Tuple[int, str], fn: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await fn()
+        finally:
+            with self._lock:
+                call = self._async_calls.get(loop_key)
+                if call is not None and call.task is asyncio.current_task():
+                    del self._async_calls[loop_key]
+
+    def _count(self, leader: bool) -> None:
+        if leader:
+            self.executed += 1
+        else:
+            self.collapsed += 1
+            metrics.registry.inc(metrics.SINGLE_FLIGHT_COLLAPSED, target=self.name)
@@ -1,10 +1,13 @@
-from tudi.statements.case import CaseStatement
+from tudi.statements.case import CaseStatement, columns
 from tudi.statements.map import MapStatement
 from tudi.statements.next import NextStatement
+from tudi.statements.route import RouteStatement
 
 __all__ = [
     'NextStatement',
     'CaseStatement',
     'MapStatement',
+    'RouteStatement',
+    'columns',
 ]
 
@@ -1,18 +1,20 @@
-from typing import Any, Callable, Optional, Type, TypeVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, TypeVar
 
 from pydantic import BaseModel
 
+from tudi import metrics
 from tudi.agent import Agent
 from tudi.base import Runnable, Statement
 
 T = TypeVar('T')
 
 class When:
-    def __init__(self, predicate: Callable[[Any], bool], default: bool = False):
+    def __init__(self, predicate: Callable[[Any], Any], default: bool = False, vectorized: bool = False):
         self._predicate = predicate
         self._agent: Optional[Agent] = None
         self._output_mapper: Optional[Callable[[Any], Any]] = None
         self._default = default
+        self.vectorized = vectorized
 
     def then(self, agent: Agent) -> 'When':
         self._agent = agent
@@ -23,8 +25,22 @@ class When:
         return self
 
     def test(self, input_data: Any) -> bool:
+        if self.vectorized:
+            return self.test_batch([input_data])[0]
         return self._predicate(input_data)
 
+    def test_batch(self, inputs: List[Any]) -> List[bool]:
+        """对一批输入求值；向量化的条件只调用一次，参数是这批输入的列（见columns）"""
+        if not self.vectorized:
+            return [bool(self._predicate(input_data)) for input_data in inputs]
+        if not inputs:
+            return []
+
+        mask = [bool(value) for value in self._predicate(columns(inputs))]
+        if len(mask) != len(inputs):
+            raise ValueError(f"Vectorized predicate returned {len(mask)} values for {len(inputs)} inputs")
+        return mask
+
     def run(self, input_data: Any) -> Any:
         if not self._agent:
             return None
@@ -34,6 +50,15 @@ class When:
             return self._output_mapper(result)
         return result
 
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        if not self._agent:
+            return [None] * len(inputs)
+
+        results = self._agent.run_batch(inputs, return_exceptions)
+        if self._output_mapper:
+            return [result if isinstance(result, Exception) else self._output_mapper(result) for result in results]
+        return results
+
     @property
     def input_type(self) -> Type[T]:
         return self._agent.input_type if self._agent else None
@@ -58,8 +83,22 @@ class When:
     def is_default(self) -> bool:
         return self._default
 
-def when(predicate: Callable[[Any], bool]) -> When:
-    return When(predicate)
+    @property
+    def agent(self) -> Optional[Agent]:
+        return self._agent
+
+def when(predicate: Callable[[Any], Any], vectorized: bool = False) -> When:
+    """vectorized为True时，predicate接收一批输入的列，返回与输入等长的布尔序列，
+    例如when(lambda cols: [degree > 30 for degree in cols["degree"]], vectorized=True)
+    """
+    return When(predicate, vectorized=vectorized)
+
+
+def columns(inputs: List[Any]) -> Any:
+    """把一批Pydantic模型转换为按字段组织的列：{"city": [...], "degree": [...]}；其他输入原样返回列表"""
+    if inputs and all(isinstance(input_data, BaseModel) for input_data in inputs):
+        return {name: [getattr(input_data, name) for input_data in inputs] for name in type(inputs[0]).model_fields}
+    return list(inputs)
 
 def default(agent: Agent) -> When:
     return When(lambda _: True, True).then(agent)
@@ -68,9 +107,21 @@ InputT = TypeVar('InputT', bound=BaseModel)
 OutputT = TypeVar('OutputT', bound=BaseModel)
 
 class CaseStatement(Statement):
+    """按条件选择分支执行。
+
+    声明depends_on（条件依赖的上游输出字段）后，Flow会让上游Agent流式输出，
+    这些字段生成完毕时就提前选择分支，并在后台预填充所选分支的prompt前缀，上游生成剩余字段的同时分支模型已经在计算前缀。
+    分支仍然在上游完成后按完整结果执行（条件会再求值一次，以完整结果为准）。
+    warmup默认在声明了depends_on时开启，传入False关闭预填充。
+    """
+
     def __init__(self, conditions: list[When],
-                 output_type: Optional[Type[OutputT]] = None):
+                 output_type: Optional[Type[OutputT]] = None,
+                 depends_on: Optional[Sequence[str]] = None,
+                 warmup: Optional[bool] = None):
         super().__init__()
+        self.depends_on = tuple(depends_on or ())
+        self.warmup = bool(self.depends_on) if warmup is None else warmup
         _default, non_default = self._split_conditions(conditions)
         self.conditions = non_default
         self.default = _default
@@ -87,22 +138,56 @@ class CaseStatement(Statement):
             return self._output_type
 
     def run(self, input_data: Any) -> Any:
+        return self.run_selected(input_data, *self._select(input_data))
+
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        """对整批输入求值条件，按选中的分支分组，每个分支的Agent对整组输入做一次批量调用"""
+        return run_partitioned(inputs, self._select_batch(inputs), self._output_type, return_exceptions)
+
+    def run_selected(self, input_data: Any, condition: Optional[When], branch: str) -> Any:
+        """执行已经选好的分支"""
         result = None
-        
-        for condition in self.conditions:
-            if condition.test(input_data):
-                result = condition.run(input_data)
-                break
-        else:
-            if self.default:
-                result = self.default.run(input_data)
-                
+        if metrics.registry.enabled:
+            metrics.registry.inc(metrics.CASE_BRANCHES, branch=branch)
+        if condition:
+            result = condition.run(input_data)
+
         if result is not None and self._output_type:
             if not isinstance(result, self._output_type):
                 raise TypeError(f"Expected return type {self._output_type.__name__}, got {type(result).__name__}")
                 
         return result
 
+    def _select(self, input_data: Any) -> tuple[Optional[When], str]:
+        """选择要执行的分支，同时返回分支的标签：when[i]:agent、default:agent或no_match"""
+        for index, condition in enumerate(self.conditions):
+            if condition.test(input_data):
+                return condition, f"when[{index}]:{_agent_name(condition)}"
+
+        if self.default:
+            return self.default, f"default:{_agent_name(self.default)}"
+
+        return None, "no_match"
+
+    def _select_batch(self, inputs: List[Any]) -> List[Tuple[Optional[When], str]]:
+        # 与_select相同的顺序语义：每个条件只对前面的条件都没有选中的输入求值
+        selections: List[Tuple[Optional[When], str]] = [(None, "no_match")] * len(inputs)
+        remaining = list(range(len(inputs)))
+        for index, condition in enumerate(self.conditions):
+            if not remaining:
+                break
+            mask = condition.test_batch([inputs[i] for i in remaining])
+            branch = f"when[{index}]:{_agent_name(condition)}"
+            for position, selected in zip(remaining, mask, strict=True):
+                if selected:
+                    selections[position] = (condition, branch)
+            remaining = [position for position, selected in zip(remaining, mask, strict=True) if not selected]
+
+        if self.default:
+            for position in remaining:
+                selections[position] = (self.default, f"default:{_agent_name(self.default)}")
+        return selections
+
     def _as_output_type(self, output_type):
         if output_type:
             return output_type
@@ -116,4 +201,38 @@ class CaseStatement(Statement):
         if len(default_conditions) > 1:
             raise ValueError("Multiple default conditions found!")
 
-        return default_conditions[0] if default_conditions else None, non_default_conditions
\ No newline at end of file
+        return default_conditions[0] if default_conditions else None, non_default_conditions
+
+
+def run_partitioned(inputs: List[Any],
+                    selections: List[Tuple[Optional[When], str]],
+                    output_type: Optional[Type],
+                    return_exceptions: bool) -> List[Any]:
+    """按分支把输入分组后批量执行，结果按原来的顺序返回；没有选中分支的输入结果为None。
+
+    return_exceptions为True时，分支失败或返回类型不符的输入结果是对应的异常。
+    """
+    partitions: Dict[str, Tuple[Optional[When], List[int]]] = {}
+    for index, (condition, branch) in enumerate(selections):
+        partitions.setdefault(branch, (condition, []))[1].append(index)
+
+    results: List[Any] = [None] * len(inputs)
+    for branch, (condition, indices) in partitions.items():
+        if metrics.registry.enabled:
+            metrics.registry.inc(metrics.CASE_BRANCHES, len(indices), branch=branch)
+        if condition is None:
+            continue
+
+        outputs = condition.run_batch([inputs[index] for index in indices], return_exceptions)
+        for index, output in zip(indices, outputs, strict=True):
+            if output is not None and not isinstance(output, Exception) and output_type \
+                    and not isinstance(output, output_type):
+                output = TypeError(f"Expected return type {output_type.__name__}, got {type(output).__name__}")
+                if not return_exceptions:
+                    raise output
+            results[index] = output
+    return results
+
+
+def _agent_name(condition: When) -> str:
+    return condition.agent.name if condition.agent else "none"
@@ -1,4 +1,4 @@
-from typing import Any, Type, TypeVar
+from typing import Any, List, Type, TypeVar
 
 from pydantic import BaseModel
 
@@ -21,4 +21,7 @@ class NextStatement(Statement):
         return self.runnable.output_type
 
     def run(self, input_data: Any) -> Any:
-        return self.runnable.run(input_data)
\ No newline at end of file
+        return self.runnable.run(input_data)
+
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        return self.runnable.run_batch(inputs, return_exceptions)
@@ -0,0 +1,195 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Literal, Optional, Type, TypeVar, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, create_model
+
+from tudi import metrics
+from tudi.base import Statement
+from tudi.output_parsers import ThinkTagRemoverOutputParser
+from tudi.statements.case import When, run_partitioned
+from tudi.usage import tracked
+
+InputT = TypeVar('InputT', bound=BaseModel)
+OutputT = TypeVar('OutputT', bound=BaseModel)
+
+
+class Route(When):
+    """由模型选择的分支：label是模型需要输出的类别名，description帮助模型理解该类别"""
+
+    def __init__(self, label: str, description: str = ""):
+        super().__init__(lambda _: False)
+        self.label = label
+        self.description = description
+
+
+def route(label: str, description: str = "") -> Route:
+    return Route(label, description)
+
+
+class RouteStatement(Statement):
+    def __init__(self,
+                 model: BaseChatModel,
+                 routes: List[When],
+                 output_type: Optional[Type[OutputT]] = None,
+                 prompt_template: Optional[str] = None,
+                 constrained: bool = False,
+                 cache_size: int = 256):
+        super().__init__()
+        self.routes = {r.label: r for r in routes if isinstance(r, Route)}
+        defaults = [r for r in routes if r.is_default()]
+        if len(defaults) > 1:
+            raise ValueError("Multiple default conditions found!")
+        if len(self.routes) + len(defaults) != len(routes):
+            raise ValueError("route statement only accepts route(...) and default(...) branches")
+        if not self.routes:
+            raise ValueError("At least one route must be provided")
+
+        self.default = defaults[0] if defaults else None
+        self.model = model
+        self.constrained = constrained
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, Optional[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._input_type = routes[0].input_type
+        self._output_type = output_type or next(iter(self.routes.values())).output_type
+        self._prompt = self._init_prompt(prompt_template)
+        self._chain = self._init_chain(model, constrained)
+
+    @property
+    def input_type(self) -> Type[InputT]:
+        return self._input_type
+
+    @property
+    def output_type(self) -> Type[OutputT]:
+        return self._output_type
+
+    def run(self, input_data: Any) -> Any:
+        return self.run_selected(input_data, *self._select(input_data))
+
+    def run_batch(self, inputs: List[Any], return_exceptions: bool = False) -> List[Any]:
+        """一次批量调用对整批输入分类，再按选中的分支分组批量执行；
+        return_exceptions为True时分类失败的输入结果是对应的异常"""
+        labels = self.classify_batch(inputs)
+        errors = {index: label for index, label in enumerate(labels) if isinstance(label, Exception)}
+        if errors and not return_exceptions:
+            raise next(iter(errors.values()))
+
+        classified = [index for index in range(len(inputs)) if index not in errors]
+        outputs = run_partitioned([inputs[index] for index in classified],
+                                  [self._target(labels[index]) for index in classified],
+                                  self._output_type, return_exceptions)
+        results: List[Any] = [errors.get(index) for index in range(len(inputs))]
+        for index, output in zip(classified, outputs, strict=True):
+            results[index] = output
+        return results
+
+    def run_selected(self, input_data: Any, target: Optional[When], branch: str) -> Any:
+        """执行已经选好的分支"""
+        if metrics.registry.enabled:
+            metrics.registry.inc(metrics.CASE_BRANCHES, branch=branch)
+
+        if target is None:
+            return None
+
+        result = target.run(input_data)
+        if result is not None and self._output_type and not isinstance(result, self._output_type):
+            raise TypeError(f"Expected return type {self._output_type.__name__}, got {type(result).__name__}")
+        return result
+
+    def _select(self, input_data: Any) -> tuple[Optional[When], str]:
+        """分类并选择分支，同时返回分支的标签：route:label、default或no_match"""
+        return self._target(self.classify(input_data))
+
+    def _target(self, label: Optional[str]) -> tuple[Optional[When], str]:
+        if label in self.routes:
+            return self.routes[label], f"route:{label}"
+        if self.default:
+            return self.default, "default"
+        return None, "no_match"
+
+    def replace_model(self, model: BaseChatModel) -> None:
+        self.model = model
+        self._chain = self._init_chain(model, self.constrained)
+        with self._lock:
+            self._cache.clear()
+
+    def classify(self, input_data: Any) -> Optional[str]:
+        """调用一次模型选择分支，返回匹配的label；无法识别时返回None"""
+        text = self._render_input(input_data)
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+
+        label = self._match_label(self._chain.invoke({"input": text}))
+        self._remember(text, label)
+        return label
+
+    def classify_batch(self, inputs: List[Any]) -> List[Union[str, None, Exception]]:
+        """对一批输入分类，相同的输入和已经缓存的输入不再调用模型；分类失败的输入结果是对应的异常"""
+        texts = [self._render_input(input_data) for input_data in inputs]
+        labels = {}
+        with self._lock:
+            for text in texts:
+                if text in self._cache:
+                    self._cache.move_to_end(text)
+                    labels[text] = self._cache[text]
+
+        missing = [text for text in dict.fromkeys(texts) if text not in labels]
+        if missing:
+            outputs = self._chain.batch([{"input": text} for text in missing], return_exceptions=True)
+            for text, output in zip(missing, outputs, strict=True):
+                if isinstance(output, Exception):
+                    labels[text] = output
+                    continue
+                labels[text] = self._match_label(output)
+                self._remember(text, labels[text])
+        return [labels[text] for text in texts]
+
+    def _remember(self, text: str, label: Optional[str]) -> None:
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[text] = label
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def _init_prompt(self, prompt_template: Optional[str]) -> PromptTemplate:
+        from tudi.prompts import ROUTER_PROMPT
+        choices = "\n".join(f"- {label}: {r.description}" if r.description else f"- {label}"
+                            for label, r in self.routes.items())
+        return PromptTemplate.from_template(prompt_template or ROUTER_PROMPT).partial(choices=choices)
+
+    def _init_chain(self, model: BaseChatModel, constrained: bool):
+        if not constrained:
+            parser = ThinkTagRemoverOutputParser(parser=StrOutputParser())
+            return self._prompt | tracked(model) | parser
+
+        # 用枚举schema限制模型只能输出其中一个label
+        labels = tuple(self.routes)
+        schema = create_model("RouteChoice", label=(Literal[labels], ...))
+        return self._prompt | model.with_structured_output(schema) | (lambda choice: choice.label)
+
+    def _match_label(self, output: str) -> Optional[str]:
+        normalized = _normalize(output)
+        lookup = {_normalize(label): label for label in self.routes}
+        if normalized in lookup:
+            return lookup[normalized]
+
+        for key, label in lookup.items():
+            if re.search(rf"\b{re.escape(key)}\b", normalized):
+                return label
+        return None
+
+    def _render_input(self, input_data: Any) -> str:
+        if isinstance(input_data, BaseModel):
+            return input_data.model_dump_json()
+        return str(input_data)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[\s\"'`.。:：]+", " ", str(text)).strip().lower()
@@ -0,0 +1,241 @@
+import dataclasses
+import hashlib
+import inspect
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from tudi import metrics
+from tudi.serialization import dumps_typed, loads_typed
+
+# 描述对象定义时递归的最大深度，更深的部分只记录类型名
+MAX_DEPTH = 8
+
+# 模型和工具中与结果无关的字段
+_IGNORED_FIELDS = frozenset({"callbacks", "callback_manager", "verbose", "cache", "tags", "metadata",
+                             "rate_limiter", "custom_get_token_ids"})
+
+
+@dataclass
+class StepCacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class StepCache:
+    """按内容寻址的步骤结果缓存，用于反复修改Flow后面的步骤时跳过没有变化的前面的步骤。
+
+    键由步骤定义的指纹（prompt模板、模型参数、输入输出类型、工具、mapper和条件函数的源码）和步骤输入的哈希组成：
+    步骤的定义和输入都没有变化时直接返回上次的结果；上游步骤的输出变化后，下游步骤的输入随之变化，会重新执行。
+    path为None时保存在内存中，否则保存在SQLite文件中，可以跨进程复用。
+    结果按dumps_typed序列化，无法按原类型还原的结果（例如tuple、set、自定义对象）不缓存，每次都重新执行；
+    闭包变量和被调用函数的变化不会被检测到。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memory: Dict[str, str] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats: Dict[str, StepCacheStats] = {}
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS steps "
+                                   "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+
+    def key(self, fingerprint: str, input_data: Any) -> str:
+        return _digest([fingerprint, dumps_typed(input_data)])
+
+    def get(self, scope: str, key: str, value_type: Optional[Type] = None) -> Tuple[bool, Any]:
+        """返回(是否命中, 结果)；结果可能是None，所以单独返回是否命中"""
+        with self._lock:
+            if self._conn is None:
+                text = self._memory.get(key)
+            else:
+                row = self._conn.execute("SELECT value FROM steps WHERE key = ?", (key,)).fetchone()
+                text = row[0] if row else None
+            self._count(scope, text is not None)
+        if text is None:
+            return False, None
+        return True, loads_typed(text, value_type)
+
+    def put(self, key: str, value: Any, value_type: Optional[Type] = None) -> bool:
+        """保存结果并返回True；按value_type还原后类型或值不同的结果不保存，返回False"""
+        text = dumps_typed(value)
+        if not _round_trips(value, text, value_type):
+            return False
+        with self._lock:
+            if self._conn is None:
+                self._memory[key] = text
+                return True
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO steps (key, value, created) VALUES (?, ?, ?)",
+                                   (key, text, time.time()))
+        return True
+
+    def stats(self, scope: Optional[str] = None) -> StepCacheStats:
+        with self._lock:
+            if scope is not None:
+                return dataclasses.replace(self._stats.get(scope, StepCacheStats()))
+            return StepCacheStats(sum(stats.hits for stats in self._stats.values()),
+                                  sum(stats.misses for stats in self._stats.values()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM steps")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._conn is None:
+                return len(self._memory)
+            return self._conn.execute("SELECT COUNT(*) FROM steps").fetchone()[0]
+
+    def _count(self, scope: str, hit: bool) -> None:
+        stats = self._stats.setdefault(scope, StepCacheStats())
+        if hit:
+            stats.hits += 1
+        else:
+            stats.misses += 1
+        flow, _, step = scope.partition("/")
+        metrics.registry.inc(metrics.STEP_CACHE, flow=flow, step=step, outcome="hit" if hit else "miss")
+
+
+def _round_trips(value: Any, text: str, value_type: Optional[Type]) -> bool:
+    try:
+        restored = loads_typed(text, value_type)
+    except Exception:
+        return False
+    return type(restored) is type(value) and restored == value
+
+
+def fingerprint(runnable: Any) -> str:
+    """步骤定义的指纹，定义中任何影响结果的部分变化时指纹随之变化"""
+    return _digest(describe(runnable))
+
+
+def describe(runnable: Any) -> Any:
+    from tudi.agent import Agent
+    from tudi.flow import Flow
+    from tudi.statements import CaseStatement, MapStatement, NextStatement, RouteStatement
+    from tudi.statements.case import When
+    from tudi.statements.route import Route
+
+    if isinstance(runnable, NextStatement):
+        return describe(runnable.runnable)
+    if isinstance(runnable, Flow):
+        return {"flow": [describe(task) for task in runnable._tasks]}
+    if isinstance(runnable, Agent):
+        return {
+            "agent": runnable.name,
+            "prompt": _describe(runnable._prompt_template),
+            "max_field_chars": runnable._template_inputs.max_field_chars,
+            "input_type": _describe(runnable.input_type),
+            "output_type": _describe(runnable.output_type),
+            "model": _describe(runnable.model),
+            "tools": _describe(runnable.tools),
+            "options": _describe({
+                "budget": runnable.budget,
+                "scratchpad": runnable.scratchpad,
+                "thinking_budget": runnable.thinking_budget,
+                "cascade": runnable.cascade,
+                "self_consistency": runnable.self_consistency,
+            }),
+        }
+    if isinstance(runnable, When):
+        return {
+            "predicate": None if isinstance(runnable, Route) else _describe(runnable._predicate),
+            "label": getattr(runnable, "label", None),
+            "description": getattr(runnable, "description", None),
+            "default": runnable.is_default(),
+            "vectorized": runnable.vectorized,
+            "then": describe(runnable.agent) if runnable.agent is not None else None,
+            "to_output": _describe(runnable._output_mapper),
+        }
+    if isinstance(runnable, CaseStatement):
+        return {
+            "case": [describe(condition) for condition in [*runnable.conditions, runnable.default]
+                     if condition is not None],
+            "output_type": _describe(runnable.output_type),
+        }
+    if isinstance(runnable, RouteStatement):
+        return {
+            "route": [describe(condition) for condition in [*runnable.routes.values(), runnable.default]
+                      if condition is not None],
+            "model": _describe(runnable.model),
+            "prompt": _describe(runnable._prompt),
+            "constrained": runnable.constrained,
+            "output_type": _describe(runnable.output_type),
+        }
+    if isinstance(runnable, MapStatement):
+        return {"map": _describe(runnable._mapper), "output_type": _describe(runnable.output_type)}
+    return _describe(runnable)
+
+
+def _describe(value: Any, depth: int = 0) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if depth > MAX_DEPTH:
+        return _qualname(type(value))
+    if isinstance(value, type):
+        if issubclass(value, BaseModel):
+            try:
+                return {"type": _qualname(value), "schema": value.model_json_schema()}
+            except Exception:
+                return _qualname(value)
+        return _qualname(value)
+    if isinstance(value, dict):
+        return {str(key): _describe(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_describe(item, depth + 1) for item in value]
+        return sorted(items, key=json.dumps) if isinstance(value, (set, frozenset)) else items
+    if isinstance(value, BaseModel):
+        fields = {name: _describe(getattr(value, name, None), depth + 1)
+                  for name in type(value).model_fields if name not in _IGNORED_FIELDS}
+        return {"type": _qualname(type(value)), **fields}
+    if dataclasses.is_dataclass(value):
+        return {"type": _qualname(type(value)),
+                **{f.name: _describe(getattr(value, f.name), depth + 1) for f in dataclasses.fields(value)}}
+    if inspect.isfunction(value) or inspect.ismethod(value):
+        return _source(value)
+    if callable(value) and not hasattr(value, "__dict__"):
+        return _qualname(value) if hasattr(value, "__qualname__") else repr(value)
+    # 其他对象按公开的属性描述，私有属性通常是锁和运行时状态
+    attributes = {name: _describe(item, depth + 1) for name, item in vars(value).items()
+                  if not name.startswith("_")} if hasattr(value, "__dict__") else {}
+    return {"type": _qualname(type(value)), **attributes}
+
+
+def _source(function: Any) -> str:
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return _qualname(function)
+
+
+def _qualname(value: Any) -> str:
+    return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+
+
+def _digest(value: Any) -> str:
+    text = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,169 @@
+from dataclasses import dataclass, field
+from typing import Any, Optional, Tuple, Type
+
+from langchain_core.utils.json import parse_partial_json
+from pydantic import BaseModel
+
+
+@dataclass(frozen=True)
+class PartialOutput:
+    """流式输出中的一个快照。
+
+    value是目前为止得到的结果：有output_type时是只填充了已出现字段的模型（未经校验），
+    final为True时是经过完整校验的实例；没有output_type时是目前为止的文本。
+    completed是已经生成完毕的字段名，按出现顺序排列，最后一个字段可能还在生成中。
+    """
+    value: Any
+    completed: Tuple[str, ...] = ()
+    final: bool = False
+    data: dict = field(default_factory=dict)
+
+
+class IncrementalJsonParser:
+    """在token流上增量解析JSON对象，跳过<think>中的内容。
+
+    每段文本只扫描一次；只有在可能有值生成完毕时（字符串结束、括号闭合、逗号）才重新解析，
+    整个流的开销与文本长度成正比，而不是每段都重新解析全部文本。
+    """
+
+    def __init__(self, output_type: Optional[Type[BaseModel]] = None):
+        self.output_type = output_type
+        self.text = ""
+        self._thinking = _ThinkingFilter()
+        self._json = ""
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._commas = 0
+        self._closed = False
+        self._last: Optional[PartialOutput] = None
+
+    def feed(self, chunk: str) -> Optional[PartialOutput]:
+        """追加一段文本，结果有变化时返回新的快照"""
+        self.text += chunk
+        visible = self._thinking.feed(chunk)
+        if not self._json:
+            start = visible.find("{")
+            if start < 0:
+                return None
+            visible = visible[start:]
+        if not visible:
+            return None
+        self._json += visible
+        if not self._scan(visible):
+            return None
+
+        data = parse_partial_json(self._json)
+        if not isinstance(data, dict):
+            return None
+        keys = tuple(data)
+        completed = keys if self._closed else keys[:self._commas]
+        if self._last is not None and self._last.data == data and self._last.completed == completed:
+            return None
+
+        self._last = PartialOutput(self._partial_value(data), completed, False, data)
+        return self._last
+
+    def _partial_value(self, data: dict) -> Any:
+        if self.output_type is None:
+            return data
+        known = {key: value for key, value in data.items() if key in self.output_type.model_fields}
+        return self.output_type.model_construct(**known)
+
+    def _scan(self, text: str) -> bool:
+        """扫描新增的文本，返回其中是否可能有值生成完毕。
+
+        只统计顶层的逗号和右括号：每出现一个顶层逗号，就有一个字段生成完毕
+        """
+        changed = False
+        for char in text:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    changed = True
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                # 对象开始时输出一个空的快照
+                changed = changed or self._depth == 0
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                changed = True
+                if self._depth == 0:
+                    self._closed = True
+            elif char == ",":
+                changed = True
+                if self._depth == 1:
+                    self._commas += 1
+        return changed
+
+
+class _ThinkingFilter:
+    """增量地去掉<think>块以及还没有结束的<think>之后的内容，返回每段新增的可见文本。
+
+    结尾可能是标签开头的部分（例如"<thi"）留到下一段再判断。
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._thinking = False
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        visible = []
+        while True:
+            tag = "</think>" if self._thinking else "<think>"
+            found = text.find(tag)
+            if found < 0:
+                break
+            if not self._thinking:
+                visible.append(text[:found])
+            text = text[found + len(tag):]
+            self._thinking = not self._thinking
+
+        keep = _partial_tag(text, tag)
+        if not self._thinking:
+            visible.append(text[:len(text) - keep])
+        self._pending = text[len(text) - keep:]
+        return "".join(visible)
+
+
+class TextStream:
+    """没有output_type时的流式输出：快照是去掉思考内容后的文本"""
+
+    def __init__(self):
+        self.text = ""
+        self._thinking = _ThinkingFilter()
+        self._visible = ""
+
+    def feed(self, chunk: str) -> Optional[PartialOutput]:
+        self.text += chunk
+        visible = self._thinking.feed(chunk)
+        # 开头的空白不输出
+        self._visible = self._visible + visible if self._visible else visible.lstrip()
+        if not visible or not self._visible:
+            return None
+        return PartialOutput(self._visible)
+
+
+def output_stream(output_type: Optional[Type[BaseModel]]):
+    return IncrementalJsonParser(output_type) if output_type else TextStream()
+
+
+def final_output(result: Any) -> PartialOutput:
+    if isinstance(result, BaseModel):
+        return PartialOutput(result, tuple(type(result).model_fields), True, result.model_dump())
+    return PartialOutput(result, (), True)
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """text结尾与tag开头重合的长度"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
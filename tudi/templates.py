@@ -0,0 +1,113 @@
+import re
+import string
+from types import SimpleNamespace
+from typing import Any, Dict, Optional, Union
+
+from pydantic import BaseModel
+
+# include树：True表示需要整个值，dict表示只需要其中的部分键
+IncludeTree = Dict[Any, Union[bool, "IncludeTree"]]
+
+_ACCESSOR = re.compile(r"\.([^.\[]+)|\[([^\]]+)\]")
+
+
+class TemplateInputs:
+    """分析prompt_template中引用的arg.*字段，运行时只导出这些字段。
+
+    输入模型通常带有很大的嵌套数据（文档、历史记录），而模板只用到其中少数字段；
+    只导出被引用的字段可以避免每次调用都深拷贝整个模型。渲染结果与完整导出一致。
+    max_field_chars按顶层字段名限制长度：直接渲染的字段按渲染后的字符串截断，
+    通过[key]引用的字段截断其中过长的字符串。
+    """
+
+    def __init__(self, template: Optional[str], max_field_chars: Optional[Dict[str, int]] = None):
+        self.max_field_chars = max_field_chars or {}
+        self.include = analyze(template) if template else None
+
+    def extract(self, input_data: BaseModel) -> SimpleNamespace:
+        values = input_data.model_dump(include=self.include)
+        for name, limit in self.max_field_chars.items():
+            if name in values:
+                values[name] = _truncate(values[name], limit, self._whole(name))
+        return SimpleNamespace(**values)
+
+    def _whole(self, name: str) -> bool:
+        return self.include is None or self.include.get(name) is True
+
+
+def analyze(template: str) -> Optional[IncludeTree]:
+    """返回模板引用的arg字段的include树；无法确定时（例如直接引用了{arg}）返回None表示需要全部字段"""
+    tree: IncludeTree = {}
+    try:
+        fields = list(_iter_fields(template))
+    except ValueError:
+        return None
+
+    for field in fields:
+        root, _, rest = field.partition(".") if field.startswith("arg.") else (field, "", "")
+        if root != "arg":
+            continue
+        if not rest:
+            return None
+        _merge(tree, _parse_path(rest))
+    return tree
+
+
+def _iter_fields(template: str):
+    for _, field, spec, _ in string.Formatter().parse(template):
+        if field is None:
+            continue
+        yield field
+        if spec and "{" in spec:
+            yield from _iter_fields(spec)
+
+
+def _parse_path(path: str) -> list:
+    """把"doc[title]"解析为["doc", "title"]。
+
+    模型被导出成dict后，只有[key]形式的访问能继续细分；
+    列表下标和其他形式的访问需要保留整个值。
+    """
+    name = re.match(r"[^.\[]+", path).group(0)
+    keys = [name]
+    for attr, key in _ACCESSOR.findall(path[len(name):]):
+        if attr or key.isdigit():
+            break
+        keys.append(key)
+    return keys
+
+
+def _merge(tree: IncludeTree, keys: list) -> None:
+    node = tree
+    for index, key in enumerate(keys):
+        last = index == len(keys) - 1
+        current = node.get(key)
+        if current is True:
+            return
+        if last:
+            node[key] = True
+            return
+        if current is None:
+            current = node[key] = {}
+        node = current
+
+
+def _truncate(value: Any, limit: int, whole: bool) -> Any:
+    if isinstance(value, str):
+        return _truncate_text(value, limit)
+    if whole:
+        # 整个字段被直接渲染时，按渲染后的字符串截断
+        text = str(value)
+        return _truncate_text(text, limit) if len(text) > limit else value
+    # 只引用了字段中的部分内容时，截断其中过长的字符串
+    if isinstance(value, dict):
+        return {key: _truncate(item, limit, False) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_truncate(item, limit, False) for item in value]
+    return value
+
+
+def _truncate_text(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [truncated {len(text) - limit} chars]"
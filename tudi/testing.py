@@ -0,0 +1,173 @@
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Union
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from pydantic import BaseModel, PrivateAttr
+
+
+def count_tokens(text: str) -> int:
+    """粗略的token计数：按空白切分"""
+    return len(text.split())
+
+
+class FakeChatModel(BaseChatModel):
+    """本地假模型，用于在没有真实模型服务时测试和压测。
+
+    可以给定固定的回复列表（循环使用），或者一个根据prompt生成回复的函数；
+    latency可以是固定秒数，也可以是每次调用时返回秒数的函数（用于模拟延迟分布）。
+    """
+
+    responses: List[str] = []
+    respond: Optional[Callable[[str], str]] = None
+    latency: Union[float, Callable[[], float]] = 0.0
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _calls: int = PrivateAttr(default=0)
+    _prompts: List[str] = PrivateAttr(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "tudi-fake"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    @property
+    def prompts(self) -> List[str]:
+        return list(self._prompts)
+
+    def _generate(self,
+                  messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        prompt = self._as_prompt(messages)
+        text = self._next_response(prompt, stop)
+        message = AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self,
+                messages: List[BaseMessage],
+                stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        prompt = self._as_prompt(messages)
+        text = self._next_response(prompt, stop)
+        for token in _split_tokens(text):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema: Any, *, include_raw: bool = False, **kwargs: Any) -> Runnable:
+        """把回复作为JSON解析为schema，只支持Pydantic模型"""
+        if include_raw or not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+            raise NotImplementedError("FakeChatModel only supports structured output with a Pydantic model schema")
+        return self | PydanticOutputParser(pydantic_object=schema)
+
+    def _next_response(self, prompt: str, stop: Optional[List[str]]) -> str:
+        with self._lock:
+            index = self._calls
+            self._calls += 1
+            self._prompts.append(prompt)
+
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+
+        if self.respond:
+            text = self.respond(prompt)
+        elif self.responses:
+            text = self.responses[index % len(self.responses)]
+        else:
+            text = prompt
+
+        return _apply_stop(text, stop)
+
+    def _as_prompt(self, messages: List[BaseMessage]) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+    def _usage(self, prompt: str, text: str) -> dict:
+        input_tokens = count_tokens(prompt)
+        output_tokens = count_tokens(text)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+
+class PrefixCachingChatModel(FakeChatModel):
+    """模拟带前缀缓存（KV cache）的本地模型服务，例如Ollama和llama.cpp。
+
+    服务保留slots个最近请求的token序列，新请求与其中最长的公共前缀部分可以直接复用，
+    只有剩余的token需要重新prefill。消息按角色标记后拼接，再按空白切分为token。
+    """
+
+    slots: int = 1
+
+    _cache: List[List[str]] = PrivateAttr(default_factory=list)
+    _prompt_tokens: int = PrivateAttr(default=0)
+    _reused_tokens: int = PrivateAttr(default=0)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self._prompt_tokens
+
+    @property
+    def reused_tokens(self) -> int:
+        return self._reused_tokens
+
+    @property
+    def reuse_rate(self) -> float:
+        return self._reused_tokens / self._prompt_tokens if self._prompt_tokens else 0.0
+
+    def _as_prompt(self, messages: List[BaseMessage]) -> str:
+        tokens = " ".join(f"<|{message.type}|> {message.content}" for message in messages).split()
+        with self._lock:
+            reused, slot = max(((_common_prefix(tokens, cached), i) for i, cached in enumerate(self._cache)),
+                               default=(0, None))
+            if slot is not None:
+                self._cache.pop(slot)
+            self._cache.append(tokens)
+            del self._cache[:-self.slots]
+            self._prompt_tokens += len(tokens)
+            self._reused_tokens += reused
+        return super()._as_prompt(messages)
+
+
+def _common_prefix(left: List[str], right: List[str]) -> int:
+    length = 0
+    for a, b in zip(left, right):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+def _apply_stop(text: str, stop: Optional[List[str]]) -> str:
+    for word in stop or []:
+        index = text.find(word)
+        if index >= 0:
+            text = text[:index]
+    return text
+
+
+def _split_tokens(text: str) -> List[str]:
+    tokens = []
+    current = ""
+    for char in text:
+        current += char
+        if char.isspace() or char in "{}[],:\"":
+            tokens.append(current)
+            current = ""
+    if current:
+        tokens.append(current)
+    return tokens
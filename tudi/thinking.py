@@ -0,0 +1,152 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from tudi.usage import track_message
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+
+@dataclass(frozen=True)
+class ThinkingBudget:
+    """推理模型的思考预算。
+
+    流式生成时统计<think>中的token数，超过max_tokens就停止生成，
+    把已有的思考内容闭合后作为assistant前缀重新请求，让模型直接给出答案。
+    max_tokens为0时直接在prompt后追加no_think_switch（例如Qwen 3的/no_think）关闭思考。
+    count_tokens默认把流式返回的每个chunk计为一个token。
+    """
+    max_tokens: int
+    no_think_switch: Optional[str] = "/no_think"
+    count_tokens: Optional[Callable[[str], int]] = None
+
+    def __post_init__(self):
+        if self.max_tokens < 0:
+            raise ValueError("max_tokens must not be negative")
+
+
+class ThinkTracker:
+    """逐块跟踪流式输出，区分<think>内外的token"""
+
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None):
+        self._count = count_tokens or (lambda _: 1)
+        self.text = ""
+        self.inside = False
+        self.thinking_tokens = 0
+        self.answer_tokens = 0
+        self._scan_from = 0
+
+    def feed(self, chunk: str) -> None:
+        self.text += chunk
+        was_inside = self.inside
+        toggled = self._update_state()
+        if was_inside or toggled or self.inside:
+            self.thinking_tokens += self._count(chunk)
+        elif chunk.strip():
+            self.answer_tokens += self._count(chunk)
+
+    def _update_state(self) -> bool:
+        toggled = False
+        while True:
+            marker = THINK_END if self.inside else THINK_START
+            index = self.text.find(marker, self._scan_from)
+            if index < 0:
+                # 保留可能被截断的标记前缀
+                self._scan_from = max(self._scan_from, len(self.text) - len(marker))
+                return toggled
+            self.inside = not self.inside
+            self._scan_from = index + len(marker)
+            toggled = True
+
+
+@dataclass
+class ThinkingResult:
+    text: str
+    thinking_tokens: int
+    answer_tokens: int
+    truncated: bool
+
+    def metadata(self) -> dict:
+        return {
+            "thinking_tokens": self.thinking_tokens,
+            "answer_tokens": self.answer_tokens,
+            "thinking_truncated": self.truncated,
+        }
+
+
+def generate(model: BaseChatModel, prompt: str, budget: ThinkingBudget) -> ThinkingResult:
+    if budget.max_tokens == 0 and budget.no_think_switch:
+        return _count_result(_invoke(model, [HumanMessage(f"{prompt}\n{budget.no_think_switch}")]), budget)
+
+    tracker = ThinkTracker(budget.count_tokens)
+    truncated = False
+    for chunk in model.stream(prompt):
+        tracker.feed(str(chunk.content))
+        if tracker.inside and tracker.thinking_tokens >= budget.max_tokens:
+            truncated = True
+            break
+    track_message(AIMessage(tracker.text), prompt)
+
+    if not truncated:
+        return ThinkingResult(tracker.text, tracker.thinking_tokens, tracker.answer_tokens, False)
+
+    answer = _invoke(model, _closed_thinking(prompt, tracker.text))
+    return _continued_result(tracker, answer, budget)
+
+
+async def agenerate(model: BaseChatModel, prompt: str, budget: ThinkingBudget) -> ThinkingResult:
+    if budget.max_tokens == 0 and budget.no_think_switch:
+        message = await _ainvoke(model, [HumanMessage(f"{prompt}\n{budget.no_think_switch}")])
+        return _count_result(message, budget)
+
+    tracker = ThinkTracker(budget.count_tokens)
+    truncated = False
+    async for chunk in model.astream(prompt):
+        tracker.feed(str(chunk.content))
+        if tracker.inside and tracker.thinking_tokens >= budget.max_tokens:
+            truncated = True
+            break
+    track_message(AIMessage(tracker.text), prompt)
+
+    if not truncated:
+        return ThinkingResult(tracker.text, tracker.thinking_tokens, tracker.answer_tokens, False)
+
+    answer = await _ainvoke(model, _closed_thinking(prompt, tracker.text))
+    return _continued_result(tracker, answer, budget)
+
+
+def _closed_thinking(prompt: str, partial: str) -> List[BaseMessage]:
+    return [HumanMessage(prompt), AIMessage(f"{partial.rstrip()}\n{THINK_END}\n\n")]
+
+
+def _continued_result(tracker: ThinkTracker, answer: str, budget: ThinkingBudget) -> ThinkingResult:
+    # 续写的内容里如果又出现了思考，也计入思考token
+    continuation = _track_text(answer, budget)
+    return ThinkingResult(answer, tracker.thinking_tokens + continuation.thinking_tokens,
+                          continuation.answer_tokens, True)
+
+
+def _count_result(text: str, budget: ThinkingBudget) -> ThinkingResult:
+    tracker = _track_text(text, budget)
+    return ThinkingResult(text, tracker.thinking_tokens, tracker.answer_tokens, False)
+
+
+def _track_text(text: str, budget: ThinkingBudget) -> ThinkTracker:
+    """非流式得到的文本按词切分后逐块统计"""
+    tracker = ThinkTracker(budget.count_tokens)
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        tracker.feed(piece)
+    return tracker
+
+
+def _invoke(model: BaseChatModel, messages: List[BaseMessage]) -> str:
+    return str(track_message(model.invoke(messages), messages).content)
+
+
+async def _ainvoke(model: BaseChatModel, messages: List[BaseMessage]) -> str:
+    return str(track_message(await model.ainvoke(messages), messages).content)
+
@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Coroutine, Optional
+
+from langchain_core.tools import BaseTool
+
+from tudi import metrics
+
+# 只有超时限制的工具最多使用的线程数；设置了max_concurrency时使用max_concurrency个线程
+TOOL_THREADS = 32
+
+_LIMITS_KEY = "tudi_tool_limits"
+
+
+class ToolTimeoutError(TimeoutError):
+    pass
+
+
+class ToolLimits:
+    """单个工具的执行限制：timeout是每次调用的最长时间（包括等待并发名额的时间），
+    max_concurrency是所有Agent同时执行该工具的调用数上限。
+
+    需要在线程中执行时使用该工具自己的线程池，并且先取得并发名额再提交：
+    超时后仍在执行的调用只占用这个工具的线程和名额，不影响其他工具。
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_concurrency: Optional[int] = None):
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def run(self, name: str, call: Callable[[], Any]) -> Any:
+        """同步执行；有超时时在线程池中执行，超时后调用方不再等待，已经开始的调用在后台执行完后才释放名额"""
+        if self.timeout is None:
+            self._acquire(name, None)
+            try:
+                return call()
+            finally:
+                self._release()
+
+        deadline = time.monotonic() + self.timeout
+        self._acquire(name, deadline)
+        future = self._submit(call)
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            raise self._timeout(name) from None
+
+    async def arun(self, name: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """执行协程工具，超时时取消该协程"""
+        try:
+            return await asyncio.wait_for(self._arun(name, call), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout(name) from None
+
+    async def arun_sync(self, name: str, call: Callable[[], Any]) -> Any:
+        """在线程池中执行同步工具，不阻塞事件循环"""
+        try:
+            return await asyncio.wait_for(self._arun_sync(call), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout(name) from None
+
+    async def _arun(self, name: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        await self._aacquire()
+        try:
+            return await call()
+        finally:
+            self._release()
+
+    async def _arun_sync(self, call: Callable[[], Any]) -> Any:
+        await self._aacquire()
+        # 取消等待时，还没有开始的调用随之取消；名额在调用结束（或被取消）时释放
+        return await asyncio.wrap_future(self._submit(call))
+
+    def _submit(self, call: Callable[[], Any]) -> Future:
+        """提交已经取得名额的调用"""
+        try:
+            future = self._pool().submit(contextvars.copy_context().run, call)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency or TOOL_THREADS,
+                                                    thread_name_prefix="tudi-tool")
+            return self._executor
+
+    async def _aacquire(self) -> None:
+        if self._semaphore is None:
+            return
+        # 轮询获取名额，等待可以随时被取消，不会占用线程
+        delay = 0.001
+        while not self._semaphore.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def _acquire(self, name: str, deadline: Optional[float]) -> None:
+        if self._semaphore is None:
+            return
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        if not self._semaphore.acquire(timeout=timeout):
+            raise self._timeout(name)
+
+    def _release(self) -> None:
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def _timeout(self, name: str) -> ToolTimeoutError:
+        metrics.registry.inc(metrics.TOOL_TIMEOUTS, agent=metrics.current_agent(), tool=name)
+        return ToolTimeoutError(f"Tool {name} timed out after {self.timeout:g} seconds")
+
+
+def limit_tool(tool: BaseTool, timeout: Optional[float] = None, max_concurrency: Optional[int] = None) -> BaseTool:
+    """在工具上配置超时和并发上限，返回同一个工具，例如limit_tool(query_orders, timeout=5, max_concurrency=4)"""
+    tool.metadata = {**(tool.metadata or {}), _LIMITS_KEY: ToolLimits(timeout, max_concurrency)}
+    return tool
+
+
+def tool_limits(tool: Optional[BaseTool]) -> Optional[ToolLimits]:
+    if tool is None or not tool.metadata:
+        return None
+    return tool.metadata.get(_LIMITS_KEY)
+
+
+def is_async_tool(tool: BaseTool) -> bool:
+    """工具是否有原生的协程实现；@tool生成的工具只有传入了协程函数时才是，它们的_arun会把同步函数放到线程中执行"""
+    if hasattr(tool, "coroutine"):
+        return tool.coroutine is not None
+    return type(tool)._arun is not BaseTool._arun
+
+
+def is_async_only_tool(tool: BaseTool) -> bool:
+    """只有协程实现的工具，例如@tool装饰的async函数"""
+    return getattr(tool, "coroutine", None) is not None and getattr(tool, "func", None) is None
+
+
+def call_tool(tool: BaseTool, call: Callable[[], Any], acall: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
+    """按工具的限制同步执行call；只有协程实现的工具用asyncio.run执行acall"""
+    run = (lambda: asyncio.run(acall())) if is_async_only_tool(tool) else call
+    limits = tool_limits(tool)
+    return run() if limits is None else limits.run(tool.name, run)
+
+
+async def acall_tool(tool: BaseTool, call: Callable[[], Any], acall: Callable[[], Awaitable[Any]]) -> Any:
+    """异步执行：协程工具直接await acall；同步工具在线程中执行call，
+    有限制的工具使用自己的线程池，没有限制的工具使用事件循环默认的线程池"""
+    limits = tool_limits(tool)
+    if is_async_tool(tool):
+        return await acall() if limits is None else await limits.arun(tool.name, acall)
+    if limits is None:
+        return await asyncio.to_thread(call)
+    return await limits.arun_sync(tool.name, call)
+
@@ -0,0 +1,288 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.agents import AgentAction
+
+from tudi import metrics
+
+# 作为参数槽位的值至少需要的长度，过短的值（例如"1"）容易在文本中误匹配
+MIN_SLOT_CHARS = 2
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+Step = Tuple[AgentAction, str]
+
+
+class TrajectoryMismatchError(Exception):
+    """回放的计划与当前请求不符，需要回到完整的ReAct循环"""
+
+
+@dataclass
+class TrajectoryStats:
+    hits: int = 0
+    misses: int = 0
+    fallbacks: int = 0
+    recorded: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def fallback_rate(self) -> float:
+        return self.fallbacks / self.hits if self.hits else 0.0
+
+
+@dataclass(frozen=True)
+class _Slot:
+    """工具参数中随请求变化的值，回放时取请求或前面步骤观察结果中名为group的捕获组，并转换为kind"""
+    group: str
+    kind: type
+
+
+@dataclass(frozen=True)
+class _PlannedStep:
+    tool: str
+    tool_input: Any
+    observation: Optional[re.Pattern]
+
+
+class TrajectoryPlan:
+    """一次成功的工具调用序列，参数中的值被替换为槽位。
+
+    请求中出现的参数值变成请求模板中的捕获组；来自前面步骤观察结果的值（例如先查询天气再按温度查询穿衣建议）
+    在该观察结果的模板中捕获。回放时任何一个模板不匹配或者参数无法转换都会抛出TrajectoryMismatchError。
+    """
+
+    def __init__(self, request: re.Pattern, steps: Sequence[_PlannedStep]):
+        self.request = request
+        self.steps = list(steps)
+
+    def run(self, match: re.Match, call_tool: Callable[[str, Any], Any]) -> List[Step]:
+        values: Dict[str, str] = match.groupdict()
+        steps: List[Step] = []
+        for index, planned in enumerate(self.steps):
+            tool_input = _fill(planned.tool_input, values)
+            observation = call_tool(planned.tool, tool_input)
+            steps.append((_action(planned.tool, tool_input), observation))
+            values.update(_capture(planned.observation, observation, index))
+        return steps
+
+    async def arun(self, match: re.Match, call_tool: Callable[[str, Any], Awaitable[Any]]) -> List[Step]:
+        values: Dict[str, str] = match.groupdict()
+        steps: List[Step] = []
+        for index, planned in enumerate(self.steps):
+            tool_input = _fill(planned.tool_input, values)
+            observation = await call_tool(planned.tool, tool_input)
+            steps.append((_action(planned.tool, tool_input), observation))
+            values.update(_capture(planned.observation, observation, index))
+        return steps
+
+
+class TrajectoryCache:
+    """工具Agent的轨迹缓存：记录成功的工具调用计划，参数不同但结构相同的请求直接回放计划，
+    只调用一次模型生成最终答案。
+
+    请求模板由请求文本中作为完整词出现的工具参数值泛化得到，例如"weather in Beijing"记录为"weather in (\\S+?)"；
+    参数中有无法从请求或观察结果推导的字符串时不记录。回放失败（模板不匹配、工具出错）时回到完整的循环，并丢弃该计划。
+    """
+
+    def __init__(self, max_entries: int = 256):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._plans: OrderedDict[Tuple[str, str], TrajectoryPlan] = OrderedDict()
+        self._stats: Dict[str, TrajectoryStats] = {}
+
+    def lookup(self, scope: str, request: str) -> Optional[Tuple[TrajectoryPlan, re.Match]]:
+        with self._lock:
+            for key in reversed(self._plans):
+                if key[0] != scope:
+                    continue
+                plan = self._plans[key]
+                match = plan.request.fullmatch(request)
+                if match is not None:
+                    self._plans.move_to_end(key)
+                    self._count(scope, "hit")
+                    return plan, match
+            self._count(scope, "miss")
+            return None
+
+    def record(self, scope: str, request: str, steps: Sequence[Step]) -> Optional[TrajectoryPlan]:
+        """记录一次成功运行的工具调用；没有调用工具或者参数无法从请求推导时不记录"""
+        if not steps:
+            return None
+
+        plan = build_plan(request, steps)
+        if plan is None:
+            return None
+        with self._lock:
+            key = (scope, plan.request.pattern)
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+            self._stats_for(scope).recorded += 1
+        return plan
+
+    def fallback(self, scope: str, plan: TrajectoryPlan) -> None:
+        """回放失败：丢弃计划，下一次成功的完整运行会重新记录"""
+        with self._lock:
+            self._plans.pop((scope, plan.request.pattern), None)
+            self._count(scope, "fallback")
+
+    def stats(self, scope: Optional[str] = None) -> TrajectoryStats:
+        with self._lock:
+            if scope is not None:
+                return TrajectoryStats(**vars(self._stats_for(scope)))
+            total = TrajectoryStats()
+            for stats in self._stats.values():
+                for name, value in vars(stats).items():
+                    setattr(total, name, getattr(total, name) + value)
+            return total
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def _stats_for(self, scope: str) -> TrajectoryStats:
+        return self._stats.setdefault(scope, TrajectoryStats())
+
+    def _count(self, scope: str, outcome: str) -> None:
+        stats = self._stats_for(scope)
+        if outcome == "hit":
+            stats.hits += 1
+        elif outcome == "miss":
+            stats.misses += 1
+        else:
+            stats.fallbacks += 1
+        metrics.registry.inc(metrics.TRAJECTORY_CACHE, agent=scope, outcome=outcome)
+
+
+def build_plan(request: str, steps: Sequence[Step]) -> Optional[TrajectoryPlan]:
+    """由一次成功的运行生成计划；字符串参数既不在请求中也不在前面的观察结果中时
+    （例如模型由"tomorrow"推算出的日期、由"euros"换算出的"EUR"），回放会使用过期的值，返回None"""
+    request_groups: Dict[str, str] = {}
+    observation_groups: List[Dict[str, str]] = [{} for _ in steps]
+    underivable: List[Any] = []
+
+    def slot(value: Any, index: int) -> Any:
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return value
+        text = str(value)
+        if len(text.strip()) < MIN_SLOT_CHARS:
+            if isinstance(value, str) and text.strip() and not _find(request, text):
+                underivable.append(value)
+            return value
+        if _find(request, text):
+            group = request_groups.setdefault(text.lower(), f"r{len(request_groups)}")
+            return _Slot(group, type(value))
+        # 来自前面步骤观察结果的值，从最近的步骤开始查找
+        for source in range(index - 1, -1, -1):
+            if _find(str(steps[source][1]), text):
+                groups = observation_groups[source]
+                group = groups.setdefault(text.lower(), f"o{source}_{len(groups)}")
+                return _Slot(group, type(value))
+        if isinstance(value, str):
+            underivable.append(value)
+        return value
+
+    planned_inputs = [_map_leaves(action.tool_input, lambda value, i=index: slot(value, i))
+                      for index, (action, _) in enumerate(steps)]
+    if underivable:
+        return None
+    request_values = list(request_groups)
+    planned = [
+        _PlannedStep(action.tool, planned_inputs[index],
+                     _template(str(observation), observation_groups[index], request_values)
+                     if observation_groups[index] else None)
+        for index, (action, observation) in enumerate(steps)
+    ]
+    return TrajectoryPlan(_template(request, request_groups), planned)
+
+
+def _template(text: str, groups: Dict[str, str], generalize: Sequence[str] = ()) -> re.Pattern:
+    """把text中作为完整词出现的值替换为命名捕获组，generalize中的值替换为同样形状的任意文本，其余部分按字面匹配。
+
+    捕获组只匹配与记录的值形状相同的文本（同样的词数，数字只匹配数字），
+    例如由"Beijing"得到的槽位不会匹配"Shanghai and Paris"。
+    """
+    values = sorted({*groups, *generalize}, key=len, reverse=True)
+    if not values:
+        return re.compile(re.escape(text), re.DOTALL)
+
+    finder = re.compile("|".join(_word(value) for value in values), re.IGNORECASE)
+    parts = []
+    seen = set()
+    position = 0
+    for found in finder.finditer(text):
+        parts.append(re.escape(text[position:found.start()]))
+        group = groups.get(found.group(0).lower())
+        if group is None:
+            parts.append(_shape(found.group(0)))
+        elif group in seen:
+            parts.append(f"(?P={group})")
+        else:
+            seen.add(group)
+            parts.append(f"(?P<{group}>{_shape(found.group(0))})")
+        position = found.end()
+    parts.append(re.escape(text[position:]))
+    return re.compile("".join(parts), re.DOTALL | re.IGNORECASE)
+
+
+def _find(text: str, value: str) -> bool:
+    return re.search(_word(value), text, re.IGNORECASE) is not None
+
+
+def _word(value: str) -> str:
+    """只匹配完整的词，"EUR"不匹配"euros"中的一部分"""
+    return rf"(?<!\w){re.escape(value)}(?!\w)"
+
+
+def _shape(value: str) -> str:
+    if _NUMBER.fullmatch(value):
+        return _NUMBER.pattern
+    words = value.split()
+    return r"(?<!\w)\S+?" + r"(?:\s+\S+?)" * (len(words) - 1) + r"(?!\w)"
+
+
+def _map_leaves(value: Any, fn: Callable[[Any], Any]) -> Any:
+    if isinstance(value, dict):
+        return {key: _map_leaves(item, fn) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_map_leaves(item, fn) for item in value]
+    return fn(value)
+
+
+def _fill(value: Any, values: Dict[str, str]) -> Any:
+    def resolve(leaf: Any) -> Any:
+        if not isinstance(leaf, _Slot):
+            return leaf
+        if values.get(leaf.group) is None:
+            raise TrajectoryMismatchError(f"No value for {leaf.group}")
+        try:
+            return leaf.kind(values[leaf.group].strip())
+        except ValueError as e:
+            raise TrajectoryMismatchError(str(e)) from e
+
+    return _map_leaves(value, resolve)
+
+
+def _capture(pattern: Optional[re.Pattern], observation: Any, index: int) -> Dict[str, str]:
+    if pattern is None:
+        return {}
+    match = pattern.fullmatch(str(observation))
+    if match is None:
+        raise TrajectoryMismatchError(f"Observation of step {index} does not match the recorded plan")
+    return match.groupdict()
+
+
+def _action(tool: str, tool_input: Any) -> AgentAction:
+    blob = json.dumps({"action": tool, "action_input": tool_input}, ensure_ascii=False)
+    return AgentAction(tool=tool, tool_input=tool_input, log=f"Action:\n```\n{blob}\n```")
@@ -0,0 +1,124 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.messages import BaseMessage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+
+Prompt = Union[PromptValue, str, List[BaseMessage], None]
+
+
+@dataclass
+class UsageTracker:
+    """累计模型调用的次数和token数；模型没有返回usage时按字符数估算"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def observe(self, message: BaseMessage, prompt: Prompt = None) -> None:
+        """记录一次模型调用，prompt只在模型没有返回usage时用于估算"""
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        else:
+            prompt_tokens = estimate_tokens(_prompt_text(prompt))
+            completion_tokens = estimate_tokens(str(message.content))
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+_trackers: ContextVar[Tuple[UsageTracker, ...]] = ContextVar("tudi_usage_trackers", default=())
+
+
+@contextmanager
+def usage_scope(tracker: Optional[UsageTracker] = None) -> Iterator[UsageTracker]:
+    """在当前上下文中登记一个UsageTracker，作用域内经过track_message/tracked的模型调用都会被记录"""
+    tracker = tracker or UsageTracker()
+    token = _trackers.set((*_trackers.get(), tracker))
+    try:
+        yield tracker
+    finally:
+        _trackers.reset(token)
+
+
+def track_message(message: BaseMessage, prompt: Prompt = None) -> BaseMessage:
+    """记录一次模型调用：同一次调用的prompt和回复一起传入，并发的调用之间不共享状态"""
+    for tracker in _trackers.get():
+        tracker.observe(message, prompt)
+    return message
+
+
+def tracked(model: Runnable) -> Runnable:
+    """包装链中的模型调用，每次调用的prompt和回复成对记录，例如prompt | tracked(model) | parser"""
+    return _Tracked(model)
+
+
+class _Tracked(Runnable):
+    """保留模型自己的stream和batch实现：流式调用在结束时记录合并后的回复，批量调用逐个记录成功的回复"""
+
+    def __init__(self, model: Runnable):
+        self.model = model
+
+    def invoke(self, input: Prompt, config: Optional[RunnableConfig] = None, **kwargs: Any) -> BaseMessage:
+        return track_message(self.model.invoke(input, config, **kwargs), input)
+
+    async def ainvoke(self, input: Prompt, config: Optional[RunnableConfig] = None, **kwargs: Any) -> BaseMessage:
+        return track_message(await self.model.ainvoke(input, config, **kwargs), input)
+
+    def stream(self, input: Prompt, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        message = None
+        for chunk in self.model.stream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+            yield chunk
+        if message is not None:
+            track_message(message, input)
+
+    async def astream(self, input: Prompt, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> AsyncIterator[Any]:
+        message = None
+        async for chunk in self.model.astream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+            yield chunk
+        if message is not None:
+            track_message(message, input)
+
+    def batch(self, inputs: List[Prompt], config: Any = None, *, return_exceptions: bool = False,
+              **kwargs: Any) -> List[Any]:
+        messages = self.model.batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+        return _track_batch(inputs, messages)
+
+    async def abatch(self, inputs: List[Prompt], config: Any = None, *, return_exceptions: bool = False,
+                     **kwargs: Any) -> List[Any]:
+        messages = await self.model.abatch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+        return _track_batch(inputs, messages)
+
+
+def _track_batch(prompts: List[Prompt], messages: List[Any]) -> List[Any]:
+    for prompt, message in zip(prompts, messages, strict=True):
+        if isinstance(message, BaseMessage):
+            track_message(message, prompt)
+    return messages
+
+
+def _prompt_text(prompt: Prompt) -> str:
+    if prompt is None:
+        return ""
+    if isinstance(prompt, PromptValue):
+        return prompt.to_string()
+    if isinstance(prompt, list):
+        return "\n".join(str(message.content) for message in prompt)
+    return str(prompt)
@@ -0,0 +1,72 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from tudi.cascade import model_name
+
+logger = logging.getLogger(__name__)
+
+# 不同模型集成中限制生成长度的字段：Ollama、OpenAI兼容接口、HuggingFace
+_MAX_TOKEN_FIELDS = ("num_predict", "max_tokens", "max_new_tokens")
+
+
+@dataclass
+class ModelWarmup:
+    """一个模型的预热结果，失败时error是异常信息"""
+    model: str
+    seconds: float
+    error: Optional[str] = None
+
+
+def minimal_model(model: BaseChatModel, keep_alive: Union[str, int, None] = None) -> BaseChatModel:
+    """返回只生成一个token的模型副本，用于预热和预填充；不支持限制长度的模型原样返回。
+
+    keep_alive是模型服务保留模型的时间（Ollama的keep_alive），只在模型支持时设置。
+    """
+    fields = type(model).model_fields
+    update = {}
+    bound = getattr(model, "bound", None)
+    if isinstance(bound, BaseChatModel):
+        # 包装其他模型的模型（例如ScheduledChatModel），限制被包装的模型
+        update["bound"] = minimal_model(bound, keep_alive)
+    else:
+        name = next((name for name in _MAX_TOKEN_FIELDS if name in fields), None)
+        if name:
+            update[name] = 1
+        if keep_alive is not None and "keep_alive" in fields:
+            update["keep_alive"] = keep_alive
+    return model.model_copy(update=update) if update else model
+
+
+def prefill(model: BaseChatModel, messages: List[BaseMessage]) -> None:
+    """把不变的prompt前缀发送给模型服务，让其提前计算并缓存这部分的KV"""
+    if messages:
+        minimal_model(model).invoke(messages)
+
+
+def warmup_models(models: Iterable[BaseChatModel],
+                  keep_alive: Union[str, int, None] = None,
+                  max_workers: Optional[int] = None) -> List[ModelWarmup]:
+    """并发地对每个不同的模型发起一次只生成一个token的调用，让模型服务提前加载模型"""
+    distinct = list({id(model): model for model in models}.values())
+    if not distinct:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(distinct), thread_name_prefix="tudi-warmup") as pool:
+        return list(pool.map(lambda model: _warmup(model, keep_alive), distinct))
+
+
+def _warmup(model: BaseChatModel, keep_alive: Union[str, int, None]) -> ModelWarmup:
+    started = time.perf_counter()
+    error = None
+    try:
+        minimal_model(model, keep_alive).invoke([HumanMessage("ping")])
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logger.warning("Warmup of %s failed: %s", model_name(model), error)
+    return ModelWarmup(model_name(model), time.perf_counter() - started, error)